@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control cho sentiment service
+Giới hạn số request được chạy model đồng thời theo hai lane (interactive, background) với hàng đợi có giới hạn,
+bỏ sớm request đã quá deadline và từ chối nhanh (429/503 kèm Retry-After) khi quá tải
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+
+class Rejected(Exception):
+    """Request không được nhận: status HTTP, lý do và số giây nên chờ trước khi gửi lại"""
+
+    def __init__(self, status: int, reason: str, retry_after: Optional[int] = None):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Slot chạy model dùng chung cho hai lane
+
+    - Lane background chỉ dùng tối đa background_share số slot, luôn còn slot cho request interactive
+    - Khi có slot trống, request interactive đang chờ được nhận trước request background
+    - Mỗi lane có hàng đợi giới hạn; hàng đợi đầy thì từ chối ngay (interactive 503, background 429)
+    - Request chỉ chờ tới deadline của nó (hoặc max_queue_wait), quá deadline thì bị bỏ với 504
+    """
+
+    # Status khi lane quá tải: 503 cho load balancer biết instance đang quá tải,
+    # 429 để job background giãn ra thay vì retry ngay
+    SATURATED_STATUS = {INTERACTIVE: 503, BACKGROUND: 429}
+
+    def __init__(
+        self,
+        max_concurrent: int = 8,
+        max_queue_interactive: int = 16,
+        max_queue_background: int = 8,
+        background_share: float = 0.5,
+        max_queue_wait: float = 5.0,
+    ):
+        """
+        Initialize Admission Controller
+
+        Args:
+            max_concurrent: Số request chạy model đồng thời tối đa trong process
+            max_queue_interactive: Số request interactive chờ slot tối đa
+            max_queue_background: Số request background chờ slot tối đa
+            background_share: Tỉ lệ slot tối đa lane background được dùng
+            max_queue_wait: Thời gian chờ slot tối đa (giây) khi request không có deadline
+        """
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent phải >= 1")
+
+        self.max_concurrent = max_concurrent
+        self.max_queue = {INTERACTIVE: max_queue_interactive, BACKGROUND: max_queue_background}
+        self.background_limit = max(1, int(max_concurrent * background_share))
+        self.max_queue_wait = max_queue_wait
+
+        self._cond = threading.Condition()
+        self._active = {lane: 0 for lane in LANES}
+        self._waiting: Dict[str, deque] = {lane: deque() for lane in LANES}
+        # EWMA thời gian giữ slot, dùng để ước lượng Retry-After
+        self._hold_seconds = 0.1
+        self.counts = {lane: {"admitted": 0, "queue_full": 0, "queue_timeout": 0, "deadline_exceeded": 0} for lane in LANES}
+
+    def _has_slot(self, lane: str) -> bool:
+        if sum(self._active.values()) >= self.max_concurrent:
+            return False
+        return lane == INTERACTIVE or self._active[BACKGROUND] < self.background_limit
+
+    def _is_next(self, lane: str, ticket: object) -> bool:
+        """Ticket đứng đầu lane và (với background) không còn request interactive nào chờ"""
+        if self._waiting[lane][0] is not ticket:
+            return False
+        return lane == INTERACTIVE or not self._waiting[INTERACTIVE]
+
+    def retry_after(self, lane: str) -> int:
+        """Ước lượng số giây tới khi hàng đợi của lane vơi đi"""
+        with self._cond:
+            queued = len(self._waiting[lane]) + (len(self._waiting[INTERACTIVE]) if lane == BACKGROUND else 0)
+            slots = self.max_concurrent if lane == INTERACTIVE else self.background_limit
+            return self._retry_after(queued, slots)
+
+    def _retry_after(self, queued: int, slots: int) -> int:
+        return min(max(1, math.ceil(self._hold_seconds * (queued + 1) / slots)), 30)
+
+    def _reject(self, lane: str, outcome: str, status: int, retry: bool) -> Rejected:
+        self.counts[lane][outcome] += 1
+        retry_after = None
+        if retry:
+            queued = len(self._waiting[lane])
+            slots = self.max_concurrent if lane == INTERACTIVE else self.background_limit
+            retry_after = self._retry_after(queued, slots)
+        return Rejected(status, outcome, retry_after)
+
+    def acquire(self, lane: str, deadline: Optional[float] = None):
+        """
+        Chờ slot cho request
+
+        Args:
+            lane: INTERACTIVE hoặc BACKGROUND
+            deadline: time.monotonic() mà sau đó kết quả không còn cần nữa
+
+        Raises:
+            Rejected: Hàng đợi đầy, chờ quá lâu hoặc quá deadline
+        """
+        now = time.monotonic()
+        with self._cond:
+            if deadline is not None and deadline <= now:
+                raise self._reject(lane, "deadline_exceeded", 504, retry=False)
+
+            if not self._waiting[INTERACTIVE] and (lane == INTERACTIVE or not self._waiting[BACKGROUND]) and self._has_slot(lane):
+                self._active[lane] += 1
+                self.counts[lane]["admitted"] += 1
+                return
+
+            if len(self._waiting[lane]) >= self.max_queue[lane]:
+                raise self._reject(lane, "queue_full", self.SATURATED_STATUS[lane], retry=True)
+
+            ticket = object()
+            self._waiting[lane].append(ticket)
+            wait_until = now + self.max_queue_wait
+            if deadline is not None:
+                wait_until = min(wait_until, deadline)
+            try:
+                while not (self._is_next(lane, ticket) and self._has_slot(lane)):
+                    remaining = wait_until - time.monotonic()
+                    if remaining <= 0:
+                        if deadline is not None and deadline <= time.monotonic():
+                            raise self._reject(lane, "deadline_exceeded", 504, retry=False)
+                        raise self._reject(lane, "queue_timeout", self.SATURATED_STATUS[lane], retry=True)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting[lane].remove(ticket)
+                # Request tiếp theo có thể đã được phép chạy khi ticket này rời hàng đợi
+                self._cond.notify_all()
+
+            self._active[lane] += 1
+            self.counts[lane]["admitted"] += 1
+
+    def release(self, lane: str, held_seconds: float):
+        with self._cond:
+            self._active[lane] -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, lane: str, deadline: Optional[float] = None):
+        """Giữ một slot trong suốt khối with"""
+        self.acquire(lane, deadline)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(lane, time.monotonic() - start)
+
+    def waiting(self, lane: str) -> int:
+        with self._cond:
+            return len(self._waiting[lane])
+
+    def active(self, lane: str) -> int:
+        with self._cond:
+            return self._active[lane]
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "background_limit": self.background_limit,
+                "avg_hold_ms": round(self._hold_seconds * 1000, 2),
+                "lanes": {
+                    lane: {
+                        "active": self._active[lane],
+                        "waiting": len(self._waiting[lane]),
+                        "max_queue": self.max_queue[lane],
+                        **self.counts[lane],
+                    }
+                    for lane in LANES
+                },
+            }
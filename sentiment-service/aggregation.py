@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregation cho batch sentiment
+Gộp ma trận scores (N, 7) thành một phân phối cảm xúc duy nhất
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+EMOTION_LABELS = ["enjoyment", "sadness", "anger", "fear", "disgust", "surprise", "other"]
+NUM_EMOTIONS = len(EMOTION_LABELS)
+
+STRATEGIES = ("mean", "confidence", "recency", "majority")
+
+
+def scores_matrix(rows) -> np.ndarray:
+    """Chuyển list các hàng 7 scores (0-1) thành ma trận (N, 7) float32"""
+    matrix = np.asarray(rows, dtype=np.float32)
+    return matrix.reshape(-1, NUM_EMOTIONS)
+
+
+def percentages_matrix(results: List[Dict]) -> np.ndarray:
+    """Chuyển kết quả phần trăm của AIBatchProcessor thành ma trận (N, 7) trong khoảng 0-1"""
+    return scores_matrix([[result[emotion] for emotion in EMOTION_LABELS] for result in results]) / 100.0
+
+
+def _weighted_mean(matrix: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    total = weights.sum()
+    if total <= 0:
+        return matrix.mean(axis=0)
+    return weights @ matrix / total
+
+
+def aggregate(matrix: np.ndarray, strategy: str = "mean", half_life: Optional[float] = None) -> np.ndarray:
+    """
+    Gộp ma trận scores thành một vector 7 scores
+
+    Args:
+        matrix: Ma trận (N, 7), mỗi hàng là phân phối cảm xúc của một text
+        strategy: "mean", "confidence" (trọng số theo confidence từng text),
+            "recency" (text sau nặng hơn, cho cửa sổ hội thoại) hoặc "majority" (tỉ lệ phiếu theo argmax)
+        half_life: Số text để trọng số recency giảm một nửa, mặc định N / 4
+
+    Returns:
+        Vector (7,) tổng bằng 1
+    """
+    if matrix.ndim != 2 or matrix.shape[1] != NUM_EMOTIONS or matrix.shape[0] == 0:
+        raise ValueError(f"Score matrix phải có shape (N, {NUM_EMOTIONS}) với N > 0")
+
+    n = matrix.shape[0]
+    if strategy == "mean":
+        return matrix.mean(axis=0)
+
+    if strategy == "confidence":
+        return _weighted_mean(matrix, matrix.max(axis=1))
+
+    if strategy == "recency":
+        half_life = half_life if half_life and half_life > 0 else max(n / 4.0, 1.0)
+        age = np.arange(n - 1, -1, -1, dtype=np.float32)
+        return _weighted_mean(matrix, np.power(0.5, age / half_life, dtype=np.float32))
+
+    if strategy == "majority":
+        votes = np.bincount(matrix.argmax(axis=1), minlength=NUM_EMOTIONS).astype(np.float32)
+        # Hòa phiếu thì cảm xúc có mean score cao hơn thắng
+        return (votes + matrix.mean(axis=0) * 1e-3) / (n + 1e-3)
+
+    raise ValueError(f"Aggregation strategy {strategy} không được hỗ trợ. Chọn: {list(STRATEGIES)}")
+
+
+def combine_chunks(matrix: np.ndarray, starts: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Gộp scores các đoạn thành scores từng text, trọng số theo số token của đoạn
+
+    Args:
+        matrix: Ma trận (M, 7) scores của M đoạn
+        starts: (N + 1,) index đoạn đầu tiên của từng text, starts[-1] = M
+        weights: (M,) số token của từng đoạn
+
+    Returns:
+        Ma trận (N, 7)
+    """
+    if matrix.shape[0] == starts.shape[0] - 1:
+        return matrix
+    sums = np.add.reduceat(matrix * weights[:, None], starts[:-1], axis=0)
+    totals = np.add.reduceat(weights, starts[:-1])
+    return (sums / totals[:, None]).astype(np.float32)
+
+
+def summarize(aggregated: np.ndarray) -> Dict:
+    """Tạo các field response từ vector đã gộp"""
+    max_idx = int(aggregated.argmax())
+    scores = [round(float(score), 4) for score in aggregated]
+    return {
+        "emotion_class": max_idx,
+        "emotion": EMOTION_LABELS[max_idx],
+        "confidence": scores[max_idx],
+        "scores": scores,
+        "percentages": {emotion: round(float(score) * 100, 2) for emotion, score in zip(EMOTION_LABELS, aggregated)},
+    }
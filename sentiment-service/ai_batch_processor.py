@@ -3,16 +3,57 @@
 AI Batch Processor for Sentiment Analysis
 Sử dụng LLM (Cerebras/Groq) để phân tích nhiều văn bản cùng lúc
 """
+import asyncio
 import json
+import logging
+import os
+import random
 import re
-from typing import List, Dict, Optional
-from openai import OpenAI
+import threading
+from typing import Any, Awaitable, Callable, List, Dict, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import FALLBACKS, LLM_CALL_SECONDS, LLM_IN_FLIGHT
+
+
+logger = logging.getLogger(__name__)
+
+
+class _LoopThread:
+    """Event loop chạy trong background thread, dùng chung cho tất cả Flask worker threads"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Lấy event loop, khởi động lại nếu process đã fork"""
+        pid = os.getpid()
+        if self._loop is not None and self._pid == pid:
+            return self._loop
+
+        with self._lock:
+            if self._loop is None or self._pid != pid:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="ai-batch-loop", daemon=True)
+                thread.start()
+                self._loop = loop
+                self._pid = pid
+        return self._loop
+
+    def run(self, coro: Awaitable) -> Any:
+        """Chạy coroutine trên loop và chờ kết quả từ thread hiện tại"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop()).result()
+
 
 class AIBatchProcessor:
     """Xử lý batch sentiment analysis với AI"""
-    
+
     # Danh sách các API providers
     PROVIDERS = {
         "cerebras": {
@@ -21,40 +62,123 @@ class AIBatchProcessor:
             "model": "gpt-oss-120b"
         },
     }
-    
-    def __init__(self, provider: str = "cerebras", max_workers: int = 5):
+
+    EMOTION_KEYS = ("enjoyment", "sadness", "anger", "fear", "disgust", "surprise", "other")
+
+    # Ước lượng token cho prompt packing (tiếng Việt có dấu: ~3 bytes UTF-8 mỗi token)
+    BYTES_PER_TOKEN = 3
+    PROMPT_TOKENS_PER_ITEM = 4  # Số thứ tự và xuống dòng
+    RESPONSE_TOKENS_PER_ITEM = 64  # Một object 7 emotions kèm chỉ số "i"
+
+    # Lỗi tạm thời đáng để retry
+    RETRYABLE_ERRORS = (
+        asyncio.TimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+    def __init__(
+        self,
+        provider: str = "cerebras",
+        max_workers: int = 5,
+        cache=None,
+        call_timeout: float = 20.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        hedge_after: Optional[float] = None,
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        model: Optional[str] = None,
+        max_prompt_tokens: int = 6000,
+        max_response_tokens: int = 4096,
+        response_overhead_tokens: int = 512,
+        max_batch_items: int = 50,
+        fast_path=None,
+    ):
         """
         Initialize AI Batch Processor
-        
+
         Args:
             provider: Tên provider (cerebras)
-            max_workers: Số lượng threads xử lý song song
+            max_workers: Số request LLM đồng thời tối đa (semaphore dùng chung cho mọi request)
+            cache: ResultCache tùy chọn để tránh gọi lại LLM cho text đã phân tích
+            call_timeout: Timeout (giây) cho mỗi lần gọi LLM
+            max_retries: Số lần retry khi lỗi tạm thời hoặc response không hợp lệ
+            backoff_base: Thời gian chờ cơ sở (giây) cho exponential backoff
+            backoff_max: Thời gian chờ tối đa (giây) giữa hai lần retry
+            hedge_after: Nếu đặt, gửi thêm một request trùng khi request đầu chưa xong sau số giây này
+            base_url: Ghi đè base URL của provider (ví dụ stub server OpenAI-compatible)
+            api_key: Ghi đè API key của provider
+            model: Ghi đè model của provider
+            max_prompt_tokens: Số token ước lượng tối đa của các text trong một sub-batch
+            max_response_tokens: max_tokens tối đa cho response của một sub-batch
+            response_overhead_tokens: Token dự phòng cho mỗi response (reasoning, dấu ngoặc)
+            max_batch_items: Số text tối đa trong một sub-batch
+            fast_path: FastPath tùy chọn, text tầm thường (emoji, link, "ok") lấy kết quả từ bảng tra cứu thay vì gọi LLM
         """
         self.provider_name = provider
         self.max_workers = max_workers
-        
+        self.cache = cache
+        self.call_timeout = call_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_response_tokens = max_response_tokens
+        self.response_overhead_tokens = response_overhead_tokens
+        self.max_batch_items = max(max_batch_items, 1)
+        self.fast_path = fast_path
+
         if provider not in self.PROVIDERS:
             raise ValueError(f"Provider {provider} không được hỗ trợ. Chọn: {list(self.PROVIDERS.keys())}")
-        
+
         config = self.PROVIDERS[provider]
-        self.client = OpenAI(
-            api_key=config["api_key"],
-            base_url=config["base_url"]
-        )
-        self.model = config["model"]
-        
-    
+        self.base_url = base_url or os.environ.get("LLM_BASE_URL") or config["base_url"]
+        self.api_key = api_key or os.environ.get("LLM_API_KEY") or config["api_key"]
+        self.model = model or os.environ.get("LLM_MODEL") or config["model"]
+        self.cache_model = f"{provider}/{self.model}"
+
+        self._runner = _LoopThread()
+        self._client: Optional[AsyncOpenAI] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> AsyncOpenAI:
+        """Client và semaphore gắn với event loop hiện tại (tạo lại sau fork)"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # Một connection pool cho tất cả request của process
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_workers * 2,
+                    max_keepalive_connections=self.max_workers,
+                ),
+                timeout=httpx.Timeout(self.call_timeout, connect=5.0),
+            )
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=0,  # Retry do processor tự xử lý
+            )
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+            self._client_loop = loop
+        return self._client
+
     def extract_json_from_text(self, text: str) -> Optional[Dict]:
         """Trích xuất JSON từ text response"""
         try:
             return json.loads(text)
         except:
             pass
-        
+
         # Xóa markdown code blocks
         text = re.sub(r'```(?:json)?\s*', '', text)
         text = re.sub(r'```\s*', '', text)
-        
+
         # Tìm JSON object
         match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text)
         if match:
@@ -62,20 +186,215 @@ class AIBatchProcessor:
                 return json.loads(match.group())
             except:
                 pass
-        
+
         return None
-    
-    def analyze_single_text(self, text: str, retry: int = 2) -> Dict:
+
+    def extract_json_array(self, text: str) -> Optional[List]:
+        """
+        Trích xuất JSON array từ text response
+
+        Nếu array bị cắt (hết max_tokens) hoặc có object lỗi, khôi phục từng object còn nguyên
+        theo thứ tự xuất hiện; object không parse được được giữ chỗ bằng None
+        """
+        text = re.sub(r'```(?:json)?', '', text).strip()
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            # {"results": [...]} hoặc một object duy nhất
+            arrays = [value for value in data.values() if isinstance(value, list)]
+            return arrays[0] if arrays else [data]
+
+        start = text.find('[')
+        end = text.rfind(']')
+        if start != -1 and end > start:
+            try:
+                data = json.loads(text[start:end + 1])
+                if isinstance(data, list):
+                    return data
+            except ValueError:
+                pass
+
+        items = []
+        for match in re.finditer(r'\{[^{}]*\}', text[start + 1:] if start != -1 else text):
+            try:
+                items.append(json.loads(match.group()))
+            except ValueError:
+                items.append(None)
+        return items or None
+
+    def estimate_tokens(self, text: str) -> int:
+        """Ước lượng số token của một text trong batch prompt"""
+        return len(text.encode("utf-8")) // self.BYTES_PER_TOKEN + self.PROMPT_TOKENS_PER_ITEM
+
+    def response_budget(self, count: int) -> int:
+        """max_tokens cho response của một sub-batch có count texts"""
+        return min(self.response_overhead_tokens + self.RESPONSE_TOKENS_PER_ITEM * count, self.max_response_tokens)
+
+    def pack_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Chia texts thành các sub-batch liên tiếp vừa budget prompt và response
+
+        Returns:
+            List các list index vào texts; text dài hơn budget được đặt riêng một sub-batch
+        """
+        max_items = min(
+            self.max_batch_items,
+            max((self.max_response_tokens - self.response_overhead_tokens) // self.RESPONSE_TOKENS_PER_ITEM, 1),
+        )
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            if current and (current_tokens + tokens > self.max_prompt_tokens or len(current) >= max_items):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _align_batch_items(self, items: List, count: int) -> List[Optional[Dict]]:
+        """
+        Ghép các object trong response với text tương ứng
+
+        Dùng chỉ số "i" (1-based) nếu có, nếu không thì theo vị trí. Object thiếu hoặc sai format là None
+        """
+        results: List[Optional[Dict]] = [None] * count
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            index = item.get("i")
+            if isinstance(index, (int, float)) and 1 <= index <= count and results[int(index) - 1] is None:
+                slot = int(index) - 1
+            elif position < count and results[position] is None:
+                slot = position
+            else:
+                continue
+            if self._validate_emotion_data(item):
+                results[slot] = self._normalize_scores(item)
+        return results
+
+    async def _complete(self, messages: List[Dict], max_tokens: int) -> str:
+        """Một lần gọi chat completion, giới hạn bởi semaphore và timeout"""
+        client = self._get_client()
+        async with self._semaphore:
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                with LLM_IN_FLIGHT.track_inprogress(provider=self.provider_name):
+                    completion = await asyncio.wait_for(
+                        client.chat.completions.create(
+                            messages=messages,
+                            model=self.model,
+                            temperature=0.3,
+                            max_tokens=max_tokens,
+                        ),
+                        timeout=self.call_timeout,
+                    )
+                outcome = "ok"
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            except asyncio.CancelledError:
+                # Request hedge thua cuộc bị huỷ
+                outcome = "cancelled"
+                raise
+            finally:
+                LLM_CALL_SECONDS.observe(time.perf_counter() - start, provider=self.provider_name, outcome=outcome)
+        return completion.choices[0].message.content or ""
+
+    async def _complete_hedged(self, messages: List[Dict], max_tokens: int) -> str:
+        """Gửi thêm request trùng nếu request đầu chậm hơn hedge_after, lấy kết quả về trước"""
+        if not self.hedge_after:
+            return await self._complete(messages, max_tokens)
+
+        first = asyncio.ensure_future(self._complete(messages, max_tokens))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        pending = {first, asyncio.ensure_future(self._complete(messages, max_tokens))}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def _retry_delay(self, attempt: int, error: Optional[BaseException]) -> float:
+        """Exponential backoff với full jitter, ưu tiên Retry-After của provider khi bị rate limit"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after_ms = response.headers.get("retry-after-ms")
+            retry_after = response.headers.get("retry-after")
+            try:
+                if retry_after_ms:
+                    return min(float(retry_after_ms) / 1000, self.backoff_max)
+                if retry_after:
+                    return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _request_with_retry(self, messages: List[Dict], max_tokens: int, parse: Callable[[str], Any]) -> Any:
+        """
+        Gọi LLM và parse response, retry khi lỗi tạm thời hoặc response không hợp lệ
+
+        Returns:
+            Kết quả của parse, None nếu hết số lần retry mà response vẫn không hợp lệ
+        """
+        error: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = parse(await self._complete_hedged(messages, max_tokens))
+                if result is not None:
+                    return result
+                error = None
+            except self.RETRYABLE_ERRORS as e:
+                error = e
+
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt, error))
+
+        if error is not None:
+            raise error
+        return None
+
+    def analyze_single_text(self, text: str, retry: Optional[int] = None) -> Dict:
         """
         Phân tích một văn bản với AI
-        
+
         Args:
             text: Văn bản cần phân tích
-            retry: Số lần retry nếu lỗi
-            
+            retry: Không còn dùng, số lần retry lấy từ max_retries
+
         Returns:
             Dict với emotion scores
         """
+        return self._runner.run(self.analyze_single_text_async(text))
+
+    async def analyze_single_text_async(self, text: str) -> Dict:
+        """Phiên bản async của analyze_single_text"""
+        fast = self._fast_path_results([text])[0]
+        if fast is not None:
+            return fast
+
+        cached = self._get_cached(text)
+        if cached is not None:
+            return cached
+
         prompt = f"""
 Phân tích cảm xúc của câu sau và trả về tỉ lệ phần trăm (0-100) cho mỗi cảm xúc.
 Tổng các tỉ lệ PHẢI bằng 100.
@@ -93,154 +412,233 @@ Trả về JSON với format:
     "other": <số>
 }}
 """
-        
-        for attempt in range(retry + 1):
-            try:
-                completion = self.client.chat.completions.create(
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Bạn là chuyên gia phân tích cảm xúc. Chỉ trả về JSON thuần với 7 emotions. Tổng = 100. KHÔNG giải thích."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    model=self.model,
-                    temperature=0.3,
-                    max_tokens=300,
-                )
-                
-                response_text = completion.choices[0].message.content
-                data = self.extract_json_from_text(response_text)
-                
-                if data and self._validate_emotion_data(data):
-                    return self._normalize_scores(data)
-                
-            except Exception as e:
-                if attempt == retry:
-                    print(f"❌ Error analyzing text after {retry+1} attempts: {e}")
-                    return self._get_default_scores()
-                time.sleep(1)  # Wait before retry
-        
-        return self._get_default_scores()
-    
-    def analyze_batch_optimized(self, texts: List[str]) -> List[Dict]:
+        messages = [
+            {
+                "role": "system",
+                "content": "Bạn là chuyên gia phân tích cảm xúc. Chỉ trả về JSON thuần với 7 emotions. Tổng = 100. KHÔNG giải thích."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+        def parse(response_text: str) -> Optional[Dict]:
+            data = self.extract_json_from_text(response_text)
+            if data and self._validate_emotion_data(data):
+                return self._normalize_scores(data)
+            return None
+
+        try:
+            result = await self._request_with_retry(messages, 300, parse)
+        except Exception as e:
+            logger.error("Error analyzing text after %d attempts: %s", self.max_retries + 1, e)
+            FALLBACKS.inc(reason="llm_default_scores")
+            return self._get_default_scores()
+
+        if result is None:
+            FALLBACKS.inc(reason="llm_default_scores")
+            return self._get_default_scores()
+
+        self._set_cached(text, result)
+        return result
+
+    def analyze_batch_optimized(self, texts: List[str], fallback: bool = True) -> List[Optional[Dict]]:
         """
         Phân tích batch với một prompt duy nhất (tối ưu nhất)
-        
+
         Args:
             texts: List các văn bản cần phân tích
-            
+            fallback: Phân tích riêng từng text không có trong response; False để không gọi thêm LLM,
+                các text đó trả về None và raise lỗi nếu không có text nào thành công
+
         Returns:
             List các kết quả emotion scores
         """
+        return self._runner.run(self.analyze_batch_optimized_async(texts, fallback))
+
+    async def analyze_batch_optimized_async(self, texts: List[str], fallback: bool = True) -> List[Optional[Dict]]:
+        """Phiên bản async của analyze_batch_optimized"""
         if not texts:
             return []
-        
-        # Tạo prompt cho tất cả texts
+
+        # Chỉ gửi các text không qua fast path và chưa có trong cache
+        cached_results = [
+            fast if fast is not None else self._get_cached(text)
+            for text, fast in zip(texts, self._fast_path_results(texts))
+        ]
+        missing = [i for i, result in enumerate(cached_results) if result is None]
+        if not missing:
+            return cached_results
+
+        missing_results = await self._analyze_batch_uncached([texts[i] for i in missing], fallback)
+        for i, result in zip(missing, missing_results):
+            cached_results[i] = result
+        return cached_results
+
+    async def _analyze_batch_uncached(self, texts: List[str], fallback: bool = True) -> List[Optional[Dict]]:
+        """Chia texts thành các sub-batch theo token budget và gọi LLM song song, không qua cache"""
+        batches = self.pack_batches(texts)
+        outcomes = await asyncio.gather(
+            *[self._analyze_sub_batch([texts[i] for i in batch]) for batch in batches],
+            return_exceptions=True,
+        )
+
+        results: List[Optional[Dict]] = [None] * len(texts)
+        errors = []
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.warning("Sub-batch of %d texts failed: %s", len(batch), outcome)
+                errors.append(outcome)
+                continue
+            for i, result in zip(batch, outcome):
+                if result is not None:
+                    self._set_cached(texts[i], result)
+                    results[i] = result
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        if not fallback:
+            if len(missing) == len(texts):
+                if errors:
+                    raise errors[0]
+                raise ValueError(f"LLM không trả về JSON array hợp lệ cho {len(texts)} texts")
+            return results
+
+        # Fallback: chỉ phân tích riêng các text chưa có kết quả
+        logger.warning("Falling back to individual analysis for %d/%d texts", len(missing), len(texts))
+        FALLBACKS.inc(len(missing), reason="llm_single_text")
+        fallback_results = await self.analyze_batch_parallel_async([texts[i] for i in missing])
+        for i, result in zip(missing, fallback_results):
+            results[i] = result
+        return results
+
+    async def _analyze_sub_batch(self, texts: List[str]) -> List[Optional[Dict]]:
+        """
+        Một request LLM cho một sub-batch
+
+        Returns:
+            List cùng thứ tự texts, None cho text không khôi phục được từ response
+        """
         texts_formatted = "\n".join([f"{i+1}. {text}" for i, text in enumerate(texts)])
-        
+
         prompt = f"""
 Phân tích cảm xúc cho {len(texts)} câu sau. Với mỗi câu, trả về tỉ lệ % cho 7 cảm xúc (tổng = 100).
 
 {texts_formatted}
 
-Trả về JSON array với format:
+Trả về JSON array theo đúng thứ tự câu, "i" là số thứ tự của câu:
 [
-    {{"enjoyment": <số>, "sadness": <số>, "anger": <số>, "fear": <số>, "disgust": <số>, "surprise": <số>, "other": <số>}},
+    {{"i": 1, "enjoyment": <số>, "sadness": <số>, "anger": <số>, "fear": <số>, "disgust": <số>, "surprise": <số>, "other": <số>}},
     ...
 ]
 """
-        
-        try:
-            completion = self.client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Bạn là chuyên gia phân tích cảm xúc. Trả về JSON array với emotion scores. Mỗi object có 7 keys. Tổng mỗi object = 100."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model=self.model,
-                temperature=0.3,
-                max_tokens=2000,
-            )
-            
-            response_text = completion.choices[0].message.content
-            
-            # Extract JSON array
-            data = self.extract_json_from_text(response_text)
-            
-            if isinstance(data, list) and len(data) == len(texts):
-                results = []
-                for item in data:
-                    if self._validate_emotion_data(item):
-                        results.append(self._normalize_scores(item))
-                    else:
-                        results.append(self._get_default_scores())
-                return results
-            
-        except Exception as e:
-            print(f"❌ Batch analysis error: {e}")
-        
-        # Fallback: analyze individually
-        print("⚠️ Falling back to individual analysis...")
-        return self.analyze_batch_parallel(texts)
-    
+        messages = [
+            {
+                "role": "system",
+                "content": "Bạn là chuyên gia phân tích cảm xúc. Trả về JSON array với emotion scores. Mỗi object có key i và 7 emotions. Tổng mỗi object = 100."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+        def parse(response_text: str) -> Optional[List[Optional[Dict]]]:
+            items = self.extract_json_array(response_text)
+            if not items:
+                return None
+            results = self._align_batch_items(items, len(texts))
+            # Chỉ retry cả sub-batch khi không khôi phục được text nào
+            return results if any(result is not None for result in results) else None
+
+        results = await self._request_with_retry(messages, self.response_budget(len(texts)), parse)
+        return results if results is not None else [None] * len(texts)
+
     def analyze_batch_parallel(self, texts: List[str]) -> List[Dict]:
         """
-        Phân tích batch với threading (song song)
-        
+        Phân tích batch song song, mỗi text một request (giới hạn bởi semaphore chung)
+
         Args:
             texts: List các văn bản cần phân tích
-            
+
         Returns:
             List các kết quả emotion scores
         """
-        results = [None] * len(texts)
-        
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_index = {
-                executor.submit(self.analyze_single_text, text): i 
-                for i, text in enumerate(texts)
-            }
-            
-            for future in as_completed(future_to_index):
-                index = future_to_index[future]
-                try:
-                    results[index] = future.result()
-                except Exception as e:
-                    print(f"❌ Error processing text {index}: {e}")
-                    results[index] = self._get_default_scores()
-        
+        return self._runner.run(self.analyze_batch_parallel_async(texts))
+
+    async def analyze_batch_parallel_async(self, texts: List[str]) -> List[Dict]:
+        """Phiên bản async của analyze_batch_parallel"""
+        results = await asyncio.gather(
+            *[self.analyze_single_text_async(text) for text in texts],
+            return_exceptions=True,
+        )
+
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logger.error("Error processing text %d: %s", index, result)
+                FALLBACKS.inc(reason="llm_default_scores")
+                results[index] = self._get_default_scores()
+
+        return results
+
+    def close(self):
+        """Đóng connection pool"""
+        if self._client is not None and self._client_loop is not None and not self._client_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._client_loop).result()
+            self._client = None
+
+    def _fast_path_results(self, texts: List[str]) -> List[Optional[Dict]]:
+        """Kết quả phần trăm từ fast path cho từng text, None nếu text cần gọi LLM"""
+        if self.fast_path is None:
+            return [None] * len(texts)
+
+        results: List[Optional[Dict]] = []
+        for fast in self.fast_path.lookup(texts):
+            if fast is None:
+                results.append(None)
+                continue
+            percentages = [int(round(score * 100)) for score in fast.scores]
+            percentages[-1] += 100 - sum(percentages)
+            results.append(dict(zip(self.EMOTION_KEYS, percentages)))
         return results
-    
+
+    def _get_cached(self, text: str) -> Optional[Dict]:
+        """Lấy kết quả LLM đã cache cho text"""
+        if self.cache is None:
+            return None
+        return self.cache.get(text, model=self.cache_model)
+
+    def _set_cached(self, text: str, result: Dict):
+        """Cache kết quả LLM hợp lệ (không cache default scores khi lỗi)"""
+        if self.cache is not None:
+            self.cache.set(text, result, model=self.cache_model)
+
     def _validate_emotion_data(self, data: Dict) -> bool:
         """Kiểm tra data có đủ 7 emotions không"""
-        required_keys = {"enjoyment", "sadness", "anger", "fear", "disgust", "surprise", "other"}
-        return all(key in data for key in required_keys)
-    
+        return isinstance(data, dict) and all(
+            isinstance(data.get(key), (int, float)) and not isinstance(data.get(key), bool) and data[key] >= 0
+            for key in self.EMOTION_KEYS
+        )
+
     def _normalize_scores(self, data: Dict) -> Dict:
         """Normalize scores để tổng = 100"""
-        total = sum(data.values())
+        total = sum(data[key] for key in self.EMOTION_KEYS)
         if total == 0:
             return self._get_default_scores()
-        
-        normalized = {key: round((value / total) * 100, 2) for key, value in data.items()}
-        
+
+        normalized = {key: round((data[key] / total) * 100, 2) for key in self.EMOTION_KEYS}
+
         # Đảm bảo tổng = 100 (fix rounding errors)
         diff = 100 - sum(normalized.values())
         if diff != 0:
             max_key = max(normalized, key=normalized.get)
             normalized[max_key] = round(normalized[max_key] + diff, 2)
-        
+
         return normalized
-    
+
     def _get_default_scores(self) -> Dict:
         """Trả về scores mặc định khi lỗi"""
         return {
@@ -257,7 +655,7 @@ Trả về JSON array với format:
 # Test function
 if __name__ == "__main__":
     processor = AIBatchProcessor(provider="cerebras", max_workers=3)
-    
+
     test_texts = [
         "Món này ngon quá! Tôi rất thích",
         "Buồn quá, tôi thất vọng lắm",
@@ -265,12 +663,12 @@ if __name__ == "__main__":
         "Sợ quá, không dám làm",
         "Ghê tởm, kinh khủng"
     ]
-    
+
     print("\n🔄 Testing batch analysis (optimized)...")
     start = time.time()
     results = processor.analyze_batch_optimized(test_texts)
     elapsed = time.time() - start
-    
+
     print(f"\n✅ Processed {len(test_texts)} texts in {elapsed:.2f}s")
     for i, (text, result) in enumerate(zip(test_texts, results)):
         print(f"\n{i+1}. {text}")
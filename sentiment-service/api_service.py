@@ -1,86 +1,779 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch
 import time
-from ai_batch_processor import AIBatchProcessor
 
+# Thời điểm bắt đầu import, để báo cáo khởi động tính cả thời gian import torch/transformers
+IMPORT_START = time.perf_counter()
+
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
+from flask_cors import CORS
+import numpy as np
+import functools
+import json
+import logging
+import os
+import threading
+from admission import BACKGROUND, INTERACTIVE, LANES, AdmissionController, Rejected
+from aggregation import (
+    EMOTION_LABELS, STRATEGIES, aggregate, percentages_matrix, scores_matrix, summarize,
+)
+from engine import InferenceEngine, fill_items, format_prediction
+from fast_path import FastPath
+from job_queue import FINISHED, JobRunner, JobStore, callback_allowed
+from logging_config import configure_logging
+from memory import peak_rss_bytes, process_memory, rss_bytes
+from metrics import (
+    ADMISSION_WAITING, ADMISSIONS, CONTENT_TYPE, FALLBACKS, FORWARD_RSS, JOBS, PROCESS_PEAK_RSS, PROCESS_RSS,
+    QUEUE_DEPTH, REGISTRY, REQUEST_SECONDS, REQUESTS_IN_FLIGHT,
+)
+from micro_batcher import BatchScheduler, BatcherFull, DeadlineExceeded
+from model_loader import default_artifact_dir
+from model_registry import ModelRegistry
+from result_cache import ResultCache, create_shared_backend
+from rollups import CONVERSATION, GRANULARITIES, USER, RollupRecorder, RollupStore, entity_key, parse_timestamp, summarize_rows
+from routing import CircuitBreaker, LatencyTracker, ProviderRouter
+from similarity_index import SimilarityIndex, VectorStore
+from startup import StartupReport
+from transcript_stream import CallStreamRegistry
+from wire_format import FLOAT32, JSON, columns, read_body, respond, response_format
+
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Cho phép CORS để Node.js có thể gọi API
 
-MODEL_ID = "tunakite03/visobert-emotion-vietnamese-v2"
+PROCESS_START = time.time()
+
+# Thời gian từng phase khởi động, log một lần khi ready và trả về trong /health
+startup = StartupReport(started_at=IMPORT_START)
+startup.record("imports", time.perf_counter() - IMPORT_START)
+
+MODEL_ID = os.environ.get("SENTIMENT_MODEL_ID", "tunakite03/visobert-emotion-vietnamese-v2")
+# Pin version (nên dùng commit hash) và checksum của file weights
+MODEL_REVISION = os.environ.get("SENTIMENT_MODEL_REVISION") or None
+MODEL_SHA256 = os.environ.get("SENTIMENT_MODEL_SHA256") or None
+
+# Các version trong registry: v2 (SENTIMENT_MODEL_ID) và v1 (model của service.py cũ) load lazy khi được chọn
+V1_MODEL_ID = os.environ.get("SENTIMENT_V1_MODEL_ID", "tunakite03/visobert-emotion-vietnamese")
+V1_MODEL_REVISION = os.environ.get("SENTIMENT_V1_MODEL_REVISION") or None
+DEFAULT_MODEL_VERSION = os.environ.get("SENTIMENT_DEFAULT_MODEL", "v2")
+# Version load cùng version mặc định lúc khởi động (trước khi fork workers), phân cách bằng dấu phẩy
+PRELOAD_MODELS = [name.strip() for name in os.environ.get("SENTIMENT_PRELOAD_MODELS", "").split(",") if name.strip()]
+# Version mặc định theo route khi request không chọn model, ví dụ "/analyze=v2,/analyze/batch=v1";
+# các route /v1/* (format của service.py cũ) mặc định dùng v1
+ROUTE_MODELS = {
+    "/v1/analyze": "v1",
+    "/v1/analyze/batch": "v1",
+    **dict(
+        (route.strip(), name.strip())
+        for route, _, name in (item.partition("=") for item in os.environ.get("SENTIMENT_ROUTE_MODELS", "").split(","))
+        if name.strip()
+    ),
+}
+# Control file để hot swap đồng bộ giữa các gunicorn workers
+MODEL_CONTROL_FILE = os.environ.get("SENTIMENT_MODEL_CONTROL", os.path.join(default_artifact_dir(), "active-model.json"))
+# Token (header X-Admin-Token) cho hot swap, quản lý và ghi similarity index, ghi rollup; để trống thì tắt các thao tác này
+ADMIN_TOKEN = os.environ.get("SENTIMENT_ADMIN_TOKEN", "")
+
+# Inference backend: "fp32", "int8" (torch dynamic quantization) hoặc "onnx" (onnxruntime)
+INFERENCE_BACKEND = os.environ.get("SENTIMENT_BACKEND", "fp32")
+# Backend khác fp32 phải đạt tỉ lệ top-1 trùng với fp32 tối thiểu này trên tập đánh giá
+MIN_BACKEND_AGREEMENT = float(os.environ.get("SENTIMENT_MIN_AGREEMENT", "0.95"))
+
+# Cấu hình micro-batching cho local model
+MAX_BATCH_SIZE = int(os.environ.get("SENTIMENT_MAX_BATCH_SIZE", "32"))
+MAX_WAIT_MS = float(os.environ.get("SENTIMENT_MAX_WAIT_MS", "5"))
+# Số token tối đa (sau padding) mỗi forward pass, batch toàn text dài được chia nhỏ để giới hạn bộ nhớ (0 = không giới hạn)
+MAX_BATCH_TOKENS = int(os.environ.get("SENTIMENT_MAX_BATCH_TOKENS", "4096"))
+# Số text chờ tối đa trong micro-batcher của mỗi version, vượt quá thì trả 503
+MAX_PENDING_TEXTS = int(os.environ.get("SENTIMENT_MAX_PENDING_TEXTS", "1024"))
+# Số thread chạy forward pass, dùng chung cho mọi version model của worker
+SCHEDULER_THREADS = int(os.environ.get("SENTIMENT_SCHEDULER_THREADS", "1"))
+# Batch size của warm-up với input tổng hợp ở mọi bucket độ dài trước khi ready, "0" hoặc rỗng để tắt
+WARMUP_BATCH_SIZES = [int(size) for size in os.environ.get("SENTIMENT_WARMUP_BATCH_SIZES", "1,8,32").split(",") if size.strip()]
+
+# Admission control: số request chạy model đồng thời mỗi worker và hàng đợi của từng lane
+MAX_CONCURRENT = int(os.environ.get("SENTIMENT_MAX_CONCURRENT", "8"))
+QUEUE_INTERACTIVE = int(os.environ.get("SENTIMENT_QUEUE_INTERACTIVE", "16"))
+QUEUE_BACKGROUND = int(os.environ.get("SENTIMENT_QUEUE_BACKGROUND", "8"))
+BACKGROUND_SHARE = float(os.environ.get("SENTIMENT_BACKGROUND_SHARE", "0.5"))
+MAX_QUEUE_WAIT = float(os.environ.get("SENTIMENT_MAX_QUEUE_WAIT", "5"))
+
+# Tokenizer: "auto" dùng fast tokenizer nếu qua parity check với slow tokenizer
+TOKENIZER_MODE = os.environ.get("SENTIMENT_TOKENIZER", "auto")
+MAX_LENGTH = 256
+
+# Long-text mode: text dài hơn MAX_LENGTH token được chia đoạn thay vì bị truncate
+LONG_TEXT_ENABLED = os.environ.get("SENTIMENT_LONG_TEXT", "1") != "0"
+LONG_TEXT_MAX_CHUNKS = int(os.environ.get("SENTIMENT_LONG_TEXT_MAX_CHUNKS", "32"))
+
+# Fast path cho emoji, link và câu rất ngắn: ngưỡng confidence để bỏ qua model và tỉ lệ shadow so với model
+FAST_PATH_ENABLED = os.environ.get("SENTIMENT_FAST_PATH", "1") != "0"
+FAST_PATH_THRESHOLD = float(os.environ.get("SENTIMENT_FAST_PATH_THRESHOLD", "0.7"))
+FAST_PATH_SHADOW_RATE = float(os.environ.get("SENTIMENT_FAST_PATH_SHADOW_RATE", "0.01"))
+
+# Cấu hình result cache
+CACHE_MAX_ENTRIES = int(os.environ.get("SENTIMENT_CACHE_SIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.environ.get("SENTIMENT_CACHE_TTL", "3600"))
+CACHE_SHARED_BACKEND = os.environ.get("SENTIMENT_CACHE_SHARED", "")
+
+# Cấu hình LLM client (AIBatchProcessor), LLM_ENABLED=0 để bỏ qua cả việc import openai
+LLM_ENABLED = os.environ.get("LLM_ENABLED", "1") != "0"
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "5"))
+LLM_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT", "20"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_HEDGE_AFTER = float(os.environ["LLM_HEDGE_AFTER"]) if os.environ.get("LLM_HEDGE_AFTER") else None
+LLM_MAX_PROMPT_TOKENS = int(os.environ.get("LLM_MAX_PROMPT_TOKENS", "6000"))
+LLM_MAX_RESPONSE_TOKENS = int(os.environ.get("LLM_MAX_RESPONSE_TOKENS", "4096"))
+
+# Circuit breaker cho LLM provider
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Streaming transcript: half-life (số segment) của rolling aggregate và thời gian giữ cuộc gọi không hoạt động
+STREAM_HALF_LIFE = float(os.environ.get("SENTIMENT_STREAM_HALF_LIFE", "8"))
+STREAM_IDLE_SECONDS = float(os.environ.get("SENTIMENT_STREAM_IDLE_SECONDS", "900"))
+
+# Output của /analyze/batch: một sentiment gộp hoặc kết quả từng text; text rỗng trong output từng text là "other"
+BATCH_OUTPUTS = ("aggregate", "items")
+
+# Tỉ lệ request thành công được ghi access log (request lỗi luôn được ghi)
+ACCESS_LOG_SAMPLE_RATE = float(os.environ.get("SENTIMENT_ACCESS_LOG_SAMPLE_RATE", "0.01"))
+
+# Job bất đồng bộ: SQLite queue dùng chung cho mọi worker, số worker threads mỗi process và số text mỗi sub-batch
+JOB_DB = os.environ.get("SENTIMENT_JOB_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.environ.get("SENTIMENT_JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.environ.get("SENTIMENT_JOB_CHUNK_SIZE", "32"))
+JOB_MAX_TEXTS = int(os.environ.get("SENTIMENT_JOB_MAX_TEXTS", "100000"))
+JOB_RETENTION_SECONDS = float(os.environ.get("SENTIMENT_JOB_RETENTION", str(7 * 24 * 3600)))
+# Lease của job được gia hạn liên tục khi job chạy, chỉ hết khi worker chết hoặc bị treo lâu hơn lease
+JOB_LEASE_SECONDS = float(os.environ.get("SENTIMENT_JOB_LEASE", "60"))
+# Callback: secret ký HMAC và danh sách host được phép (phân cách bằng dấu phẩy, rỗng = không nhận callback_url)
+JOB_CALLBACK_SECRET = os.environ.get("SENTIMENT_JOB_CALLBACK_SECRET", "")
+JOB_CALLBACK_HOSTS = [host.strip().lower() for host in os.environ.get("SENTIMENT_JOB_CALLBACK_HOSTS", "").split(",") if host.strip()]
+
+# Similarity index: embedding của nội dung đã phân tích (SQLite dùng chung mọi worker), loại index
+# "exact" (NumPy brute force) hoặc "ivf" (approximate), số cụm / số cụm được so của ivf và ngưỡng near-duplicate
+INDEX_DB = os.environ.get("SENTIMENT_INDEX_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "index.sqlite3"))
+INDEX_KIND = os.environ.get("SENTIMENT_INDEX_KIND", "exact")
+INDEX_LISTS = int(os.environ.get("SENTIMENT_INDEX_LISTS", "64"))
+INDEX_NPROBE = int(os.environ.get("SENTIMENT_INDEX_NPROBE", "8"))
+DUPLICATE_THRESHOLD = float(os.environ.get("SENTIMENT_DUPLICATE_THRESHOLD", "0.95"))
+SIMILAR_MAX_K = 100
+
+# Emotion rollups theo user / conversation (SQLite dùng chung mọi worker): độ dài bucket, số giây giữa hai lần ghi
+# và số ngày giữ bucket, truy vấn không dài hơn thời gian giữ
+ROLLUP_DB = os.environ.get("SENTIMENT_ROLLUP_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rollups.sqlite3"))
+ROLLUP_BUCKET_SECONDS = int(os.environ.get("SENTIMENT_ROLLUP_BUCKET_SECONDS", "3600"))
+ROLLUP_FLUSH_INTERVAL = float(os.environ.get("SENTIMENT_ROLLUP_FLUSH_INTERVAL", "1"))
+ROLLUP_RETENTION_DAYS = int(os.environ.get("SENTIMENT_ROLLUP_RETENTION_DAYS", "400"))
+
+# Mọi version model của worker chạy forward pass trên cùng pool thread thay vì mỗi version một thread
+scheduler = BatchScheduler(SCHEDULER_THREADS)
+registry = ModelRegistry(
+    control_file=MODEL_CONTROL_FILE,
+    backend=INFERENCE_BACKEND,
+    min_agreement=MIN_BACKEND_AGREEMENT,
+    tokenizer_mode=TOKENIZER_MODE,
+    max_length=MAX_LENGTH,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_batch_tokens=MAX_BATCH_TOKENS,
+    max_wait_ms=MAX_WAIT_MS,
+    max_pending=MAX_PENDING_TEXTS,
+    scheduler=scheduler,
+    warmup_batch_sizes=WARMUP_BATCH_SIZES,
+)
+registry.add("v2", MODEL_ID, MODEL_REVISION, expected_sha256=MODEL_SHA256, default=DEFAULT_MODEL_VERSION == "v2")
+registry.add("v1", V1_MODEL_ID, V1_MODEL_REVISION, default=DEFAULT_MODEL_VERSION == "v1")
+# Version mặc định đã hot swap trước đó vẫn được giữ sau khi restart
+registry.load_control()
+
+model_ready = threading.Event()
+startup_state = {"error": None, "cold_start_seconds": None, "timings": {}}
+
+
+def load_model():
+    """Load version mặc định từ artifact dir local (chỉ tải khi chưa có), warm-up trước khi nhận traffic"""
+    version = registry.default
+
+    logger.info("Loading model %s (%s)", version.name, version.model_id)
+    try:
+        with startup.phase(f"{version.name}.total"):
+            version.load()
+        startup.add(version.name, version.timings)
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error("Error loading model: %s", e)
+        raise
+
+    for name in PRELOAD_MODELS:
+        if name == version.name:
+            continue
+        try:
+            with startup.phase(f"{name}.total"):
+                registry.get(name).load()
+            startup.add(name, registry.get(name).timings)
+        except Exception as e:
+            # Version phụ lỗi không chặn version mặc định, request chọn version đó nhận 503 như khi load lazy
+            logger.error("Error preloading model %s: %s", name, e)
+
+    startup_state["timings"] = version.timings
+    startup_state["backend"] = version.backend_info
+    startup_state["cold_start_seconds"] = round(time.time() - PROCESS_START, 4)
+    startup.mark_ready()
+    logger.info(
+        "Model loaded successfully",
+        extra={"cold_start_seconds": startup_state["cold_start_seconds"], "timings": version.timings},
+    )
+    logger.info("Startup report", extra=startup.snapshot())
+    model_ready.set()
+
+
+def load_model_async():
+    """Load model trong background để /health trả lời ngay khi process khởi động"""
+    thread = threading.Thread(target=load_model, name="model-loader", daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until_ready(timeout=None):
+    """Chờ model load xong (dùng trước khi fork workers), raise nếu load lỗi"""
+    deadline = time.monotonic() + timeout if timeout else None
+    while not model_ready.wait(0.5):
+        if startup_state["error"]:
+            raise RuntimeError(f"Model failed to load: {startup_state['error']}")
+        if deadline and time.monotonic() > deadline:
+            raise TimeoutError("Model load timed out")
+
+
+def not_ready_response():
+    """Response 503 khi model chưa sẵn sàng"""
+    return jsonify({
+        "error": startup_state["error"] or "Model is loading"
+    }), 503
+
 
-print("Loading model...")
+load_model_async()
 
-try:
-    print("Downloading model files...")
-    # Use slow tokenizer to avoid corrupted tokenizer.json
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID, use_fast=False, force_download=True)
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_ID, force_download=True)
-    model.eval()
-    print("Model loaded successfully!")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    raise
+# Cache dùng chung cho local model và AI Batch Processor
+result_cache = ResultCache(
+    MODEL_ID,
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    shared=create_shared_backend(CACHE_SHARED_BACKEND),
+)
 
 # Initialize AI Batch Processor
-try:
-    ai_processor = AIBatchProcessor(provider="cerebras", max_workers=5)
-except Exception as e:
-    ai_processor = None
+ai_processor = None
+if LLM_ENABLED:
+    with startup.phase("llm_client"):
+        try:
+            from ai_batch_processor import AIBatchProcessor
+
+            ai_processor = AIBatchProcessor(
+                provider="cerebras",
+                max_workers=LLM_MAX_CONCURRENCY,
+                cache=result_cache,
+                call_timeout=LLM_CALL_TIMEOUT,
+                max_retries=LLM_MAX_RETRIES,
+                hedge_after=LLM_HEDGE_AFTER,
+                max_prompt_tokens=LLM_MAX_PROMPT_TOKENS,
+                max_response_tokens=LLM_MAX_RESPONSE_TOKENS,
+            )
+        except Exception as e:
+            logger.warning("LLM client disabled: %s", e)
+
+# Router theo provider: circuit breaker + latency p50/p95
+llm_routers = {}
+if ai_processor:
+    llm_routers[ai_processor.provider_name] = ProviderRouter(
+        ai_processor.provider_name,
+        breaker=CircuitBreaker(failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET_SECONDS),
+        latency=LatencyTracker(),
+    )
+
+call_streams = CallStreamRegistry(half_life=STREAM_HALF_LIFE, idle_timeout=STREAM_IDLE_SECONDS)
+
+fast_path = FastPath(threshold=FAST_PATH_THRESHOLD, shadow_rate=FAST_PATH_SHADOW_RATE) if FAST_PATH_ENABLED else None
+
+# Engine dùng chung cho mọi route và mọi version; text fast path chạy lại với priority sau mọi lane
+engine = InferenceEngine(
+    registry,
+    result_cache,
+    fast_path=fast_path,
+    long_text=LONG_TEXT_ENABLED,
+    long_text_max_chunks=LONG_TEXT_MAX_CHUNKS,
+    shadow_priority=len(LANES),
+)
+
+admission = AdmissionController(
+    max_concurrent=MAX_CONCURRENT,
+    max_queue_interactive=QUEUE_INTERACTIVE,
+    max_queue_background=QUEUE_BACKGROUND,
+    background_share=BACKGROUND_SHARE,
+    max_queue_wait=MAX_QUEUE_WAIT,
+)
+
+def collect_queue_depth():
+    for name in registry.names():
+        version = registry.get(name)
+        QUEUE_DEPTH.set(version.batcher.pending() + version.embedding_batcher.pending(), model=name)
+    for lane in LANES:
+        ADMISSION_WAITING.set(admission.waiting(lane), lane=lane)
+
+
+def collect_memory():
+    pid = os.getpid()
+    PROCESS_RSS.set(rss_bytes(), pid=pid)
+    PROCESS_PEAK_RSS.set(peak_rss_bytes(), pid=pid)
+    for name in registry.names():
+        for batch_size, stats in registry.get(name).memory.snapshot().items():
+            FORWARD_RSS.set(stats["max_rss_bytes"], pid=pid, model=name, batch_size=batch_size)
+
+
+REGISTRY.add_collector(collect_queue_depth)
+REGISTRY.add_collector(collect_memory)
+
+
+def request_endpoint():
+    """Label endpoint theo route pattern để số label không tăng theo URL"""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def sync_model_registry():
+    """Áp dụng hot swap do worker khác ghi vào control file"""
+    registry.poll()
+
+
+@app.before_request
+def start_request_metrics():
+    REGISTRY.ensure_flusher()
+    g.request_start = time.perf_counter()
+    g.endpoint = request_endpoint()
+    REQUESTS_IN_FLIGHT.inc(endpoint=g.endpoint)
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("request_start")
+    if start is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.observe(elapsed, endpoint=g.endpoint, status=response.status_code)
+    # Streaming response chỉ tính đến lúc trả header, phần body do từng event ghi nhận
+    logger.log(
+        logging.WARNING if response.status_code >= 500 else logging.INFO,
+        "request",
+        extra={
+            "method": request.method,
+            "endpoint": g.endpoint,
+            "status": response.status_code,
+            "duration_ms": round(elapsed * 1000, 2),
+            "sample_rate": 1.0 if response.status_code >= 400 else ACCESS_LOG_SAMPLE_RATE,
+        },
+    )
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if g.get("request_start") is not None:
+        REQUESTS_IN_FLIGHT.dec(endpoint=g.endpoint)
+
+
+def resolve_model_version(name=None):
+    """
+    Version model cho request: field 'model', header X-Model-Version, version của route (ROUTE_MODELS)
+    hoặc version mặc định
+
+    Returns:
+        (version, None) hoặc (None, error response); version chưa load sẽ được load trong background
+    """
+    try:
+        version = registry.get(name or request.headers.get('X-Model-Version') or ROUTE_MODELS.get(request_endpoint()))
+    except KeyError as e:
+        return None, (jsonify({"error": e.args[0]}), 400)
+
+    if not version.start_loading():
+        response = jsonify({"error": version.error or f"Model {version.name} is loading"})
+        response.headers['Retry-After'] = '5'
+        return None, (response, 503)
+    return version, None
+
+
+def request_deadline():
+    """
+    Deadline của request theo time.monotonic(): header X-Request-Deadline (unix epoch ms)
+    hoặc X-Request-Timeout-Ms (ms tính từ lúc nhận request), None nếu không có
+    """
+    try:
+        if request.headers.get('X-Request-Deadline'):
+            remaining = float(request.headers['X-Request-Deadline']) / 1000.0 - time.time()
+        elif request.headers.get('X-Request-Timeout-Ms'):
+            remaining = float(request.headers['X-Request-Timeout-Ms']) / 1000.0
+        else:
+            return None
+    except ValueError:
+        return None
+    return time.monotonic() + remaining
+
+
+def is_admin():
+    """Request có header X-Admin-Token đúng, luôn False khi chưa đặt SENTIMENT_ADMIN_TOKEN"""
+    return bool(ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+
+
+def rejection_response(rejected):
+    """Response nhanh cho request bị từ chối, kèm Retry-After khi nên gửi lại"""
+    response = jsonify({"error": f"Request rejected: {rejected.reason}", "reason": rejected.reason})
+    if rejected.retry_after is not None:
+        response.headers['Retry-After'] = str(rejected.retry_after)
+    return response, rejected.status
+
+
+def admitted(default_lane):
+    """
+    Decorator chạy view trong một slot của admission controller
+
+    Lane lấy từ header X-Priority (interactive/background), mặc định default_lane
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            lane = request.headers.get('X-Priority', default_lane).lower()
+            if lane not in LANES:
+                return jsonify({"error": f"X-Priority must be one of {list(LANES)}"}), 400
+
+            g.lane = lane
+            g.deadline = request_deadline()
+            try:
+                with admission.admit(lane, g.deadline):
+                    ADMISSIONS.inc(lane=lane, outcome="admitted")
+                    return view(*args, **kwargs)
+            except Rejected as e:
+                ADMISSIONS.inc(lane=lane, outcome=e.reason)
+                return rejection_response(e)
+        return wrapper
+    return decorator
+
+
+def run_engine(fn, *args, lane=None, **kwargs):
+    """
+    Gọi một hàm của engine với priority theo lane và deadline của request hiện tại
+
+    Text của request interactive được batcher chạy trước; text quá deadline của request bị bỏ.
+    Lane mặc định lấy từ request hiện tại (interactive nếu gọi ngoài request)
+
+    Raises:
+        Rejected: Batcher đầy hoặc request quá deadline khi đang chờ model
+    """
+    lane = lane or (g.get("lane", INTERACTIVE) if has_request_context() else INTERACTIVE)
+    deadline = g.get("deadline") if has_request_context() else None
+    try:
+        return fn(*args, priority=LANES.index(lane), deadline=deadline, **kwargs)
+    except BatcherFull:
+        raise Rejected(503, "batcher_full", admission.retry_after(lane))
+    except DeadlineExceeded:
+        raise Rejected(504, "deadline_exceeded")
+
+
+def fast_path_lookup(texts, version):
+    """Kết quả fast path của từng text (None nếu phải chạy model)"""
+    return engine.fast_path_lookup(texts, version)
+
+
+def predict_scores_cached(texts, version=None, lane=None, use_fast_path=True):
+    """Scores từng text qua fast path, cache và batcher của version"""
+    return run_engine(engine.scores, texts, version, lane=lane, use_fast_path=use_fast_path)
+
+
+def predict_sentiment(text, version=None, return_chunks=False):
+    """Phân tích emotion cho một văn bản (text dài được chia đoạn)"""
+    return run_engine(engine.predict, text, version, return_chunks)
+
+
+def local_scores_matrix(texts, version=None, lane=None, use_fast_path=True):
+    """Phân tích bằng local model, trả về ma trận softmax (N, 7) không qua dict từng text"""
+    return run_engine(engine.scores_matrix, texts, version, lane=lane, use_fast_path=use_fast_path)
+
+def request_latency_budget(data):
+    """
+    Latency budget (ms) từ body 'latency_budget_ms' hoặc header X-Latency-Budget-Ms,
+    mặc định là thời gian còn lại tới deadline của request
+    """
+    budget = data.get('latency_budget_ms', request.headers.get('X-Latency-Budget-Ms'))
+    try:
+        if budget is not None:
+            return float(budget)
+    except (TypeError, ValueError):
+        pass
+    deadline = g.get("deadline")
+    return max(deadline - time.monotonic(), 0.0) * 1000 if deadline is not None else None
+
+
+def valid_half_life(value):
+    """recency_half_life hợp lệ: null hoặc số dương hữu hạn"""
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < float("inf"))
+
+
+def analyze_matrix_routed(texts, budget_ms=None, version=None, lane=None):
+    """
+    Phân tích texts qua fast path, rồi LLM provider hoặc local model tùy router cho các text còn lại
+
+    Returns:
+        (score matrix, method, lý do dùng local model); method là "fast_path" nếu không text nào cần model
+    """
+    version = version or registry.default
+    fast = fast_path_lookup(texts, version)
+    rest = [i for i, result in enumerate(fast) if result is None]
+    if len(rest) == len(texts):
+        return route_scores_matrix(texts, budget_ms, version, lane)
+
+    matrix = np.empty((len(texts), len(EMOTION_LABELS)), dtype=np.float32)
+    for i, result in enumerate(fast):
+        if result is not None:
+            matrix[i] = result.scores
+    if not rest:
+        return matrix, "fast_path", None
+    matrix[rest], method, reason = route_scores_matrix([texts[i] for i in rest], budget_ms, version, lane)
+    return matrix, method, reason
+
+
+def route_scores_matrix(texts, budget_ms, version, lane):
+    """LLM provider hoặc local model tùy router (texts đã qua fast path)"""
+    if not ai_processor:
+        return local_scores_matrix(texts, version, lane, use_fast_path=False), "pytorch_batch_aggregated", None
+
+    router = llm_routers[ai_processor.provider_name]
+    route, reason = router.choose(budget_ms)
+    if route == ProviderRouter.LLM:
+        try:
+            # Không fallback từng text qua LLM, lỗi được tính cho breaker và chuyển sang local model
+            results = router.call(lambda: ai_processor.analyze_batch_optimized(texts, fallback=False))
+            missing = [i for i, result in enumerate(results) if result is None]
+            if not missing:
+                return percentages_matrix(results), "ai_batch_aggregated", None
+
+            # Text LLM không trả về được bù bằng local model
+            FALLBACKS.inc(len(missing), reason="llm_missing_items")
+            matrix = np.empty((len(texts), len(EMOTION_LABELS)), dtype=np.float32)
+            answered = [i for i in range(len(texts)) if results[i] is not None]
+            matrix[answered] = percentages_matrix([results[i] for i in answered])
+            matrix[missing] = local_scores_matrix([texts[i] for i in missing], version, lane, use_fast_path=False)
+            return matrix, "ai_batch_aggregated", None
+        except Rejected:
+            raise
+        except Exception as e:
+            logger.warning("AI processor failed, falling back to local model: %s", e)
+            reason = "llm_error"
+            router.record_fallback(reason)
+
+    if reason:
+        FALLBACKS.inc(reason=reason)
+    return local_scores_matrix(texts, version, lane, use_fast_path=False), "pytorch_batch_aggregated", reason
+
+
+def run_job_chunk(texts, params):
+    """
+    Phân tích một sub-batch của job trong lane background
+
+    Sub-batch chờ slot của admission controller như request background, chỉ khác là không bị từ chối
+    mà chờ Retry-After rồi thử lại
+    """
+    version = registry.get(params.get('model'))
+    while not version.start_loading():
+        if version.error:
+            raise RuntimeError(version.error)
+        time.sleep(1)
+
+    while True:
+        try:
+            with admission.admit(BACKGROUND):
+                matrix, method, _ = analyze_matrix_routed(texts, version=version, lane=BACKGROUND)
+            break
+        except Rejected as e:
+            time.sleep(e.retry_after or 1)
+
+    results = []
+    for row in matrix.astype(np.float64).tolist():
+        result = format_prediction(row, None)
+        del result["processing_time"]
+        result["method"] = method
+        results.append(result)
+    return results
+
+
+def finish_job(results, params):
+    """Kết quả tổng hợp của job, cùng format với /analyze/batch"""
+    matrix = scores_matrix([result["scores"] for result in results])
+    summary = summarize(aggregate(matrix, params['aggregation'], params.get('recency_half_life')))
+    methods = {}
+    for result in results:
+        methods[result["method"]] = methods.get(result["method"], 0) + 1
+    summary.update({
+        "texts_analyzed": len(results),
+        "aggregation": params['aggregation'],
+        "methods": methods,
+        "model_version": params['model'],
+    })
+    return summary
+
+
+job_store = JobStore(JOB_DB)
+
+# Mỗi model một index (embedding của các version khác nhau không so sánh được), load lazy ở truy vấn đầu tiên
+vector_store = VectorStore(INDEX_DB)
+similarity_indexes = {}
+similarity_indexes_lock = threading.Lock()
+
+
+def similarity_index(version):
+    """Similarity index cho embedding của version"""
+    with similarity_indexes_lock:
+        index = similarity_indexes.get(version.cache_model)
+        if index is None:
+            index = SimilarityIndex(vector_store, version.cache_model, kind=INDEX_KIND, n_lists=INDEX_LISTS, nprobe=INDEX_NPROBE)
+            similarity_indexes[version.cache_model] = index
+        return index
+
+
+def embedding_error(version, fmt):
+    """Error response nếu request cần embedding mà backend hoặc format response không đáp ứng được"""
+    if not version.backend.supports_embeddings:
+        return jsonify({"error": f"Backend {version.backend_name} does not support embeddings"}), 400
+    if fmt == FLOAT32:
+        return jsonify({"error": "Embeddings need a JSON or MessagePack response"}), 406
+    return None
+
+
+def index_ids_error(ids, count):
+    if not isinstance(ids, list) or len(ids) != count or not all(isinstance(item_id, str) and item_id for item_id in ids):
+        return jsonify({"error": "'ids' must be an array of non-empty strings, one per text"}), 400
+    return None
+
+
+rollup_store = RollupStore(ROLLUP_DB, bucket_seconds=ROLLUP_BUCKET_SECONDS)
+rollup_recorder = RollupRecorder(
+    rollup_store,
+    flush_interval=ROLLUP_FLUSH_INTERVAL,
+    retention_seconds=ROLLUP_RETENTION_DAYS * 86400,
+)
+
+
+def rollup_entity(data):
+    """
+    (entity, user_id, conversation_id, timestamp) của nội dung trong body, None nếu không cần ghi rollup
+
+    Chỉ nội dung có entity_id và user_id hoặc conversation_id được ghi (lần kiểm tra trước khi tạo nội dung
+    không có entity_id nên không bị tính hai lần); raise ValueError nếu timestamp không hợp lệ.
+    Field rollup chỉ được nhận từ backend (header X-Admin-Token): /analyze mở qua nginx, caller bên ngoài
+    không được cộng hay ghi đè scores vào rollup của user / conversation khác; request không có token vẫn được
+    phân tích bình thường, chỉ không ghi rollup
+    """
+    if not isinstance(data, dict) or data.get('entity_id') in (None, "") or not is_admin():
+        return None
+    if data.get('user_id') in (None, "") and data.get('conversation_id') in (None, ""):
+        return None
+    return (
+        entity_key(data.get('entity_type'), data['entity_id']),
+        data.get('user_id') or None,
+        data.get('conversation_id') or None,
+        parse_timestamp(data.get('timestamp')),
+    )
+
+
+def batch_rollup_entities(entities, count):
+    """Entity của từng text trong body 'entities' của /analyze/batch (object như body /analyze hoặc null)"""
+    if entities is None:
+        return None, None
+    if not isinstance(entities, list) or len(entities) != count or not all(entity is None or isinstance(entity, dict) for entity in entities):
+        return None, (jsonify({"error": "'entities' must be an array of objects or nulls, one per text"}), 400)
+    try:
+        return [rollup_entity(entity) for entity in entities], None
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+
+
+def record_rollups(entities, matrix):
+    """Ghi scores từng dòng của matrix cho entity cùng vị trí (bỏ qua vị trí None)"""
+    for entity, scores in zip(entities, matrix):
+        if entity is not None:
+            key, user_id, conversation_id, timestamp = entity
+            rollup_recorder.record(key, scores, user_id=user_id, conversation_id=conversation_id, timestamp=timestamp)
+
+
+job_runner = JobRunner(
+    job_store,
+    run_job_chunk,
+    finish_job,
+    workers=JOB_WORKERS,
+    chunk_size=JOB_CHUNK_SIZE,
+    lease_seconds=JOB_LEASE_SECONDS,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    callback_secret=JOB_CALLBACK_SECRET,
+    ready=model_ready,
+)
+
+
+@app.before_request
+def start_job_runner():
+    """Worker threads của job chạy trong từng process (gunicorn post_fork hoặc dev server)"""
+    job_runner.ensure_started()
 
-def predict_sentiment(text):
-    """Phân tích emotion cho văn bản với 7 classes"""
-    start_time = time.time()
-    
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=256, padding=True)
-    
-    with torch.no_grad():
-        outputs = model(**inputs)
-        predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        predicted_class = torch.argmax(predictions, dim=-1).item()
-        confidence = predictions[0][predicted_class].item()
-        
-        # Get all scores
-        all_scores = predictions[0].tolist()
-    
-    processing_time = round(time.time() - start_time, 4)
-    
-    # 7-class emotion model
-    # 0: Enjoyment, 1: Sadness, 2: Anger, 3: Fear, 4: Disgust, 5: Surprise, 6: Other
-    emotion_labels = {
-        0: "enjoyment",
-        1: "sadness", 
-        2: "anger",
-        3: "fear",
-        4: "disgust",
-        5: "surprise",
-        6: "other"
-    }
-    
-    return {
-        "emotion_class": predicted_class,
-        "emotion": emotion_labels.get(predicted_class, "other"),
-        "confidence": round(confidence, 4),
-        "scores": [round(score, 4) for score in all_scores],  # Array of 7 scores
-        "processing_time": processing_time
-    }
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Endpoint kiểm tra health"""
+    """Endpoint kiểm tra health (liveness), process còn sống kể cả khi model đang load"""
+    failed = startup_state["error"] is not None
     return jsonify({
-        "status": "healthy",
-        "model": MODEL_ID,
-        "model_loaded": True
-    })
+        "status": "unhealthy" if failed else "healthy",
+        "model": registry.default.model_id,
+        "model_version": registry.default.name,
+        "model_loaded": model_ready.is_set(),
+        "ready": model_ready.is_set(),
+        "startup": {**startup_state, "report": startup.snapshot()},
+        "cache": result_cache.stats(),
+        "tokenization": registry.default.tokenization.stats() if registry.default.tokenization else None,
+        "llm": [router.snapshot() for router in llm_routers.values()],
+        "streams": call_streams.stats(),
+        "admission": admission.stats(),
+        "scheduler": scheduler.stats(),
+        "fast_path": fast_path.stats() if fast_path else None,
+        "jobs": {status: job_store.count(status) for status in ("queued", "running")},
+        "rollups": rollup_recorder.stats(),
+        "memory": process_memory()
+    }), 503 if failed else 200
+
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Endpoint kiểm tra readiness, chỉ trả 200 khi model đã load xong"""
+    if not model_ready.is_set():
+        return not_ready_response()
+    return jsonify({
+        "ready": True,
+        "model": registry.default.model_id,
+        "model_version": registry.default.name,
+        "cold_start_seconds": startup_state["cold_start_seconds"]
+    }), 200
 
 @app.route('/analyze', methods=['POST'])
+@app.route('/v1/analyze', methods=['POST'])
+@admitted(INTERACTIVE)
 def analyze():
     """Endpoint phân tích sentiment cho một văn bản"""
+    if not model_ready.is_set():
+        return not_ready_response()
+
     try:
-        data = request.get_json()
+        fmt, error_response = response_format(request)
+        if error_response:
+            return error_response
+        data, error_response = read_body(request)
+        if error_response:
+            return error_response
         
         if not data or 'text' not in data:
             return jsonify({
@@ -94,10 +787,48 @@ def analyze():
                 "error": "Text cannot be empty"
             }), 400
         
-        result = predict_sentiment(text)
+        version, error_response = resolve_model_version(data.get('model'))
+        if error_response:
+            return error_response
+
+        try:
+            entity = rollup_entity(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        index_id = data.get('index_id')
+        if index_id and not is_admin():
+            return jsonify({
+                "error": "'index_id' requires X-Admin-Token"
+            }), 403
+        vectors = None
+        if data.get('embedding') or index_id:
+            error_response = embedding_error(version, fmt) or (index_ids_error([index_id], 1) if index_id else None)
+            if error_response:
+                return error_response
+
+            # Embedding chạy trước và ghi scores của text (hoặc từng đoạn) vào result cache,
+            # predict_sentiment bên dưới dùng lại nên scores giống hệt request không có embedding
+            start_time = time.time()
+            _, vectors = run_engine(engine.embed, [text], version)
+            if index_id:
+                similarity_index(version).add([index_id], vectors)
+
+        result = predict_sentiment(text, version, bool(data.get('return_chunks')))
+        if vectors is not None:
+            result["processing_time"] = round(time.time() - start_time, 4)
+            if index_id:
+                result["indexed"] = True
+            if data.get('embedding'):
+                result["embedding"] = vectors[0]
+        result["model_version"] = version.name
+        if entity is not None:
+            record_rollups([entity], [result["scores"]])
         
-        return jsonify(result), 200
+        return respond(result, result["scores"], fmt)
     
+    except Rejected:
+        raise
     except Exception as e:
         return jsonify({
             "error": str(e)
@@ -105,10 +836,24 @@ def analyze():
 
 
 @app.route('/analyze/batch', methods=['POST'])
+@admitted(BACKGROUND)
 def batch_analyze():
-    """Endpoint phân tích nhiều texts và trả về 1 sentiment duy nhất cho toàn bộ"""
+    """
+    Endpoint phân tích nhiều texts, mặc định trả về 1 sentiment duy nhất cho toàn bộ
+
+    Body 'output': "items" trả về kết quả từng text theo thứ tự request (text rỗng là "other") ở dạng cột
+    emotion_class / confidence / scores. Response là JSON, MessagePack hoặc float32 thô theo header Accept
+    """
+    if not model_ready.is_set():
+        return not_ready_response()
+
     try:
-        data = request.get_json()
+        fmt, error_response = response_format(request)
+        if error_response:
+            return error_response
+        data, error_response = read_body(request)
+        if error_response:
+            return error_response
         
         if not data or 'texts' not in data:
             return jsonify({
@@ -123,111 +868,601 @@ def batch_analyze():
             }), 400
         
         # Filter empty texts
-        valid_texts = [t for t in texts if t and t.strip()]
+        valid_indices = [i for i, t in enumerate(texts) if t and t.strip()]
+        valid_texts = [texts[i] for i in valid_indices]
         
         if not valid_texts:
             return jsonify({
                 "error": "No valid texts to analyze"
             }), 400
         
+        output = data.get('output', 'aggregate')
+        if output not in BATCH_OUTPUTS:
+            return jsonify({
+                "error": f"'output' must be one of {list(BATCH_OUTPUTS)}"
+            }), 400
+        
+        strategy = data.get('aggregation', 'mean')
+        if strategy not in STRATEGIES:
+            return jsonify({
+                "error": f"'aggregation' must be one of {list(STRATEGIES)}"
+            }), 400
+        
+        if not valid_half_life(data.get('recency_half_life')):
+            return jsonify({
+                "error": "'recency_half_life' must be a positive number or null"
+            }), 400
+        
+        version, error_response = resolve_model_version(data.get('model'))
+        if error_response:
+            return error_response
+        
+        entities, error_response = batch_rollup_entities(data.get('entities'), len(texts))
+        if error_response:
+            return error_response
+        
+        ids = data.get('ids')
+        if ids is not None and not is_admin():
+            return jsonify({
+                "error": "'ids' requires X-Admin-Token"
+            }), 403
+        if data.get('embedding') or ids is not None:
+            if output != 'items':
+                return jsonify({
+                    "error": "'embedding' and 'ids' need output 'items'"
+                }), 400
+            error_response = embedding_error(version, fmt) or (index_ids_error(ids, len(texts)) if ids is not None else None)
+            if error_response:
+                return error_response
+            return embedding_items_response(texts, ids, version, fmt, bool(data.get('embedding')), entities)
+        
         start_time = time.time()
         
-        # Try to use AI processor first, fallback to local model
-        if ai_processor:
-            try:
-                # Use optimized AI batch processing
-                ai_results = ai_processor.analyze_batch_optimized(valid_texts)
-                method = "ai_batch_aggregated"
-            except Exception as e:
-                print(f"AI processor failed, falling back to local model: {e}")
-                # Fallback to local PyTorch model
-                ai_results = []
-                for text in valid_texts:
-                    result = predict_sentiment(text)
-                    # Convert to percentages format
-                    ai_results.append({
-                        "enjoyment": result['scores'][0] * 100,
-                        "sadness": result['scores'][1] * 100,
-                        "anger": result['scores'][2] * 100,
-                        "fear": result['scores'][3] * 100,
-                        "disgust": result['scores'][4] * 100,
-                        "surprise": result['scores'][5] * 100,
-                        "other": result['scores'][6] * 100
-                    })
-                method = "pytorch_batch_aggregated"
-        else:
-            # Use local PyTorch model
-            ai_results = []
-            for text in valid_texts:
-                result = predict_sentiment(text)
-                # Convert to percentages format
-                ai_results.append({
-                    "enjoyment": result['scores'][0] * 100,
-                    "sadness": result['scores'][1] * 100,
-                    "anger": result['scores'][2] * 100,
-                    "fear": result['scores'][3] * 100,
-                    "disgust": result['scores'][4] * 100,
-                    "surprise": result['scores'][5] * 100,
-                    "other": result['scores'][6] * 100
-                })
-            method = "pytorch_batch_aggregated"
+        # LLM nếu breaker cho phép và latency nằm trong budget, ngược lại dùng local model
+        matrix, method, route_reason = analyze_matrix_routed(valid_texts, request_latency_budget(data), version)
+        if entities:
+            record_rollups([entities[i] for i in valid_indices], matrix)
+        
+        if output == 'items':
+            # Text rỗng giữ vị trí với scores "other" như /v1/analyze/batch
+            item_matrix = fill_items(len(texts), valid_indices, matrix)
+            result = {
+                "count": len(texts),
+                "labels": EMOTION_LABELS,
+                **columns(item_matrix),
+                "texts_analyzed": len(valid_texts),
+                "processing_time": round(time.time() - start_time, 4),
+                "method": method,
+            }
+            if route_reason:
+                result["route_reason"] = route_reason
+            if method == "pytorch_batch_aggregated":
+                result["model_version"] = version.name
+            return respond(result, item_matrix, fmt)
         
         # Aggregate all results into one sentiment
-        emotion_labels = ["enjoyment", "sadness", "anger", "fear", "disgust", "surprise", "other"]
-        
-        # Calculate average scores across all texts
-        avg_scores = {
-            "enjoyment": 0,
-            "sadness": 0,
-            "anger": 0,
-            "fear": 0,
-            "disgust": 0,
-            "surprise": 0,
-            "other": 0
-        }
-        
-        for ai_result in ai_results:
-            for emotion in emotion_labels:
-                avg_scores[emotion] += ai_result[emotion]
-        
-        # Average by number of texts
-        num_texts = len(ai_results)
-        for emotion in emotion_labels:
-            avg_scores[emotion] = avg_scores[emotion] / num_texts
-        
-        # Convert to scores (0-1 range)
-        scores = [
-            avg_scores["enjoyment"] / 100,
-            avg_scores["sadness"] / 100,
-            avg_scores["anger"] / 100,
-            avg_scores["fear"] / 100,
-            avg_scores["disgust"] / 100,
-            avg_scores["surprise"] / 100,
-            avg_scores["other"] / 100
-        ]
-        
-        # Find dominant emotion
-        max_idx = scores.index(max(scores))
+        result = summarize(aggregate(matrix, strategy, data.get('recency_half_life')))
+        result.update({
+            "texts_analyzed": int(matrix.shape[0]),
+            "processing_time": round(time.time() - start_time, 4),
+            "method": method,
+            "aggregation": strategy
+        })
+        if route_reason:
+            result["route_reason"] = route_reason
+        if method == "pytorch_batch_aggregated":
+            result["model_version"] = version.name
         
-        processing_time = round(time.time() - start_time, 4)
+        if data.get('return_scores'):
+            # Ma trận scores từng text, cùng thứ tự với valid_texts
+            result["score_matrix"] = matrix
         
+        return respond(result, matrix if data.get('return_scores') else result["scores"], fmt)
+    
+    except Rejected:
+        raise
+    except Exception as e:
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+def embedding_items_response(texts, ids, version, fmt, return_embeddings, entities=None):
+    """Output "items" của /analyze/batch bằng local model kèm embedding, thêm text có id vào similarity index"""
+    start_time = time.time()
+    matrix, embeddings, indices = run_engine(engine.embed_items, texts, version)
+    if ids is not None and indices:
+        similarity_index(version).add([ids[i] for i in indices], embeddings[indices])
+    if entities:
+        record_rollups([entities[i] for i in indices], matrix[indices])
+
+    result = {
+        "count": len(texts),
+        "labels": EMOTION_LABELS,
+        **columns(matrix),
+        "texts_analyzed": len(indices),
+        "processing_time": round(time.time() - start_time, 4),
+        "method": "pytorch_batch_aggregated",
+        "model_version": version.name,
+    }
+    if ids is not None:
+        result["indexed"] = len(indices)
+    if return_embeddings:
+        # Text rỗng có embedding 0
+        result["embeddings"] = embeddings
+    return respond(result, matrix, fmt)
+
+
+def search_similar(default_min_score=None):
+    """
+    Tìm nội dung gần nhất trong similarity index của version, query là 'text' (chạy model) hoặc 'id' đã index
+
+    Body: {"text" | "id", "k": 10, "min_score": ..., "model": ...}
+    """
+    data, error_response = read_body(request)
+    if error_response:
+        return error_response
+    data = data or {}
+    if not data.get('text') and not data.get('id'):
+        return jsonify({"error": "Missing 'text' or 'id' field in request body"}), 400
+
+    try:
+        k = int(data.get('k', 10))
+        min_score = data.get('min_score', data.get('threshold', default_min_score))
+        min_score = float(min_score) if min_score is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "'k' and 'min_score' must be numbers"}), 400
+    if not 1 <= k <= SIMILAR_MAX_K:
+        return jsonify({"error": f"'k' must be between 1 and {SIMILAR_MAX_K}"}), 400
+
+    version, error_response = resolve_model_version(data.get('model'))
+    if error_response:
+        return error_response
+    error_response = embedding_error(version, JSON)
+    if error_response:
+        return error_response
+
+    index = similarity_index(version)
+    start_time = time.time()
+    if data.get('id'):
+        query = index.vector_of(data['id'])
+        if query is None:
+            return jsonify({"error": f"'{data['id']}' is not in the index"}), 404
+        queries = query[None, :]
+    else:
+        _, queries = run_engine(engine.embed, [data['text']], version)
+
+    query_start = time.perf_counter()
+    results = index.search(queries, k, min_score, exclude=[data.get('id')])[0]
+    return jsonify({
+        "results": results,
+        "count": len(results),
+        "min_score": min_score,
+        "index": index.kind,
+        "query_seconds": round(time.perf_counter() - query_start, 6),
+        "processing_time": round(time.time() - start_time, 4),
+        "model_version": version.name,
+    }), 200
+
+
+@app.route('/similar', methods=['POST'])
+@admitted(INTERACTIVE)
+def similar():
+    """Endpoint tìm nội dung tương tự (cosine similarity của sentence embedding)"""
+    if not model_ready.is_set():
+        return not_ready_response()
+    try:
+        return search_similar()
+    except Rejected:
+        raise
+    except Exception as e:
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+@app.route('/near-duplicates', methods=['POST'])
+@admitted(INTERACTIVE)
+def near_duplicates():
+    """Endpoint tìm nội dung gần như trùng lặp: kết quả có similarity >= 'threshold' (mặc định SENTIMENT_DUPLICATE_THRESHOLD)"""
+    if not model_ready.is_set():
+        return not_ready_response()
+    try:
+        return search_similar(DUPLICATE_THRESHOLD)
+    except Rejected:
+        raise
+    except Exception as e:
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+@app.route('/index/remove', methods=['POST'])
+def remove_from_index():
+    """Endpoint xoá nội dung khỏi similarity index, body {"ids": [...], "model": ...} (cần header X-Admin-Token)"""
+    if not is_admin():
+        return jsonify({
+            "error": "Forbidden"
+        }), 403
+    data = request.get_json() or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return jsonify({"error": "'ids' must be a non-empty array"}), 400
+    try:
+        version = registry.get(data.get('model') or request.headers.get('X-Model-Version'))
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 400
+    similarity_index(version).remove([str(item_id) for item_id in ids])
+    return jsonify({"removed": len(ids)}), 200
+
+
+@app.route('/index/stats', methods=['GET'])
+def index_stats():
+    """Endpoint thống kê similarity index của worker: số vector, thời gian build, latency truy vấn p50/p95"""
+    with similarity_indexes_lock:
+        indexes = list(similarity_indexes.values())
+    return jsonify({"indexes": [index.stats() for index in indexes]}), 200
+
+
+@app.route('/index/rebuild', methods=['POST'])
+def rebuild_index():
+    """Endpoint build lại similarity index của một version từ SQLite (cần header X-Admin-Token)"""
+    if not is_admin():
+        return jsonify({
+            "error": "Forbidden"
+        }), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        version = registry.get(data.get('model'))
+    except KeyError as e:
+        return jsonify({"error": e.args[0]}), 400
+    return jsonify(similarity_index(version).rebuild()), 200
+
+
+def rollup_response(scope, key):
+    """
+    Emotion rollup của một user / conversation trong `days` ngày gần nhất, cộng từ các bucket đã lưu
+
+    Query: days (mặc định 30), granularity hour / day / week / total (mặc định day) cho series,
+    utc_offset (giờ) để ranh giới ngày / tuần theo múi giờ của client
+    """
+    try:
+        days = float(request.args.get('days', 30))
+        utc_offset = float(request.args.get('utc_offset', 0))
+    except ValueError:
+        return jsonify({"error": "'days' and 'utc_offset' must be numbers"}), 400
+    if not 0 < days <= ROLLUP_RETENTION_DAYS:
+        return jsonify({"error": f"'days' must be between 0 and {ROLLUP_RETENTION_DAYS}"}), 400
+    if not -14 <= utc_offset <= 14:
+        return jsonify({"error": "'utc_offset' must be between -14 and 14 hours"}), 400
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"'granularity' must be one of {list(GRANULARITIES)}"}), 400
+    step = GRANULARITIES[granularity]
+    if step and step < ROLLUP_BUCKET_SECONDS:
+        return jsonify({"error": f"'granularity' must not be shorter than the {ROLLUP_BUCKET_SECONDS}s rollup bucket"}), 400
+
+    # Event chờ ghi của worker này; worker khác ghi trong vòng SENTIMENT_ROLLUP_FLUSH_INTERVAL giây
+    rollup_recorder.flush()
+    end = time.time()
+    start = end - days * 86400
+    rows = rollup_store.query(scope, key, start, end + ROLLUP_BUCKET_SECONDS, step, int(utc_offset * 3600))
+    return jsonify({
+        scope: key,
+        "days": days,
+        "granularity": granularity,
+        "bucket_seconds": ROLLUP_BUCKET_SECONDS,
+        "labels": EMOTION_LABELS,
+        **summarize_rows(rows, step),
+    }), 200
+
+
+@app.route('/rollups/users/<user_id>', methods=['GET'])
+def user_rollup(user_id):
+    """Endpoint emotion rollup của một user"""
+    return rollup_response(USER, user_id)
+
+
+@app.route('/rollups/conversations/<conversation_id>', methods=['GET'])
+def conversation_rollup(conversation_id):
+    """Endpoint emotion rollup của một conversation"""
+    return rollup_response(CONVERSATION, conversation_id)
+
+
+@app.route('/rollups/remove', methods=['POST'])
+def remove_from_rollups():
+    """Endpoint bỏ nội dung đã xoá khỏi rollups, body {"entities": [{"entity_id": ..., "entity_type": ...}]}"""
+    data = request.get_json() or {}
+    entities = data.get('entities')
+    if not isinstance(entities, list) or not entities or not all(isinstance(entity, dict) and entity.get('entity_id') not in (None, "") for entity in entities):
+        return jsonify({"error": "'entities' must be a non-empty array of objects with 'entity_id'"}), 400
+    for entity in entities:
+        rollup_recorder.remove(entity_key(entity.get('entity_type'), entity['entity_id']))
+    return jsonify({"removed": len(entities)}), 200
+
+
+@app.route('/v1/analyze/batch', methods=['POST'])
+@admitted(BACKGROUND)
+def batch_analyze_items():
+    """
+    Endpoint phân tích nhiều texts và trả về kết quả từng text theo format của service.py cũ (model mặc định v1)
+
+    Response {"results": [...], "count": N}, text rỗng là "other" với confidence 0;
+    Accept MessagePack hoặc float32 trả về dạng cột như output "items" của /analyze/batch
+    """
+    if not model_ready.is_set():
+        return not_ready_response()
+
+    try:
+        fmt, error_response = response_format(request)
+        if error_response:
+            return error_response
+        data, error_response = read_body(request)
+        if error_response:
+            return error_response
+
+        if not data or 'texts' not in data:
+            return jsonify({
+                "error": "Missing 'texts' field in request body"
+            }), 400
+
+        texts = data['texts']
+
+        if not isinstance(texts, list):
+            return jsonify({
+                "error": "'texts' must be an array"
+            }), 400
+
+        version, error_response = resolve_model_version(data.get('model'))
+        if error_response:
+            return error_response
+
+        start_time = time.time()
+        matrix = run_engine(engine.predict_items, texts, version)
+        processing_time = round(time.time() - start_time, 4)
+
+        if fmt != JSON:
+            return respond({"count": len(texts), "labels": EMOTION_LABELS, **columns(matrix), "model_version": version.name}, matrix, fmt)
+
+        results = []
+        for text, row in zip(texts, matrix.astype(np.float64).tolist()):
+            result = format_prediction(row, processing_time)
+            if not (text and text.strip()):
+                result.update({"confidence": 0.0, "processing_time": 0})
+            results.append(result)
+
         return jsonify({
-            "emotion_class": max_idx,
-            "emotion": emotion_labels[max_idx],
-            "confidence": round(scores[max_idx], 4),
-            "scores": [round(s, 4) for s in scores],
-            "percentages": avg_scores,
-            "texts_analyzed": num_texts,
-            "processing_time": processing_time,
-            "method": method
+            "results": results,
+            "count": len(results),
+            "model_version": version.name
         }), 200
-    
+
+    except Rejected:
+        raise
     except Exception as e:
         return jsonify({
             "error": str(e)
         }), 500
 
 
+def handle_stream_event(event, half_life=None, version=None):
+    """Xử lý một dòng của stream: segment mới hoặc kết thúc cuộc gọi"""
+    if not isinstance(event, dict) or not event.get('call_id'):
+        raise ValueError("Missing 'call_id' field")
+    call_id = str(event['call_id'])
+
+    if event.get('type') == 'end':
+        stream = call_streams.end(call_id)
+        summary = stream.summary() if stream else {"call_id": call_id, "call": None, "speakers": {}}
+        return {"type": "call_end", **summary}
+
+    text = event.get('text')
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Missing 'text' field")
+
+    start_time = time.time()
+    # Segment của mọi cuộc gọi đang mở được micro-batcher gom chung forward pass
+    all_scores = predict_scores_cached([text], version)[0]
+    result = {
+        "type": "segment",
+        "call_id": call_id,
+        "segment_id": event.get('segment_id'),
+        "speaker": event.get('speaker'),
+    }
+    result.update(format_prediction(all_scores, round(time.time() - start_time, 4)))
+    result.update(call_streams.get(call_id, half_life).add_segment(event.get('speaker'), all_scores))
+    return result
+
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """
+    Endpoint streaming NDJSON cho transcript cuộc gọi
+
+    Mỗi dòng request là {"call_id", "speaker", "text", "segment_id"} hoặc {"call_id", "type": "end"},
+    mỗi dòng response là emotion của segment kèm rolling aggregate theo speaker và theo cuộc gọi
+    """
+    if not model_ready.is_set():
+        return not_ready_response()
+
+    half_life = request.args.get('half_life', type=float)
+    version, error_response = resolve_model_version(request.args.get('model'))
+    if error_response:
+        return error_response
+
+    def generate():
+        for line_number, line in enumerate(request.stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                event = handle_stream_event(json.loads(line), half_life, version)
+            except Exception as e:
+                event = {"type": "error", "line": line_number, "error": str(e)}
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def job_response(job, status=200):
+    """Job kèm kết quả từng text (khi có ?items=true), phân trang bằng offset/limit"""
+    job = dict(job)
+    job.pop('callback_url', None)
+    job['progress'] = round(job['completed'] / job['total'], 4) if job['total'] else 1.0
+    if request.args.get('items', '').lower() in ('1', 'true', 'yes'):
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        job['items'] = job_store.items(job['job_id'], offset, limit, request.args.get('status'))
+        job['offset'] = offset
+        job['limit'] = limit
+    return jsonify(job), status
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Endpoint tạo job phân tích batch lớn, trả về 202 và job_id ngay
+
+    Body: {"texts": [...], "aggregation": "mean", "recency_half_life": null, "model": "v2",
+    "callback_url": "https://...", "metadata": {...}}. Kết quả lấy qua GET /jobs/<job_id>
+    hoặc được POST tới callback_url khi job kết thúc
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('texts'), list):
+        return jsonify({
+            "error": "'texts' must be an array"
+        }), 400
+
+    texts = data['texts']
+    if not all(text is None or isinstance(text, str) for text in texts):
+        return jsonify({
+            "error": "'texts' must contain only strings"
+        }), 400
+    if not any(text and text.strip() for text in texts):
+        return jsonify({
+            "error": "No valid texts to analyze"
+        }), 400
+    if len(texts) > JOB_MAX_TEXTS:
+        return jsonify({
+            "error": f"At most {JOB_MAX_TEXTS} texts per job"
+        }), 413
+
+    strategy = data.get('aggregation', 'mean')
+    if strategy not in STRATEGIES:
+        return jsonify({
+            "error": f"'aggregation' must be one of {list(STRATEGIES)}"
+        }), 400
+
+    # Giá trị sai chỉ lỗi ở finish_job, sau khi mọi sub-batch đã chạy
+    if not valid_half_life(data.get('recency_half_life')):
+        return jsonify({
+            "error": "'recency_half_life' must be a positive number or null"
+        }), 400
+
+    try:
+        version = registry.get(data.get('model') or request.headers.get('X-Model-Version'))
+    except KeyError as e:
+        return jsonify({
+            "error": e.args[0]
+        }), 400
+
+    callback_url = data.get('callback_url')
+    if callback_url is not None and (not isinstance(callback_url, str) or not callback_allowed(callback_url, JOB_CALLBACK_HOSTS)):
+        return jsonify({
+            "error": "'callback_url' must be an http(s) URL on a host listed in SENTIMENT_JOB_CALLBACK_HOSTS"
+        }), 400
+
+    params = {
+        "aggregation": strategy,
+        "recency_half_life": data.get('recency_half_life'),
+        "model": version.name,
+        "metadata": data.get('metadata'),
+    }
+    job = job_store.create(texts, params, callback_url)
+    JOBS.inc(outcome="submitted")
+    job_runner.notify()
+
+    response, status = job_response(job, 202)
+    response.headers['Location'] = f"{request.script_root}/jobs/{job['job_id']}"
+    return response, status
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Endpoint trạng thái job, kết quả tổng hợp khi xong và kết quả từng text đã phân tích"""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({
+            "error": "Job not found"
+        }), 404
+    return job_response(job)
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Endpoint huỷ job, kết quả các text đã phân tích vẫn được giữ"""
+    job = job_store.get(job_id)
+    if not job:
+        return jsonify({
+            "error": "Job not found"
+        }), 404
+    if job['status'] in FINISHED:
+        return job_response(job, 409)
+
+    job = job_store.cancel(job_id)
+    if job['status'] == "cancelled":
+        JOBS.inc(outcome="cancelled")
+    return job_response(job)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics của mọi worker (gộp qua SENTIMENT_METRICS_DIR)"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/models/info', methods=['GET'])
+def models_info():
+    """Endpoint thông tin các version model: id, revision, backend, bộ nhớ và latency"""
+    return jsonify(registry.info()), 200
+
+
+@app.route('/models/activate', methods=['POST'])
+def activate_model():
+    """
+    Endpoint hot swap version mặc định (cần header X-Admin-Token)
+
+    Body: {"version": "v3", "model_id": "...", "revision": "...", "backend": "fp32", "unload_previous": false},
+    model_id chỉ cần khi đăng ký version mới. Version được load và warm-up trước khi nhận traffic
+    """
+    if not is_admin():
+        return jsonify({
+            "error": "Forbidden"
+        }), 403
+
+    data = request.get_json() or {}
+    name = data.get('version')
+    if not name:
+        return jsonify({
+            "error": "Missing 'version' field in request body"
+        }), 400
+
+    spec = {key: data[key] for key in ('model_id', 'revision', 'backend') if data.get(key)} or None
+    if spec and 'model_id' not in spec:
+        return jsonify({
+            "error": "'model_id' is required when 'revision' or 'backend' is given"
+        }), 400
+
+    try:
+        registry.request_activation(name, spec, bool(data.get('unload_previous')))
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            "error": e.args[0]
+        }), 400
+
+    return jsonify(registry.info()), 202
+
+
 # Legacy endpoints for backward compatibility
 @app.route('/predict', methods=['POST'])
 def predict():
@@ -240,4 +1475,5 @@ def batch_predict():
     return batch_analyze()
 
 if __name__ == '__main__':
+    job_runner.ensure_started()
     app.run(host='0.0.0.0', port=8000, debug=False)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Backfill sentiment cho dữ liệu lịch sử (posts, comments, messages)
+Đọc streaming từ JSONL hoặc pg_dump plain (COPY ... FROM stdin), chấm điểm offline bằng process pool
+theo batch đã sort theo độ dài, ghi kết quả theo từng part file và checkpoint để chạy tiếp khi bị dừng
+
+Usage:
+    python backfill.py --input dump.sql --output backfill-out
+    python backfill.py --input rows.jsonl --output backfill-out --format sql --resume
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from model_loader import ModelLoader
+from result_cache import ResultCache
+
+
+# Giá trị enum SentimentType trong Prisma, cùng thứ tự class của model
+SENTIMENT_TYPES = ["ENJOYMENT", "SADNESS", "ANGER", "FEAR", "DISGUST", "SURPRISE", "OTHER"]
+DEFAULT_TABLES = ("posts", "comments", "messages")
+CHECKPOINT_FILE = "checkpoint.json"
+
+COPY_PATTERN = re.compile(r'^COPY\s+(?:"?\w+"?\.)?"?(\w+)"?\s*\(([^)]*)\)\s+FROM\s+stdin;', re.IGNORECASE)
+COPY_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def unescape_copy(value: str) -> Optional[str]:
+    """Giải mã một field của COPY text format (\\N là NULL)"""
+    if value == "\\N":
+        return None
+    return re.sub(r"\\(.)", lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+def read_pg_dump(path: str, tables, id_field: str = "id", text_field: str = "content") -> Iterator[Dict]:
+    """Đọc từng row của các bảng cần backfill trong file pg_dump plain format"""
+    with open(path, encoding="utf-8") as f:
+        current = None
+        for line in f:
+            line = line.rstrip("\n")
+            if current is None:
+                match = COPY_PATTERN.match(line)
+                if match:
+                    columns = [column.strip().strip('"') for column in match.group(2).split(",")]
+                    wanted = match.group(1) in tables and id_field in columns and text_field in columns
+                    current = (match.group(1), columns.index(id_field), columns.index(text_field)) if wanted else ()
+                continue
+
+            if line == "\\.":
+                current = None
+            elif current:
+                table, id_index, text_index = current
+                values = line.split("\t")
+                yield {"table": table, "id": unescape_copy(values[id_index]), "text": unescape_copy(values[text_index])}
+
+
+def read_jsonl(path: str, tables, id_field: str = "id", text_field: str = "content", default_table: str = "posts") -> Iterator[Dict]:
+    """Đọc từng row từ file JSONL, mỗi dòng một object có id, content và table (tùy chọn)"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            table = row.get("table", default_table)
+            if table in tables:
+                yield {"table": table, "id": row[id_field], "text": row.get(text_field)}
+
+
+def read_rows(args) -> Iterator[Dict]:
+    tables = set(args.tables)
+    if args.input.endswith((".jsonl", ".ndjson")):
+        return read_jsonl(args.input, tables, args.id_field, args.text_field, args.table)
+    return read_pg_dump(args.input, tables, args.id_field, args.text_field)
+
+
+# State của worker process, khởi tạo một lần bởi init_worker
+_worker: Dict = {}
+
+
+def init_worker(model_path: str, backend_name: str, tokenizer_mode: str, max_length: int, batch_size: int, threads: int):
+    """Load tokenizer và model một lần cho mỗi worker process"""
+    import torch
+    from inference_backends import create_backend
+    from tokenization import TokenizationStage
+
+    torch.set_num_threads(threads)
+    model = ModelLoader(model_path, offline=True, verify=False).load_model(model_path)
+    _worker["tokenization"] = TokenizationStage.load(model_path, mode=tokenizer_mode, max_length=max_length, local_files_only=True)
+    _worker["backend"] = create_backend(backend_name, model, model_path)
+    _worker["batch_size"] = batch_size
+
+
+def score_chunk(texts: List[str]) -> List[List[float]]:
+    """Chấm điểm một chunk texts trong worker, trả về softmax 7 scores cho mỗi text"""
+    import torch
+
+    tokenization = _worker["tokenization"]
+    encodings = tokenization.encode(texts)
+    all_scores = [None] * len(texts)
+
+    with torch.inference_mode():
+        for indices in tokenization.plan_batches(encodings, _worker["batch_size"]):
+            inputs = tokenization.pad([encodings[i] for i in indices])
+            predictions = torch.nn.functional.softmax(_worker["backend"].logits(inputs), dim=-1)
+            for i, scores in zip(indices, predictions.tolist()):
+                all_scores[i] = scores
+
+    return all_scores
+
+
+def result_row(row: Dict, scores: List[float], model_id: str) -> Dict:
+    """Kết quả theo format các cột sentiment, sentimentConfidence, sentimentScores của Node backend"""
+    predicted_class = max(range(len(scores)), key=scores.__getitem__)
+    return {
+        "table": row["table"],
+        "id": row["id"],
+        "sentiment": SENTIMENT_TYPES[predicted_class],
+        "sentimentConfidence": round(scores[predicted_class], 4),
+        "sentimentScores": {emotion: round(score, 4) for emotion, score in zip(SENTIMENT_TYPES, scores)},
+        "model": model_id,
+    }
+
+
+def sql_quote(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def format_sql(result: Dict) -> str:
+    """Câu UPDATE cho một row, chạy bằng psql"""
+    return (
+        f'UPDATE "{result["table"]}" SET "sentiment" = {sql_quote(result["sentiment"])}::"SentimentType", '
+        f'"sentimentConfidence" = {result["sentimentConfidence"]}, '
+        f'"sentimentScores" = {sql_quote(json.dumps(result["sentimentScores"]))}::jsonb '
+        f'WHERE "id" = {sql_quote(result["id"])};'
+    )
+
+
+def write_atomic(path: str, content: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str, job: Dict) -> Dict:
+    """Đọc checkpoint, từ chối resume nếu input hoặc model khác lần chạy trước"""
+    if not os.path.exists(path):
+        return {**job, "rows_done": 0, "parts": 0}
+
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    for key, value in job.items():
+        if checkpoint.get(key) != value:
+            raise ValueError(f"Checkpoint có {key}={checkpoint.get(key)!r}, khác lần chạy này ({value!r})")
+    return checkpoint
+
+
+def run(args):
+    os.makedirs(args.output, exist_ok=True)
+    checkpoint_path = os.path.join(args.output, CHECKPOINT_FILE)
+    job = {"input": os.path.abspath(args.input), "model": args.model, "revision": args.revision, "format": args.format}
+    if args.resume:
+        checkpoint = load_checkpoint(checkpoint_path, job)
+    elif os.path.exists(checkpoint_path):
+        raise FileExistsError(f"{checkpoint_path} đã tồn tại, dùng --resume để chạy tiếp")
+    else:
+        checkpoint = {**job, "rows_done": 0, "parts": 0}
+
+    # Tải model một lần ở process cha, workers chỉ load từ thư mục local
+    model_path = ModelLoader(args.model, revision=args.revision).fetch()
+    model_id = f"{args.model}@{args.revision or 'main'}"
+
+    # Text giống nhau (sau chuẩn hóa) chỉ chấm điểm một lần, kể cả giữa các window
+    dedupe = ResultCache(model_id, max_entries=args.dedupe_entries, ttl_seconds=float("inf"))
+
+    rows = itertools.islice(read_rows(args), checkpoint["rows_done"], None)
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    extension = "sql" if args.format == "sql" else "jsonl"
+    stats = {"rows": 0, "scored": 0, "deduped": 0, "skipped": 0}
+    start = time.perf_counter()
+
+    print(f"Backfill {args.input} -> {args.output} with {args.workers} workers x {threads} threads, resuming at row {checkpoint['rows_done']}")
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(model_path, args.backend, args.tokenizer, args.max_length, args.batch_size, threads),
+    ) as pool:
+        while True:
+            window = list(itertools.islice(rows, args.window))
+            if not window:
+                break
+
+            scored: Dict[str, List[float]] = {}
+            pending: Dict[str, str] = {}
+            for row in window:
+                text = row["text"]
+                if not text or not text.strip():
+                    continue
+                key = dedupe.make_key(text)
+                if key not in scored and key not in pending:
+                    cached = dedupe.get(text)
+                    if cached is not None:
+                        scored[key] = cached
+                    else:
+                        pending[key] = text
+
+            # Sort theo độ dài để mỗi chunk có text dài gần nhau, ít padding
+            items = sorted(pending.items(), key=lambda item: len(item[1]))
+            chunks = [items[i:i + args.chunk_size] for i in range(0, len(items), args.chunk_size)]
+            results = pool.map(score_chunk, [[text for _, text in chunk] for chunk in chunks])
+            for chunk, chunk_scores in zip(chunks, results):
+                for (key, text), scores in zip(chunk, chunk_scores):
+                    scored[key] = scores
+                    dedupe.set(text, scores)
+
+            lines = []
+            for row in window:
+                text = row["text"]
+                if not text or not text.strip():
+                    stats["skipped"] += 1
+                    continue
+                result = result_row(row, scored[dedupe.make_key(text)], model_id)
+                lines.append(format_sql(result) if args.format == "sql" else json.dumps(result, ensure_ascii=False))
+
+            part_path = os.path.join(args.output, f"part-{checkpoint['parts']:05d}.{extension}")
+            write_atomic(part_path, "".join(line + "\n" for line in lines))
+
+            # Checkpoint chỉ cập nhật sau khi part đã ghi xong, chạy lại sẽ ghi đè part dở dang
+            checkpoint["rows_done"] += len(window)
+            checkpoint["parts"] += 1
+            write_atomic(checkpoint_path, json.dumps(checkpoint, indent=2))
+
+            stats["rows"] += len(window)
+            stats["scored"] += len(items)
+            stats["deduped"] += len(lines) - len(items)
+            elapsed = time.perf_counter() - start
+            print(
+                f"rows {checkpoint['rows_done']} | {stats['rows'] / elapsed:.1f} rows/s | "
+                f"scored {stats['scored']} | deduped {stats['deduped']} | skipped {stats['skipped']} | {part_path}"
+            )
+
+    elapsed = time.perf_counter() - start
+    checkpoint["completed"] = True
+    write_atomic(checkpoint_path, json.dumps(checkpoint, indent=2))
+    print(f"✅ Backfill done: {stats} in {elapsed:.1f}s ({stats['rows'] / max(elapsed, 1e-9):.1f} rows/s)")
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rescore sentiment cho posts, comments và messages")
+    parser.add_argument("--input", required=True, help="File .jsonl hoặc pg_dump plain (.sql)")
+    parser.add_argument("--output", required=True, help="Thư mục ghi part files và checkpoint")
+    parser.add_argument("--format", choices=("jsonl", "sql"), default="jsonl", help="jsonl hoặc các câu UPDATE cho psql")
+    parser.add_argument("--resume", action="store_true", help="Chạy tiếp từ checkpoint trong thư mục output")
+    parser.add_argument("--tables", nargs="+", default=list(DEFAULT_TABLES))
+    parser.add_argument("--table", default="posts", help="Bảng mặc định cho dòng JSONL không có 'table'")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--text-field", default="content")
+    parser.add_argument("--model", default=os.environ.get("SENTIMENT_MODEL_ID", "tunakite03/visobert-emotion-vietnamese-v2"))
+    parser.add_argument("--revision", default=os.environ.get("SENTIMENT_MODEL_REVISION") or None)
+    parser.add_argument("--backend", choices=("fp32", "int8"), default="fp32")
+    parser.add_argument("--tokenizer", choices=("auto", "fast", "slow"), default=os.environ.get("SENTIMENT_TOKENIZER", "auto"))
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2))
+    parser.add_argument("--window", type=int, default=20000, help="Số row đọc mỗi lần, cũng là kích thước một part file")
+    parser.add_argument("--chunk-size", type=int, default=512, help="Số text gửi cho worker mỗi lần")
+    parser.add_argument("--batch-size", type=int, default=64, help="Số text mỗi forward pass trong worker")
+    parser.add_argument("--dedupe-entries", type=int, default=1_000_000, help="Số text đã chấm giữ lại để dedupe")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run(parse_args())
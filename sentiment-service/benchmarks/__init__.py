@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark và load test cho sentiment service
+Chạy từ thư mục sentiment-service: python -m benchmarks.<module> --help
+"""
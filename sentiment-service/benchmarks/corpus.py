@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Corpus tiếng Việt cố định cho benchmark
+Sinh deterministic từ seed theo phân phối độ dài thực tế của từng loại nội dung
+(chat, comment, post, transcript) để các lần chạy so sánh được với nhau
+
+Usage:
+    python -m benchmarks.corpus --output corpus.jsonl --size 2000
+"""
+import argparse
+import json
+import random
+from typing import Dict, List, Optional, Sequence
+
+DEFAULT_SEED = 20240615
+DEFAULT_SIZE = 2000
+
+# Câu mang cảm xúc theo từng emotion, dùng làm nội dung chính của mỗi text
+SENTENCES = {
+    "enjoyment": [
+        "Món này ngon quá, lần sau nhất định quay lại",
+        "Hôm nay được thưởng Tết, vui quá trời luôn",
+        "Cảm ơn mọi người đã đến dự sinh nhật mình",
+        "Trận này đội nhà thắng đậm, đã thật sự",
+        "Chuyến đi Đà Lạt lần này tuyệt vời lắm",
+        "Cuối cùng cũng bảo vệ luận văn xong rồi, nhẹ cả người",
+        "Con mèo nhà mình dễ thương hết sức",
+        "Quán cà phê này view đẹp, nhân viên thân thiện",
+    ],
+    "sadness": [
+        "Buồn quá, tôi thất vọng lắm",
+        "Ông ngoại mất rồi, cả nhà ai cũng khóc",
+        "Trượt phỏng vấn lần thứ ba, chán thật sự",
+        "Chia tay rồi, không biết phải làm sao nữa",
+        "Mưa cả tuần, ở nhà một mình thấy cô đơn",
+        "Mất điện thoại với toàn bộ ảnh kỷ niệm",
+    ],
+    "anger": [
+        "Tôi rất tức giận về việc này",
+        "Giao hàng trễ ba ngày mà không ai xin lỗi một câu",
+        "Đỗ xe chắn hết lối đi, vô ý thức thật",
+        "Gọi tổng đài năm lần vẫn không ai giải quyết",
+        "Bị tính tiền sai mà thái độ nhân viên còn khó chịu",
+        "Hàng xóm hát karaoke đến hai giờ sáng",
+    ],
+    "fear": [
+        "Sợ quá, không dám làm",
+        "Nghe tiếng động lạ ngoài cửa lúc nửa đêm",
+        "Ngày mai thi cuối kỳ mà chưa học gì, lo quá",
+        "Đường trơn, xe phía trước thắng gấp, hú hồn",
+        "Kết quả xét nghiệm chưa có, hồi hộp không ngủ được",
+    ],
+    "disgust": [
+        "Ghê tởm, kinh khủng",
+        "Trong bát phở có con gián, không ăn nổi",
+        "Nhà vệ sinh quán này bẩn không chịu được",
+        "Đồ ăn để qua đêm bốc mùi mà vẫn bán",
+        "Kiểu người nói xấu sau lưng thật đáng khinh",
+    ],
+    "surprise": [
+        "Không thể tin được, bất ngờ thật sự",
+        "Ủa sao giá vé rẻ vậy trời",
+        "Tự nhiên nhận được quà từ bạn cũ mười năm không gặp",
+        "Đội yếu nhất giải lại vô địch, không ai ngờ",
+        "Mở cửa ra thấy cả nhóm tổ chức sinh nhật bất ngờ",
+    ],
+    "other": [
+        "Hôm nay trời nhiều mây",
+        "Mai họp lúc chín giờ nhé",
+        "Cho mình hỏi địa chỉ cửa hàng ở quận 3",
+        "Tài liệu đã gửi qua email rồi",
+        "Đơn hàng mã 12345 đang được vận chuyển",
+        "Lịch học tuần sau thay đổi, mọi người xem thông báo",
+    ],
+}
+
+# Từ đệm, teencode và emoji thường gặp trong chat/comment
+FILLERS = ["nha", "nhé", "luôn", "á", "đó", "thiệt", "ghê", "quá trời", "ha", "vậy á"]
+TEENCODE = ["ko", "dc", "vs", "j", "bt", "mn", "k", "đc", "trc", "ntn"]
+EMOJIS = ["😂", "🥳", "😡", "😭", "😱", "🤮", "😮", "❤️", "👍", "🙏"]
+# Từ đệm khi nói, xuất hiện trong transcript cuộc gọi
+SPOKEN = ["à", "ừ", "ờ", "dạ", "vâng", "thì", "kiểu như là", "nói chung là", "alo"]
+
+# Tỉ lệ từng loại nội dung và phân phối số từ (lognormal: mu, sigma, min, max)
+KINDS = {
+    "chat": {"weight": 0.45, "words": (2.0, 0.6, 1, 40)},
+    "comment": {"weight": 0.30, "words": (2.9, 0.6, 3, 120)},
+    "post": {"weight": 0.15, "words": (4.2, 0.6, 15, 600)},
+    "transcript": {"weight": 0.10, "words": (2.6, 0.5, 2, 80)},
+}
+
+
+def _sentence(rng: random.Random) -> str:
+    emotion = rng.choice(list(SENTENCES))
+    return rng.choice(SENTENCES[emotion])
+
+
+def _stylize(rng: random.Random, words: List[str], kind: str) -> List[str]:
+    """Thêm từ đệm, teencode, emoji theo loại nội dung"""
+    styled = []
+    for word in words:
+        if kind == "chat" and rng.random() < 0.08:
+            styled.append(rng.choice(TEENCODE))
+            continue
+        styled.append(word)
+        if kind == "transcript" and rng.random() < 0.12:
+            styled.append(rng.choice(SPOKEN))
+
+    if kind in ("chat", "comment") and rng.random() < 0.4:
+        styled.append(rng.choice(FILLERS))
+    if kind in ("chat", "comment") and rng.random() < 0.35:
+        styled.append(rng.choice(EMOJIS) * rng.randint(1, 3))
+    return styled
+
+
+def make_text(rng: random.Random, kind: str) -> str:
+    """Một text với số từ lấy theo phân phối của kind"""
+    mu, sigma, low, high = KINDS[kind]["words"]
+    target = min(max(int(rng.lognormvariate(mu, sigma)), low), high)
+
+    words: List[str] = []
+    while len(words) < target:
+        words.extend(_sentence(rng).split())
+        if kind in ("post", "comment") and len(words) < target:
+            words[-1] += rng.choice([".", "!", ",", "..."])
+    text = " ".join(_stylize(rng, words[:target], kind))
+    if kind == "post" and rng.random() < 0.3:
+        text += " #" + rng.choice(["review", "dulich", "amthuc", "tamsu", "congviec"])
+    return text
+
+
+def build_corpus(size: int = DEFAULT_SIZE, seed: int = DEFAULT_SEED, kinds: Optional[Sequence[str]] = None) -> List[Dict]:
+    """
+    Sinh corpus cố định
+
+    Args:
+        size: Số text
+        seed: Seed, cùng seed và size luôn cho cùng corpus
+        kinds: Chỉ lấy các loại này (mặc định tất cả, theo tỉ lệ trong KINDS)
+
+    Returns:
+        List {"id", "kind", "text"}
+    """
+    kinds = list(kinds or KINDS)
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        raise ValueError(f"Loại nội dung không hợp lệ: {unknown}. Chọn: {list(KINDS)}")
+
+    rng = random.Random(seed)
+    weights = [KINDS[kind]["weight"] for kind in kinds]
+    corpus = []
+    for index in range(size):
+        kind = rng.choices(kinds, weights)[0]
+        corpus.append({"id": index, "kind": kind, "text": make_text(rng, kind)})
+    return corpus
+
+
+def length_stats(corpus: List[Dict]) -> Dict:
+    """Số text và độ dài (ký tự) theo từng loại"""
+    stats = {}
+    for kind in sorted({row["kind"] for row in corpus}):
+        lengths = sorted(len(row["text"]) for row in corpus if row["kind"] == kind)
+        stats[kind] = {
+            "count": len(lengths),
+            "chars_p50": lengths[len(lengths) // 2],
+            "chars_p95": lengths[min(int(len(lengths) * 0.95), len(lengths) - 1)],
+            "chars_max": lengths[-1],
+        }
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sinh corpus tiếng Việt cố định cho benchmark")
+    parser.add_argument("--output", required=True, help="File JSONL đầu ra")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--kinds", default=",".join(KINDS), help="Các loại nội dung, phân cách bằng dấu phẩy")
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size, args.seed, args.kinds.split(","))
+    with open(args.output, "w", encoding="utf-8") as f:
+        for row in corpus:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    print(json.dumps(length_stats(corpus), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP load generator cho /analyze và /analyze/batch
+closed loop: N client gửi request tiếp theo ngay khi nhận response (đo throughput tối đa)
+open loop: request đến theo Poisson với rate cố định, không phụ thuộc response (đo latency dưới tải cho trước);
+latency tính từ thời điểm request lẽ ra được gửi nên thời gian xếp hàng phía client cũng được tính
+
+Usage:
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --mode closed --concurrency 16 --duration 30
+    python -m benchmarks.loadgen --endpoint /analyze/batch --batch-size 32 --mode open --rate 20 --output results/open.json
+"""
+import argparse
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from benchmarks.corpus import DEFAULT_SEED, KINDS, build_corpus
+from benchmarks.results import latency_stats, write_results
+
+
+class Client:
+    """Một keep-alive connection, mở lại khi server đóng"""
+
+    def __init__(self, url: str, timeout: float, headers: Dict[str, str]):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.prefix = parsed.path.rstrip("/")
+        self.https = parsed.scheme == "https"
+        self.timeout = timeout
+        self.headers = {"Content-Type": "application/json", **headers}
+        self.connection: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.connection is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self.connection = connection_class(self.host, self.port, timeout=self.timeout)
+        return self.connection
+
+    def post(self, path: str, body: bytes) -> int:
+        """Gửi request và đọc hết response, trả về status (0 nếu lỗi kết nối)"""
+        try:
+            connection = self._connect()
+            connection.request("POST", self.prefix + path, body=body, headers=self.headers)
+            response = connection.getresponse()
+            response.read()
+            if response.getheader("Connection", "").lower() == "close":
+                self.close()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Recorder:
+    """Latency và status của các request hoàn thành trong cửa sổ đo (sau warm-up)"""
+
+    def __init__(self, measure_from: float):
+        self.measure_from = measure_from
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, started: float, finished: float, status: int):
+        if started < self.measure_from:
+            return
+        with self._lock:
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            if 200 <= status < 300:
+                self.latencies.append(finished - started)
+
+
+def build_payloads(args) -> List[Tuple[bytes, int]]:
+    """Payload (body, số text) cố định từ corpus, quay vòng theo thứ tự"""
+    texts = [row["text"] for row in build_corpus(args.corpus_size, args.seed, args.kinds.split(","))]
+    extra = json.loads(args.body_extra) if args.body_extra else {}
+    payloads = []
+    if args.endpoint.endswith("/batch") or args.endpoint == "/batch-predict":
+        for start in range(0, len(texts) - args.batch_size + 1, args.batch_size):
+            body = {"texts": texts[start:start + args.batch_size], **extra}
+            payloads.append((json.dumps(body, ensure_ascii=False).encode("utf-8"), args.batch_size))
+    else:
+        for text in texts:
+            payloads.append((json.dumps({"text": text, **extra}, ensure_ascii=False).encode("utf-8"), 1))
+    if not payloads:
+        raise ValueError("Corpus nhỏ hơn batch size")
+    return payloads
+
+
+def run_closed(args, payloads, recorder: Recorder, deadline: float) -> int:
+    """concurrency client, mỗi client gửi tuần tự; trả về số request đã gửi"""
+    sent = [0] * args.concurrency
+
+    def worker(index: int):
+        client = Client(args.url, args.timeout, args.headers)
+        position = index
+        while time.perf_counter() < deadline:
+            body, _ = payloads[position % len(payloads)]
+            position += args.concurrency
+            started = time.perf_counter()
+            status = client.post(args.endpoint, body)
+            recorder.record(started, time.perf_counter(), status)
+            sent[index] += 1
+        client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(sent)
+
+
+def run_open(args, payloads, recorder: Recorder, start: float, deadline: float) -> Dict:
+    """Request đến theo Poisson với rate args.rate; tối đa args.concurrency request đồng thời"""
+    rng = random.Random(args.seed)
+    pending: "queue.Queue[Optional[Tuple[float, bytes]]]" = queue.Queue()
+    late = [0]
+    lock = threading.Lock()
+
+    def worker():
+        client = Client(args.url, args.timeout, args.headers)
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            scheduled, body = item
+            now = time.perf_counter()
+            if now > scheduled + 0.001:
+                # Không còn client rảnh đúng lúc: server không theo kịp rate yêu cầu
+                with lock:
+                    late[0] += 1
+            status = client.post(args.endpoint, body)
+            recorder.record(scheduled, time.perf_counter(), status)
+        client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+
+    scheduled = start
+    sent = 0
+    while True:
+        scheduled += rng.expovariate(args.rate)
+        if scheduled >= deadline:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((scheduled, payloads[sent % len(payloads)][0]))
+        sent += 1
+
+    for _ in threads:
+        pending.put(None)
+    # Request đã xếp hàng vẫn được chạy hết để latency của chúng được ghi nhận
+    for thread in threads:
+        thread.join(args.drain_timeout)
+    return {"sent": sent, "late": late[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator cho sentiment service")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL (có thể kèm prefix, ví dụ http://host/sentiment)")
+    parser.add_argument("--endpoint", default="/analyze")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số client (closed) hoặc số request đồng thời tối đa (open)")
+    parser.add_argument("--rate", type=float, default=50.0, help="Request/s cho open loop")
+    parser.add_argument("--duration", type=float, default=30.0, help="Thời gian đo (giây), không tính warm-up")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Giây đầu không tính vào kết quả")
+    parser.add_argument("--batch-size", type=int, default=32, help="Số text mỗi request của /analyze/batch")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--header", action="append", default=[], help="Header thêm dạng 'Name: value'")
+    parser.add_argument("--body-extra", help="JSON object trộn vào mỗi body, ví dụ '{\"model\": \"v1\"}'")
+    parser.add_argument("--corpus-size", type=int, default=2000)
+    parser.add_argument("--kinds", default=",".join(KINDS))
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", help="File JSON kết quả")
+    args = parser.parse_args()
+
+    args.headers = dict(header.split(":", 1) for header in args.header)
+    args.headers = {key.strip(): value.strip() for key, value in args.headers.items()}
+    payloads = build_payloads(args)
+    texts_per_request = payloads[0][1]
+
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    deadline = measure_from + args.duration
+    recorder = Recorder(measure_from)
+
+    if args.mode == "closed":
+        extra = {"sent": run_closed(args, payloads, recorder, deadline)}
+    else:
+        extra = run_open(args, payloads, recorder, start, deadline)
+
+    succeeded = len(recorder.latencies)
+    case = f"{args.mode}{args.endpoint}"
+    case += f"/c={args.concurrency}" if args.mode == "closed" else f"/rate={args.rate:g}"
+    result = {
+        "case": case,
+        "mode": args.mode,
+        "endpoint": args.endpoint,
+        "texts_per_request": texts_per_request,
+        "requests": sum(recorder.statuses.values()),
+        "statuses": recorder.statuses,
+        "error_rate": round(1 - succeeded / max(sum(recorder.statuses.values()), 1), 4),
+        "latency": latency_stats(recorder.latencies),
+        "throughput": round(succeeded / args.duration, 2),
+        "texts_per_second": round(succeeded * texts_per_request / args.duration, 2),
+        **extra,
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "headers")}
+    write_results(args.output, "loadgen", config, [result])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark các stage của local model và AIBatchProcessor theo batch size
+tokenize (encode + pad), forward (logits), postprocess (softmax), aggregate (các strategy + summarize),
+predict (predict_scores_batch end-to-end), llm (analyze_batch_optimized qua mock server)
+và index (build + query của similarity index exact/ivf trên embedding tổng hợp, recall@k của ivf so với exact)
+
+Usage:
+    python -m benchmarks.micro --model tunakite03/visobert-emotion-vietnamese-v2 --output results/micro.json
+    python -m benchmarks.micro --suites llm --llm-latency-ms 300 --llm-error-rate 0.05
+    python -m benchmarks.micro --suites index --index-sizes 10000,100000 --index-dim 768
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from aggregation import STRATEGIES, aggregate, summarize
+from benchmarks.corpus import DEFAULT_SEED, KINDS, build_corpus
+from benchmarks.results import latency_stats, write_results
+from memory import peak_rss_bytes, rss_bytes
+
+LOCAL_SUITES = ("tokenize", "forward", "postprocess", "aggregate", "predict")
+SUITES = LOCAL_SUITES + ("llm", "index")
+
+
+def batches_of(texts: List[str], batch_size: int, count: int) -> List[List[str]]:
+    """count batch liên tiếp từ corpus (quay vòng), cùng tham số luôn cho cùng các batch"""
+    cycle = itertools.cycle(texts)
+    return [[next(cycle) for _ in range(batch_size)] for _ in range(count)]
+
+
+def measure(fn: Callable[[Any], object], inputs: List[Any], warmup: int) -> List[float]:
+    """Latency (giây) của fn trên từng input, bỏ qua warmup lần đầu"""
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = []
+    for item in inputs[warmup:]:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def result(suite: str, batch_size: int, latencies: List[float]) -> Dict:
+    total = sum(latencies)
+    return {
+        "case": f"{suite}/batch={batch_size}",
+        "suite": suite,
+        "batch_size": batch_size,
+        "latency": latency_stats(latencies),
+        "throughput": round(batch_size * len(latencies) / total, 2) if total else None,
+        # Peak RSS tăng dần theo thứ tự chạy nên nên so sánh giữa các batch size trong cùng một lần chạy
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def local_suites(args, texts: List[str]) -> List[Dict]:
+    """Benchmark các stage của local model, mỗi stage đo riêng trên input đã chuẩn bị sẵn"""
+    import torch
+
+    from model_registry import ModelVersion
+
+    version = ModelVersion(
+        "bench",
+        args.model,
+        args.revision,
+        backend=args.backend,
+        tokenizer_mode=args.tokenizer,
+        max_length=args.max_length,
+        max_batch_size=max(args.batch_sizes),
+        max_batch_tokens=args.max_batch_tokens,
+    )
+    version.load()
+    tokenization, backend = version.tokenization, version.backend
+
+    def tokenize(batch):
+        return tokenization.pad(tokenization.encode(batch))
+
+    results = []
+    for batch_size in args.batch_sizes:
+        batches = batches_of(texts, batch_size, args.warmup + args.repeats)
+        # Input của stage sau được chuẩn bị trước để chỉ đo đúng một stage
+        inputs = [tokenize(batch) for batch in batches]
+        with torch.inference_mode():
+            logits = [backend.logits(batch_inputs) for batch_inputs in inputs]
+        matrices = [torch.nn.functional.softmax(batch_logits, dim=-1).numpy().astype(np.float32) for batch_logits in logits]
+
+        def forward(batch_inputs):
+            with torch.inference_mode():
+                return backend.logits(batch_inputs)
+
+        def postprocess(batch_logits):
+            return torch.nn.functional.softmax(batch_logits, dim=-1).tolist()
+
+        def aggregate_all(matrix):
+            return [summarize(aggregate(matrix, strategy)) for strategy in STRATEGIES]
+
+        stages = {
+            "tokenize": (tokenize, batches),
+            "forward": (forward, inputs),
+            "postprocess": (postprocess, logits),
+            "aggregate": (aggregate_all, matrices),
+            "predict": (version.predict_scores_batch, batches),
+        }
+        for suite in args.suites:
+            if suite in stages:
+                fn, suite_inputs = stages[suite]
+                results.append(result(suite, batch_size, measure(fn, suite_inputs, args.warmup)))
+                print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+def llm_suite(args, texts: List[str]) -> List[Dict]:
+    """Benchmark AIBatchProcessor với mock server chạy trong process, không dùng cache"""
+    from ai_batch_processor import AIBatchProcessor
+    from benchmarks.mock_llm import MockLLMConfig, MockLLMServer
+
+    server = MockLLMServer(MockLLMConfig(
+        latency_ms=args.llm_latency_ms,
+        jitter_ms=args.llm_jitter_ms,
+        error_rate=args.llm_error_rate,
+        rate_limit_rate=args.llm_rate_limit_rate,
+        truncate_rate=args.llm_truncate_rate,
+        seed=args.seed,
+    )).start()
+    processor = AIBatchProcessor(
+        max_workers=args.llm_concurrency,
+        base_url=server.base_url,
+        api_key="mock",
+        model="mock",
+        call_timeout=args.llm_timeout,
+        backoff_base=0.05,
+    )
+
+    results = []
+    try:
+        for batch_size in args.batch_sizes:
+            batches = batches_of(texts, batch_size, args.warmup + args.repeats)
+            latencies = measure(processor.analyze_batch_optimized, batches, args.warmup)
+            results.append(result("llm", batch_size, latencies))
+            results[-1]["mock"] = dict(server.config.stats)
+            print(json.dumps(results[-1], ensure_ascii=False))
+    finally:
+        processor.close()
+        server.stop()
+    return results
+
+
+def synthetic_embeddings(size: int, dim: int, seed: int) -> np.ndarray:
+    """Embedding chuẩn hoá quanh các cụm chủ đề, gần với phân bố của nội dung thật hơn vector ngẫu nhiên đều"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(size // 200, 1), dim))
+    vectors = topics[rng.integers(0, topics.shape[0], size)] + rng.normal(scale=0.5, size=(size, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def index_suite(args) -> List[Dict]:
+    """Build time và query latency của similarity index (SQLite tạm), recall@k của ivf so với exact"""
+    from similarity_index import SimilarityIndex, VectorStore
+
+    results = []
+    for size in args.index_sizes:
+        vectors = synthetic_embeddings(size, args.index_dim, args.seed)
+        queries = vectors[np.random.default_rng(args.seed + 1).choice(size, args.warmup + args.repeats)]
+        with tempfile.TemporaryDirectory() as directory:
+            store = VectorStore(os.path.join(directory, "index.sqlite3"))
+            store.put("bench", [str(i) for i in range(size)], vectors)
+
+            exact = None
+            for kind in ("exact", "ivf"):
+                index = SimilarityIndex(store, "bench", kind=kind, n_lists=args.index_lists, nprobe=args.index_nprobe)
+                found = []
+                latencies = measure(lambda query: found.append(index.search(query[None, :], args.index_k)[0]), list(queries), args.warmup)
+                ids = [{match["id"] for match in matches} for matches in found[args.warmup:]]
+                exact = ids if kind == "exact" else exact
+
+                results.append({
+                    "case": f"index/{kind}/size={size}",
+                    "suite": "index",
+                    "kind": kind,
+                    "size": size,
+                    "dim": args.index_dim,
+                    "build_seconds": index.build_seconds,
+                    "latency": latency_stats(latencies),
+                    "recall_at_k": round(float(np.mean([len(a & b) / len(a) for a, b in zip(exact, ids) if a])), 4),
+                    "rss_bytes": rss_bytes(),
+                    "peak_rss_bytes": peak_rss_bytes(),
+                })
+                print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark sentiment service")
+    parser.add_argument("--model", default=os.environ.get("SENTIMENT_MODEL_ID", "tunakite03/visobert-emotion-vietnamese-v2"))
+    parser.add_argument("--revision", default=os.environ.get("SENTIMENT_MODEL_REVISION") or None)
+    parser.add_argument("--backend", default="fp32", choices=["fp32", "int8", "onnx"])
+    parser.add_argument("--tokenizer", default="auto", choices=["auto", "fast", "slow"])
+    parser.add_argument("--max-length", type=int, default=256)
+    parser.add_argument("--max-batch-tokens", type=int, default=0, help="Giới hạn token mỗi forward pass của suite predict (0 = không giới hạn)")
+    parser.add_argument("--suites", default=",".join(LOCAL_SUITES), help=f"Các suite phân cách bằng dấu phẩy: {','.join(SUITES)}")
+    parser.add_argument("--batch-sizes", default="1,8,32,64")
+    parser.add_argument("--repeats", type=int, default=20, help="Số lần đo mỗi suite và batch size")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--corpus-size", type=int, default=2000)
+    parser.add_argument("--kinds", default=",".join(KINDS))
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--llm-truncate-rate", type=float, default=0.0)
+    parser.add_argument("--llm-concurrency", type=int, default=5)
+    parser.add_argument("--llm-timeout", type=float, default=20.0)
+    parser.add_argument("--index-sizes", default="10000,100000", help="Số vector của suite index")
+    parser.add_argument("--index-dim", type=int, default=768)
+    parser.add_argument("--index-k", type=int, default=10)
+    parser.add_argument("--index-lists", type=int, default=64)
+    parser.add_argument("--index-nprobe", type=int, default=8)
+    parser.add_argument("--output", help="File JSON kết quả")
+    args = parser.parse_args()
+
+    args.suites = args.suites.split(",")
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"Suite không hợp lệ: {unknown}")
+    args.batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    args.index_sizes = [int(size) for size in args.index_sizes.split(",")]
+
+    texts = [row["text"] for row in build_corpus(args.corpus_size, args.seed, args.kinds.split(","))]
+
+    results = []
+    if any(suite in LOCAL_SUITES for suite in args.suites):
+        results.extend(local_suites(args, texts))
+    if "llm" in args.suites:
+        results.extend(llm_suite(args, texts))
+    if "index" in args.suites:
+        results.extend(index_suite(args))
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    write_results(args.output, "micro", config, results)
+
+
+if __name__ == "__main__":
+    main()
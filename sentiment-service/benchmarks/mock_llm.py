@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Mock server OpenAI-compatible cho benchmark đường LLM
+Trả về emotion scores deterministic theo nội dung text, với latency và lỗi (429, 500, timeout) cấu hình được
+
+Usage:
+    python -m benchmarks.mock_llm --port 8090 --latency-ms 300 --error-rate 0.05
+    LLM_BASE_URL=http://127.0.0.1:8090/v1 LLM_API_KEY=mock gunicorn -c gunicorn.conf.py wsgi:app
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+EMOTIONS = ("enjoyment", "sadness", "anger", "fear", "disgust", "surprise", "other")
+
+# Prompt batch của AIBatchProcessor: "Phân tích cảm xúc cho N câu sau" rồi từng dòng "k. text"
+BATCH_COUNT_PATTERN = re.compile(r"cho (\d+) câu")
+BATCH_LINE_PATTERN = re.compile(r"^(\d+)\. (.*)$", re.MULTILINE)
+SINGLE_TEXT_PATTERN = re.compile(r'Câu: "(.*)"', re.DOTALL)
+
+
+def scores_for(text: str) -> Dict[str, int]:
+    """Tỉ lệ % 7 emotions (tổng 100) suy ra từ hash của text, cùng text luôn cho cùng kết quả"""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    weights = [digest[i] + 1 for i in range(len(EMOTIONS))]
+    # Một emotion trội để response giống model thật
+    weights[digest[7] % len(EMOTIONS)] *= 6
+    total = sum(weights)
+    scores = [weight * 100 // total for weight in weights]
+    scores[-1] += 100 - sum(scores)
+    return dict(zip(EMOTIONS, scores))
+
+
+class MockLLMConfig:
+    """Cấu hình latency và lỗi của mock server"""
+
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        per_item_ms: float = 5.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_seconds: float = 60.0,
+        truncate_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            latency_ms: Latency cơ sở của mỗi response
+            jitter_ms: Độ lệch chuẩn của latency (phân phối lognormal quanh latency_ms)
+            per_item_ms: Latency thêm cho mỗi text trong batch (mô phỏng sinh token)
+            error_rate: Tỉ lệ request trả 500
+            rate_limit_rate: Tỉ lệ request trả 429 kèm Retry-After
+            timeout_rate: Tỉ lệ request treo timeout_seconds (vượt quá LLM_CALL_TIMEOUT)
+            timeout_seconds: Thời gian treo của request timeout
+            truncate_rate: Tỉ lệ response batch bị cắt giữa chừng (JSON array không đóng)
+            seed: Seed cho lỗi và latency
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_item_ms = per_item_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.truncate_rate = truncate_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "items": 0, "errors": 0, "rate_limited": 0, "timeouts": 0, "truncated": 0}
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def latency(self, items: int) -> float:
+        with self.lock:
+            base = self.latency_ms
+            if self.jitter_ms > 0 and base > 0:
+                base *= self.rng.lognormvariate(0, self.jitter_ms / base)
+        return (base + self.per_item_ms * items) / 1000.0
+
+    def count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.stats[key] += amount
+
+
+def parse_texts(prompt: str) -> Optional[List[str]]:
+    """Các text trong prompt batch, None nếu là prompt một text"""
+    if not BATCH_COUNT_PATTERN.search(prompt):
+        return None
+    return [match.group(2) for match in BATCH_LINE_PATTERN.finditer(prompt)]
+
+
+def make_handler(config: MockLLMConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with config.lock:
+                    self._send_json(200, dict(config.stats))
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            prompt = body.get("messages", [{}])[-1].get("content", "")
+            texts = parse_texts(prompt)
+            items = len(texts) if texts is not None else 1
+            config.count("requests")
+            config.count("items", items)
+
+            draw = config.draw()
+            if draw < config.timeout_rate:
+                config.count("timeouts")
+                time.sleep(config.timeout_seconds)
+            draw -= config.timeout_rate
+            if 0 <= draw < config.rate_limit_rate:
+                config.count("rate_limited")
+                self._send_json(429, {"error": {"message": "rate limited"}}, {"Retry-After": "1"})
+                return
+            draw -= config.rate_limit_rate
+            if 0 <= draw < config.error_rate:
+                config.count("errors")
+                self._send_json(500, {"error": {"message": "injected error"}})
+                return
+
+            time.sleep(config.latency(items))
+
+            if texts is None:
+                match = SINGLE_TEXT_PATTERN.search(prompt)
+                content = json.dumps(scores_for(match.group(1) if match else prompt))
+            else:
+                content = json.dumps([{"i": i + 1, **scores_for(text)} for i, text in enumerate(texts)])
+                if len(texts) > 1 and config.draw() < config.truncate_rate:
+                    config.count("truncated")
+                    content = content[: len(content) * 2 // 3]
+
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(content) // 3, "total_tokens": (len(prompt) + len(content)) // 3},
+            })
+
+    return Handler
+
+
+class MockLLMServer:
+    """Mock server chạy trong background thread, dùng trong benchmarks.micro hoặc chạy riêng qua CLI"""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockLLMConfig()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.config))
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--per-item-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=60.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def config_from_args(args: argparse.Namespace) -> MockLLMConfig:
+    return MockLLMConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        per_item_ms=args.per_item_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        truncate_rate=args.truncate_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock LLM server OpenAI-compatible")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockLLMServer(config_from_args(args), args.host, args.port)
+    print(f"Mock LLM listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
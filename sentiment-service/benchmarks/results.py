@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Ghi và so sánh kết quả benchmark dạng JSON
+
+Usage:
+    python -m benchmarks.results baseline.json candidate.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+def latency_stats(latencies: Iterable[float]) -> Dict:
+    """p50/p95/p99/mean/max (ms) của các latency tính bằng giây"""
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+
+    def percentile(p: float) -> float:
+        # Nearest-rank, không nội suy để kết quả ổn định với ít mẫu
+        index = min(max(math.ceil(p / 100 * len(values)) - 1, 0), len(values) - 1)
+        return round(values[index] * 1000, 3)
+
+    return {
+        "count": len(values),
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> Dict:
+    """Thông tin máy và phiên bản thư viện để biết hai lần chạy có so sánh được không"""
+    env = {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import torch
+        env["torch"] = torch.__version__
+        env["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return env
+
+
+def write_results(path: Optional[str], benchmark: str, config: Dict, results: List[Dict]) -> Dict:
+    """
+    Ghi kết quả ra file JSON (bỏ qua nếu path rỗng) và trả về document
+
+    Mỗi result có "case" định danh duy nhất trong benchmark (ví dụ "forward/batch=32"),
+    "latency" từ latency_stats và "throughput" (texts/s hoặc requests/s)
+    """
+    document = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
+    return document
+
+
+def compare(baseline: Dict, candidate: Dict) -> List[Dict]:
+    """Chênh lệch (%) của các chỉ số latency và throughput giữa hai lần chạy cùng benchmark"""
+    baseline_results = {result["case"]: result for result in baseline["results"]}
+    rows = []
+    for result in candidate["results"]:
+        before = baseline_results.get(result["case"])
+        if before is None:
+            continue
+        row = {"case": result["case"]}
+        for field in ("p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get("latency", {}).get(field), result.get("latency", {}).get(field)
+            if old and new is not None:
+                row[field] = {"baseline": old, "candidate": new, "change_pct": round((new - old) / old * 100, 1)}
+        old, new = before.get("throughput"), result.get("throughput")
+        if old and new is not None:
+            row["throughput"] = {"baseline": old, "candidate": new, "change_pct": round((new - old) / old * 100, 1)}
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh hai file kết quả benchmark")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline["benchmark"] != candidate["benchmark"]:
+        raise SystemExit(f"Khác benchmark: {baseline['benchmark']} vs {candidate['benchmark']}")
+
+    print(json.dumps(compare(baseline, candidate), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Inference Engine cho local model
+Phần dùng chung của mọi route: fast path, result cache, chia đoạn text dài, micro-batcher của từng version
+và format kết quả. Không phụ thuộc Flask; api_service chỉ map lane/deadline của request và lỗi sang HTTP
+"""
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aggregation import EMOTION_LABELS, combine_chunks, scores_matrix
+from metrics import CACHE_LOOKUPS
+from micro_batcher import BatcherFull
+from segmentation import SegmentedTexts, TextSegmenter
+
+
+logger = logging.getLogger(__name__)
+
+
+# Scores của text rỗng trong output từng text: "other" với confidence 0
+EMPTY_TEXT_SCORES = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0], dtype=np.float32)
+
+
+def format_prediction(all_scores, processing_time):
+    """Chuyển 7 scores thành response format của /analyze"""
+    predicted_class = max(range(len(all_scores)), key=all_scores.__getitem__)
+    confidence = all_scores[predicted_class]
+
+    return {
+        "emotion_class": predicted_class,
+        "emotion": EMOTION_LABELS[predicted_class] if predicted_class < len(EMOTION_LABELS) else "other",
+        "confidence": round(confidence, 4),
+        "scores": [round(score, 4) for score in all_scores],  # Array of 7 scores
+        "processing_time": processing_time
+    }
+
+
+def model_method(version) -> str:
+    """method trong response khi scores do local model tính: "pytorch" với backend fp32, ngược lại tên backend"""
+    return "pytorch" if version.backend_name == "fp32" else version.backend_name
+
+
+def fill_items(count: int, indices: List[int], matrix: np.ndarray) -> np.ndarray:
+    """Ma trận (count, 7) với các hàng indices lấy từ matrix, các hàng còn lại (text rỗng) là EMPTY_TEXT_SCORES"""
+    items = np.tile(EMPTY_TEXT_SCORES, (count, 1))
+    items[indices] = matrix
+    return items
+
+
+class InferenceEngine:
+    """Chạy local model cho mọi version trong registry, các version dùng chung scheduler của registry"""
+
+    def __init__(
+        self,
+        registry,
+        result_cache,
+        fast_path=None,
+        long_text: bool = True,
+        long_text_max_chunks: int = 32,
+        shadow_priority: int = 2,
+    ):
+        """
+        Initialize Inference Engine
+
+        Args:
+            registry: ModelRegistry chứa các version
+            result_cache: ResultCache, key theo version.cache_model
+            fast_path: FastPath cho input tầm thường, None để tắt
+            long_text: Chia text vượt quá max_length thành đoạn thay vì truncate
+            long_text_max_chunks: Số đoạn tối đa mỗi text
+            shadow_priority: Priority của text fast path được model chạy lại (thấp hơn mọi lane)
+        """
+        self.registry = registry
+        self.result_cache = result_cache
+        self.fast_path = fast_path
+        self.long_text = long_text
+        self.long_text_max_chunks = long_text_max_chunks
+        self.shadow_priority = shadow_priority
+
+    def fast_path_lookup(self, texts: List[str], version) -> list:
+        """Kết quả fast path của từng text (None nếu phải chạy model); một phần nhỏ được model chạy lại trong nền"""
+        if self.fast_path is None:
+            return [None] * len(texts)
+        results = self.fast_path.lookup(texts)
+        for text, result in zip(texts, results):
+            if result is not None and version.ready and self.fast_path.should_shadow():
+                self._shadow_fast_path(text, result, version)
+        return results
+
+    def _shadow_fast_path(self, text: str, result, version):
+        """Chạy model cho text đã qua fast path với priority thấp nhất, không chờ kết quả"""
+        try:
+            future = version.batcher.submit(text, priority=self.shadow_priority)
+        except (BatcherFull, RuntimeError):
+            return
+
+        def compare(done):
+            if not done.cancelled() and done.exception() is None:
+                self.fast_path.record_shadow(result, done.result())
+
+        future.add_done_callback(compare)
+
+    def scores(
+        self,
+        texts: List[str],
+        version=None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+        use_fast_path: bool = True,
+    ) -> List[List[float]]:
+        """
+        Scores từng text: fast path, rồi cache, chỉ đưa các text chưa có vào batcher của version
+
+        Raises:
+            BatcherFull: Batcher đầy
+            DeadlineExceeded: Quá deadline khi đang chờ model
+        """
+        version = version or self.registry.default
+        if use_fast_path and self.fast_path is not None:
+            fast = self.fast_path_lookup(texts, version)
+            if any(result is not None for result in fast):
+                scores_list = [result.scores if result is not None else None for result in fast]
+                rest = [i for i, result in enumerate(fast) if result is None]
+                if rest:
+                    predicted = self.scores([texts[i] for i in rest], version, priority, deadline, use_fast_path=False)
+                    for i, scores in zip(rest, predicted):
+                        scores_list[i] = scores
+                return scores_list
+
+        scores_list = [self.result_cache.get(text, model=version.cache_model) for text in texts]
+        missing = [i for i, scores in enumerate(scores_list) if scores is None]
+        if len(missing) < len(texts):
+            CACHE_LOOKUPS.inc(len(texts) - len(missing), result="hit")
+        if missing:
+            CACHE_LOOKUPS.inc(len(missing), result="miss")
+
+            # Text trùng nhau trong cùng request chỉ chạy model một lần
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            scores = version.batcher.predict_many(unique_texts, priority=priority, deadline=deadline)
+            predicted = dict(zip(unique_texts, scores))
+            for text, scores in predicted.items():
+                self.result_cache.set(text, scores, model=version.cache_model)
+            for i in missing:
+                scores_list[i] = predicted[texts[i]]
+
+        return scores_list
+
+    def segment(self, texts: List[str], version) -> Optional[SegmentedTexts]:
+        """Chia text vượt quá max_length thành các đoạn, None nếu tắt long-text mode hoặc tokenizer chưa load"""
+        if not self.long_text or version.tokenization is None:
+            return None
+        segmented = TextSegmenter(version.tokenization, self.long_text_max_chunks).segment(texts)
+        return segmented if segmented.segmented else None
+
+    def scores_matrix(
+        self,
+        texts: List[str],
+        version=None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+        use_fast_path: bool = True,
+    ) -> np.ndarray:
+        """
+        Ma trận softmax (N, 7) không qua dict từng text
+
+        Đoạn của mọi text dài được đưa vào batcher cùng lúc nên một batch text dài vẫn chỉ tốn vài forward pass
+        """
+        version = version or self.registry.default
+        segmented = self.segment(texts, version)
+        if segmented is None:
+            return scores_matrix(self.scores(texts, version, priority, deadline, use_fast_path))
+        chunk_matrix = scores_matrix(self.scores(segmented.chunks, version, priority, deadline, use_fast_path))
+        return combine_chunks(chunk_matrix, segmented.starts, segmented.weights)
+
+    def predict(
+        self,
+        text: str,
+        version=None,
+        return_chunks: bool = False,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ) -> Dict:
+        """
+        Phân tích emotion cho văn bản với 7 classes
+
+        Text dài hơn max_length được chia đoạn, các đoạn chạy chung batch và gộp theo số token
+        """
+        start_time = time.time()
+        version = version or self.registry.default
+
+        fast = self.fast_path_lookup([text], version)[0]
+        if fast is not None:
+            result = format_prediction(fast.scores, round(time.time() - start_time, 4))
+            result.update({"method": "fast_path", "fast_path_rule": fast.rule})
+            return result
+
+        segmented = self.segment([text], version)
+        if segmented is None:
+            # Request được gom chung batch với các request đồng thời khác
+            all_scores = self.scores([text], version, priority, deadline, use_fast_path=False)[0]
+            result = format_prediction(all_scores, round(time.time() - start_time, 4))
+            result["method"] = model_method(version)
+            return result
+
+        chunk_scores = self.scores(segmented.chunks, version, priority, deadline, use_fast_path=False)
+        combined = combine_chunks(scores_matrix(chunk_scores), segmented.starts, segmented.weights)[0]
+        result = format_prediction(combined.astype(np.float64).tolist(), round(time.time() - start_time, 4))
+        result["method"] = model_method(version)
+        result["chunks_analyzed"] = len(segmented.chunks)
+        if return_chunks:
+            result["chunks"] = []
+            for (chunk, tokens), scores in zip(segmented.chunks_of(0), chunk_scores):
+                chunk_result = format_prediction(scores, None)
+                del chunk_result["processing_time"]
+                result["chunks"].append({"text": chunk, "tokens": tokens, **chunk_result})
+        return result
+
+    def predict_items(
+        self,
+        texts: List[str],
+        version=None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Ma trận (N, 7) theo đúng thứ tự texts, text rỗng là "other" không qua model
+
+        Mọi text không rỗng được đưa vào batcher cùng lúc
+        """
+        indices = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not indices:
+            return fill_items(len(texts), [], np.empty((0, len(EMOTION_LABELS)), dtype=np.float32))
+        matrix = self.scores_matrix([texts[i] for i in indices], version, priority, deadline)
+        return fill_items(len(texts), indices, matrix)
+
+    def embed(
+        self,
+        texts: List[str],
+        version=None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Ma trận scores (N, 7) và sentence embedding (N, hidden) chuẩn hoá L2 từ cùng một forward pass
+
+        Không qua fast path và result cache vì cần hidden state của model; scores vẫn được ghi vào cache.
+        Embedding của text dài là trung bình các đoạn theo số token
+
+        Raises:
+            BatcherFull: Batcher đầy
+            DeadlineExceeded: Quá deadline khi đang chờ model
+        """
+        version = version or self.registry.default
+        segmented = self.segment(texts, version)
+        chunks = segmented.chunks if segmented is not None else texts
+
+        unique_texts = list(dict.fromkeys(chunks))
+        outputs = dict(zip(unique_texts, version.embedding_batcher.predict_many(unique_texts, priority=priority, deadline=deadline)))
+        for text, (scores, _) in outputs.items():
+            self.result_cache.set(text, scores, model=version.cache_model)
+
+        matrix = scores_matrix([outputs[chunk][0] for chunk in chunks])
+        vectors = np.stack([outputs[chunk][1] for chunk in chunks]).astype(np.float32)
+        if segmented is not None:
+            matrix = combine_chunks(matrix, segmented.starts, segmented.weights)
+            vectors = combine_chunks(vectors, segmented.starts, segmented.weights)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+        return matrix, vectors
+
+    def embed_items(
+        self,
+        texts: List[str],
+        version=None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, List[int]]:
+        """Như predict_items kèm embedding; text rỗng có embedding 0, trả về thêm index các text không rỗng"""
+        indices = [i for i, text in enumerate(texts) if text and text.strip()]
+        if not indices:
+            empty = np.empty((0, len(EMOTION_LABELS)), dtype=np.float32)
+            return fill_items(len(texts), [], empty), np.zeros((len(texts), 0), dtype=np.float32), indices
+        matrix, vectors = self.embed([texts[i] for i in indices], version, priority, deadline)
+        embeddings = np.zeros((len(texts), vectors.shape[1]), dtype=np.float32)
+        embeddings[indices] = vectors
+        return fill_items(len(texts), indices, matrix), embeddings, indices
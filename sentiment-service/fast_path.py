@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Fast path trước model cho input tầm thường: emoji, link, câu rất ngắn ("ok", "haha", "cảm ơn"), chỉ có dấu câu
+Các input này không cần tokenizer + forward pass (hay một lần gọi LLM); kết quả lấy từ bảng tra cứu
+và chỉ được dùng khi confidence đạt ngưỡng. Một phần nhỏ kết quả fast path được chạy lại bằng model (shadow)
+để đo tỉ lệ trùng với model
+"""
+import random
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aggregation import EMOTION_LABELS, NUM_EMOTIONS
+from metrics import FAST_PATH, FAST_PATH_SHADOW
+
+# Emoji -> (emotion, độ mạnh); phần còn lại chia đều cho các emotion khác
+EMOJI_EMOTIONS: Dict[str, Tuple[str, float]] = {}
+for _emojis, _emotion, _strength in (
+    ("😀😃😄😁😆😂🤣😊😍🥰😘😗😙😚☺🙂😋😛😜🤪😝🤗🥳🤩😇😺😸😹😻💯🎉🎊🌹🌸💐", "enjoyment", 0.9),
+    ("❤🧡💛💚💙💜🤍💕💖💗💓💞💘💝♥👍👏🙌👌💪✨", "enjoyment", 0.85),
+    ("😎😅😉🔥🤤", "enjoyment", 0.7),
+    ("😢😭😞😔😟🙁☹😣😖😫😩🥺😿💔😥😓", "sadness", 0.85),
+    ("🥲😪", "sadness", 0.65),
+    ("😠😡🤬👿💢🖕", "anger", 0.9),
+    ("😤", "anger", 0.7),
+    ("😨😰😱😧🙀", "fear", 0.85),
+    ("😬", "fear", 0.6),
+    ("🤢🤮💩", "disgust", 0.85),
+    ("😒🙄👎", "disgust", 0.7),
+    ("😮😯😲😳🤯😦", "surprise", 0.85),
+    ("😵", "surprise", 0.6),
+    ("🤔😐😑😶🙃🤷🤨🫤👀", "other", 0.75),
+):
+    for _emoji in _emojis:
+        EMOJI_EMOTIONS.setdefault(_emoji, (_emotion, _strength))
+
+# Câu ngắn (đã chuẩn hoá: chữ thường, bỏ dấu câu) -> (emotion, độ mạnh)
+PHRASE_EMOTIONS: Dict[str, Tuple[str, float]] = {}
+for _phrases, _emotion, _strength in (
+    (("ok", "oke", "okie", "okay", "okela", "ừ", "ừm", "ừa", "uhm", "uh", "ờ", "dạ", "vâng", "được", "đc", "k",
+      "ko", "không", "hmm", "hm", "ủa ok", "rồi", "r", "oki"), "other", 0.85),
+    (("cảm ơn", "cám ơn", "cảm ơn bạn", "cảm ơn nhiều", "thanks", "thank you", "thank", "tks", "thks", "ty",
+      "tuyệt", "tuyệt vời", "đỉnh", "đỉnh quá", "xịn", "xịn quá", "ngon", "hay", "hay quá", "đẹp quá", "thích quá",
+      "yêu", "love", "good", "nice", "great", "cool", "vui quá", "zui", "vui"), "enjoyment", 0.85),
+    (("buồn", "buồn quá", "huhu", "hu hu", "hic", "hix", "chán", "chán quá", "tiếc quá", "sad", "mệt quá"), "sadness", 0.85),
+    (("bực", "bực mình", "tức", "tức quá", "điên", "cút", "im đi"), "anger", 0.8),
+    (("sợ", "sợ quá", "hết hồn", "sợ vãi"), "fear", 0.85),
+    (("eo", "ew", "tởm", "kinh tởm", "gớm"), "disgust", 0.8),
+    (("wow", "woa", "woah", "trời", "trời ơi", "trời đất", "omg", "thật á", "thật hả", "thiệt hả", "vậy hả",
+      "vậy á", "ủa", "hả"), "surprise", 0.8),
+):
+    for _phrase in _phrases:
+        PHRASE_EMOTIONS[_phrase] = (_emotion, _strength)
+
+# Emoticon dạng ký tự, so khớp trước khi bỏ dấu câu
+EMOTICON_EMOTIONS: Dict[str, Tuple[str, float]] = {
+    ":)": ("enjoyment", 0.8), ":))": ("enjoyment", 0.85), ":d": ("enjoyment", 0.85), "=)": ("enjoyment", 0.8),
+    "=))": ("enjoyment", 0.85), "<3": ("enjoyment", 0.85), "^^": ("enjoyment", 0.8), "^_^": ("enjoyment", 0.8),
+    "xd": ("enjoyment", 0.85), ":(": ("sadness", 0.8), ":((": ("sadness", 0.85), ":'(": ("sadness", 0.85),
+    "t_t": ("sadness", 0.85), ":o": ("surprise", 0.8), "o_o": ("surprise", 0.75), ">:(": ("anger", 0.8),
+    "-_-": ("other", 0.7), ":|": ("other", 0.75),
+}
+
+LAUGH_PATTERN = re.compile(r"^(?:(?:ha|he|hi|hj|hô|ka|ke)\s*){2,}$|^(?:lol|lmao|kkk+)$")
+URL_PATTERN = re.compile(r"^(?:https?://|www\.)\S+$", re.IGNORECASE)
+# Một emoji: ký tự emoji kèm skin tone / variation selector, các emoji nối bằng ZWJ tính là một
+EMOJI_CHARS = "\U0001F000-\U0001FAFF\u2600-\u27BF\u2300-\u23FF\u2B00-\u2BFF\u2190-\u21FF"
+EMOJI_MODIFIER_CHARS = "\uFE0F\U0001F3FB-\U0001F3FF"
+EMOJI_PATTERN = re.compile(
+    f"[{EMOJI_CHARS}][{EMOJI_MODIFIER_CHARS}]*(?:\u200D[{EMOJI_CHARS}][{EMOJI_MODIFIER_CHARS}]*)*"
+)
+EMOJI_MODIFIERS = re.compile(f"[{EMOJI_MODIFIER_CHARS}]")
+PUNCTUATION = re.compile(r"[^\w\s]", re.UNICODE)
+REPEATED = re.compile(r"(\w)\1+")
+
+# Text dài hơn số ký tự này (sau khi bỏ emoji và link) không phải input tầm thường
+MAX_PHRASE_CHARS = 24
+
+
+def emotion_vector(emotion: str, strength: float) -> np.ndarray:
+    vector = np.full(NUM_EMOTIONS, (1.0 - strength) / (NUM_EMOTIONS - 1), dtype=np.float64)
+    vector[EMOTION_LABELS.index(emotion)] = strength
+    return vector
+
+
+class FastPathResult:
+    """Kết quả fast path của một text: scores 7 emotions, rule đã dùng và confidence"""
+
+    __slots__ = ("scores", "rule", "confidence")
+
+    def __init__(self, scores: List[float], rule: str):
+        self.scores = scores
+        self.rule = rule
+        self.confidence = max(scores)
+
+    @property
+    def emotion_class(self) -> int:
+        return int(np.argmax(self.scores))
+
+
+class FastPath:
+    """
+    Phân loại input tầm thường không qua model
+
+    Rules: "empty" (chỉ khoảng trắng hoặc dấu câu), "url" (chỉ có link), "emoji" (chỉ có emoji/emoticon),
+    "phrase" (câu ngắn có trong bảng, có thể kèm emoji)
+    """
+
+    RULES = ("empty", "url", "emoji", "phrase")
+
+    def __init__(self, threshold: float = 0.7, shadow_rate: float = 0.01, seed: Optional[int] = None):
+        """
+        Initialize Fast Path
+
+        Args:
+            threshold: Confidence tối thiểu để dùng kết quả fast path thay cho model
+            shadow_rate: Tỉ lệ kết quả fast path được chạy lại bằng model để đo độ trùng
+            seed: Seed cho việc lấy mẫu shadow
+        """
+        self.threshold = threshold
+        self.shadow_rate = shadow_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.bypassed = {rule: 0 for rule in self.RULES}
+        self.below_threshold = 0
+        self.shadow = {rule: {"agree": 0, "disagree": 0} for rule in self.RULES}
+        self._vectors = {
+            key: emotion_vector(emotion, strength)
+            for table in (EMOJI_EMOTIONS, PHRASE_EMOTIONS, EMOTICON_EMOTIONS)
+            for key, (emotion, strength) in table.items()
+        }
+        self._uniform = np.full(NUM_EMOTIONS, 1.0 / NUM_EMOTIONS)
+
+    def classify(self, text: str) -> Optional[FastPathResult]:
+        """Kết quả từ bảng tra cứu, None nếu text không phải input tầm thường (không xét ngưỡng)"""
+        stripped = text.strip()
+        words = stripped.split()
+        if not PUNCTUATION.sub("", stripped).strip() and not EMOJI_PATTERN.search(stripped) \
+                and not any(word.lower() in EMOTICON_EMOTIONS for word in words):
+            return FastPathResult(self._uniform_other(), "empty")
+
+        if all(URL_PATTERN.match(word) for word in words):
+            return FastPathResult(self._uniform_other(), "url")
+
+        # Link đi kèm câu ngắn ("xem nè https://...") được bỏ qua, phần còn lại phải là emoji hoặc câu ngắn
+        rest = " ".join(word for word in words if not URL_PATTERN.match(word))
+        if len(rest) > MAX_PHRASE_CHARS * 2:
+            return None
+
+        vectors = []
+        unknown = 0
+        for match in EMOJI_PATTERN.finditer(rest):
+            vector = self._vectors.get(EMOJI_MODIFIERS.sub("", match.group()).split("\u200d")[0])
+            if vector is None:
+                unknown += 1
+            else:
+                vectors.append(vector)
+        rest = EMOJI_PATTERN.sub(" ", rest).lower()
+
+        phrase_words = []
+        for word in rest.split():
+            vector = self._vectors.get(word) if word in EMOTICON_EMOTIONS else None
+            if vector is not None:
+                vectors.append(vector)
+            else:
+                phrase_words.append(word)
+        phrase = " ".join(PUNCTUATION.sub(" ", " ".join(phrase_words)).split())
+
+        rule = "emoji"
+        if phrase:
+            if len(phrase) > MAX_PHRASE_CHARS:
+                return None
+            # "okeee", "huhuuu": thử lại sau khi rút chữ lặp ("good", "cool" vẫn khớp ở lần đầu)
+            candidates = (phrase, REPEATED.sub(r"\1\1", phrase), REPEATED.sub(r"\1", phrase))
+            matched = next((candidate for candidate in candidates if candidate in PHRASE_EMOTIONS), None)
+            if LAUGH_PATTERN.match(phrase):
+                vectors.append(self._vectors[":))"])
+            elif matched is not None:
+                vectors.append(self._vectors[matched])
+            else:
+                return None
+            rule = "phrase"
+
+        if not vectors:
+            return None
+        scores = np.mean(vectors, axis=0)
+        if unknown:
+            # Emoji không có trong bảng kéo kết quả về phân phối đều
+            coverage = len(vectors) / (len(vectors) + unknown)
+            scores = coverage * scores + (1 - coverage) * self._uniform
+        return FastPathResult(scores.tolist(), rule)
+
+    def _uniform_other(self) -> List[float]:
+        return emotion_vector("other", 0.95).tolist()
+
+    def lookup(self, texts: List[str]) -> List[Optional[FastPathResult]]:
+        """Kết quả fast path đạt ngưỡng cho từng text (None nếu phải chạy model), có ghi nhận thống kê"""
+        results: List[Optional[FastPathResult]] = []
+        below = 0
+        for text in texts:
+            result = self.classify(text)
+            if result is not None and result.confidence < self.threshold:
+                below += 1
+                result = None
+            results.append(result)
+
+        bypassed = [result.rule for result in results if result is not None]
+        for rule in set(bypassed):
+            FAST_PATH.inc(bypassed.count(rule), outcome=rule)
+        if below:
+            FAST_PATH.inc(below, outcome="below_threshold")
+        if len(texts) - len(bypassed) - below:
+            FAST_PATH.inc(len(texts) - len(bypassed) - below, outcome="miss")
+
+        with self._lock:
+            self.checked += len(texts)
+            self.below_threshold += below
+            for result in results:
+                if result is not None:
+                    self.bypassed[result.rule] += 1
+        return results
+
+    def should_shadow(self) -> bool:
+        if self.shadow_rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < self.shadow_rate
+
+    def record_shadow(self, result: FastPathResult, model_scores: List[float]):
+        """So sánh emotion của fast path với model trên cùng text"""
+        agree = int(np.argmax(model_scores)) == result.emotion_class
+        FAST_PATH_SHADOW.inc(rule=result.rule, result="agree" if agree else "disagree")
+        with self._lock:
+            self.shadow[result.rule]["agree" if agree else "disagree"] += 1
+        return agree
+
+    def stats(self) -> Dict:
+        with self._lock:
+            bypassed = sum(self.bypassed.values())
+            shadow_total = {rule: counts["agree"] + counts["disagree"] for rule, counts in self.shadow.items()}
+            return {
+                "threshold": self.threshold,
+                "shadow_rate": self.shadow_rate,
+                "checked": self.checked,
+                "bypassed": dict(self.bypassed),
+                "below_threshold": self.below_threshold,
+                "bypass_rate": round(bypassed / self.checked, 4) if self.checked else 0.0,
+                "shadow_agreement": {
+                    rule: round(self.shadow[rule]["agree"] / total, 4) if total else None
+                    for rule, total in shadow_total.items()
+                },
+                "shadow_samples": shadow_total,
+            }
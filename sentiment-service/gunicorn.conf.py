@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn config cho sentiment service
+Pre-fork nhiều workers, model load trước khi fork và số torch threads mỗi worker chia theo số cores
+"""
+import glob
+import os
+
+CPU_COUNT = os.cpu_count() or 1
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8000')}"
+
+# Số worker processes; workers × torch threads = số cores
+workers = int(os.environ.get("SENTIMENT_WORKERS", max(1, CPU_COUNT // 2)))
+TORCH_THREADS = int(os.environ.get("SENTIMENT_TORCH_THREADS", max(1, CPU_COUNT // workers)))
+
+# Mỗi worker nhận nhiều request đồng thời để micro-batcher có thể gom batch;
+# nhiều hơn số slot của admission control để request vượt quá được từ chối nhanh thay vì xếp hàng trong socket backlog
+worker_class = "gthread"
+threads = int(os.environ.get("SENTIMENT_REQUEST_THREADS", "32"))
+
+# Load model trong master trước khi fork
+preload_app = True
+
+timeout = int(os.environ.get("SENTIMENT_WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.environ.get("SENTIMENT_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
+
+# Đặt trước khi torch được import trong master để OpenMP/MKL không tạo thread pool theo số cores
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+# Tokenizer Rust đã được dùng trong master (parity check), tắt parallelism để tránh deadlock sau fork
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+# Mỗi worker ghi metrics vào thư mục chung để /metrics trả về số liệu của cả process group
+METRICS_DIR = os.environ.setdefault("SENTIMENT_METRICS_DIR", "/tmp/sentiment-metrics")
+
+
+def on_starting(server):
+    """Xoá snapshot metrics của lần chạy trước"""
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        os.remove(path)
+
+
+def post_fork(server, worker):
+    """Giới hạn intra-op threads của torch trong từng worker"""
+    import torch
+    import api_service
+    import logging_config
+
+    torch.set_num_threads(TORCH_THREADS)
+    # Log listener thread của master không tồn tại sau fork
+    logging_config.configure_logging()
+    # Job chạy trên worker threads của mọi worker, không đợi request đầu tiên
+    api_service.job_runner.ensure_started()
+    server.log.info(f"Worker {worker.pid}: torch threads = {TORCH_THREADS}")
+
+
+def worker_exit(server, worker):
+    """Trả job đang chạy về hàng đợi, chạy hết các batch đang chờ và ghi nốt rollups trước khi worker thoát"""
+    import api_service
+
+    api_service.job_runner.shutdown(timeout=graceful_timeout)
+    api_service.registry.shutdown(timeout=graceful_timeout)
+    api_service.rollup_recorder.shutdown()
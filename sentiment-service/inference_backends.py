@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Inference Backends cho local model
+Eager fp32, dynamic INT8 (torch) và ONNX Runtime, chọn bằng config lúc khởi động
+"""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+# Tập đánh giá cố định để so sánh backend với fp32 lúc khởi động
+EVAL_TEXTS = [
+    "Món này ngon quá! Tôi rất thích",
+    "Hôm nay được thưởng Tết, vui quá trời luôn 🥳",
+    "Cảm ơn mọi người đã đến dự sinh nhật mình, hạnh phúc lắm",
+    "Trận này đội nhà thắng đậm, đã thật sự",
+    "Buồn quá, tôi thất vọng lắm",
+    "Nhớ nhà ghê, xa mẹ cả năm rồi",
+    "Con mèo của mình mất rồi, không muốn làm gì nữa",
+    "Thi rớt nữa rồi, chán đời thật",
+    "Tôi rất tức giận về việc này",
+    "Shop giao sai hàng mà còn cãi, bực mình hết sức",
+    "Đừng có nói chuyện kiểu đó với tôi!",
+    "Kẹt xe cả tiếng đồng hồ, điên mất thôi",
+    "Sợ quá, không dám làm",
+    "Tối qua nghe tiếng động lạ ngoài cửa, run hết cả người",
+    "Mai phỏng vấn rồi mà lo quá không ngủ được",
+    "Đi đường tối một mình thấy ghê ghê sao ấy",
+    "Ghê tởm, kinh khủng",
+    "Quán này bẩn thỉu, thấy cả gián trong đồ ăn",
+    "Hành động đó thật đáng khinh bỉ",
+    "Nhìn cảnh đó mà muốn ói",
+    "Ủa thiệt hả trời?? bất ngờ ghê 😮",
+    "Không ngờ là anh ấy lại cầu hôn giữa phố",
+    "Trời ơi, trúng số thật á?",
+    "Wow, cái này mới ra mà đã hết hàng rồi sao",
+    "Mai họp lúc 9 giờ sáng nhé",
+    "Mình đang ở quận 3",
+    "Gửi mình file báo cáo tháng này với",
+    "ok",
+    "Bài viết này nói về lịch sử Việt Nam thế kỷ 19",
+    "haha",
+]
+
+BACKENDS = ("fp32", "int8", "onnx")
+
+
+def mean_pool(hidden: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """Trung bình hidden state cuối trên các token thật (bỏ padding), chuẩn hoá L2 để cosine là tích vô hướng"""
+    mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+    pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+    return torch.nn.functional.normalize(pooled, dim=-1)
+
+
+class InferenceBackend:
+    """Interface chung: nhận tensors đã pad, trả về logits"""
+
+    name = "base"
+    supports_embeddings = False
+
+    def logits(self, inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        raise NotImplementedError
+
+    def forward(self, inputs: Dict[str, torch.Tensor], pooled: bool = False) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """Logits và (nếu pooled) sentence embedding (batch, hidden) của cùng một forward pass"""
+        if pooled:
+            raise NotImplementedError(f"Backend {self.name} không hỗ trợ embedding")
+        return self.logits(inputs), None
+
+    def memory_bytes(self) -> int:
+        raise NotImplementedError
+
+    def info(self) -> Dict:
+        return {"name": self.name, "memory_mb": round(self.memory_bytes() / (1024 * 1024), 2)}
+
+
+class EagerBackend(InferenceBackend):
+    """PyTorch eager fp32"""
+
+    name = "fp32"
+    supports_embeddings = True
+
+    def __init__(self, model):
+        self.model = model
+        # Hidden state cuối của encoder được giữ lại qua hook khi thread hiện tại cần embedding,
+        # forward pass của thread khác (scheduler nhiều thread) không bị ảnh hưởng
+        self._capture = threading.local()
+        model.base_model.register_forward_hook(self._capture_hidden)
+
+    def _capture_hidden(self, module, args, output):
+        if getattr(self._capture, "active", False):
+            self._capture.hidden = output[0]
+
+    def logits(self, inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        with torch.inference_mode():
+            return self.model(**inputs).logits
+
+    def forward(self, inputs: Dict[str, torch.Tensor], pooled: bool = False) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        if not pooled:
+            return self.logits(inputs), None
+        self._capture.active = True
+        try:
+            logits = self.logits(inputs)
+            hidden = self._capture.hidden
+        finally:
+            self._capture.active = False
+            self._capture.hidden = None
+        return logits, mean_pool(hidden, inputs["attention_mask"])
+
+    def memory_bytes(self) -> int:
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in self.model.state_dict().values()
+            if isinstance(tensor, torch.Tensor)
+        )
+
+
+class DynamicInt8Backend(EagerBackend):
+    """PyTorch dynamic quantization: weights của các Linear layer lưu INT8"""
+
+    name = "int8"
+
+    def __init__(self, model):
+        quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        super().__init__(quantized)
+
+
+class _LogitsOnly(torch.nn.Module):
+    """Wrapper để ONNX graph chỉ có một output là logits"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+class OnnxBackend(InferenceBackend):
+    """Model export sang ONNX, chạy bằng onnxruntime (cần cài onnx và onnxruntime)"""
+
+    name = "onnx"
+    INPUT_NAMES = ["input_ids", "attention_mask"]
+
+    def __init__(self, model, onnx_path: str):
+        import onnxruntime  # Optional dependency
+
+        if not os.path.exists(onnx_path):
+            self.export(model, onnx_path)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.onnx_path = onnx_path
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    @classmethod
+    def export(cls, model, onnx_path: str):
+        """Export model sang ONNX với batch size và sequence length động"""
+        os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+        dummy = torch.ones((2, 8), dtype=torch.long)
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in cls.INPUT_NAMES}
+        dynamic_axes["logits"] = {0: "batch"}
+
+        logger.info("Exporting ONNX model to %s", onnx_path)
+        tmp_path = onnx_path + ".tmp"
+        # Wrapper mới tạo ở train mode, export khôi phục mode đó (đệ quy) sau khi xong: phải eval() trước,
+        # nếu không model fp32 bị để lại ở train mode (dropout bật)
+        with torch.no_grad():
+            torch.onnx.export(
+                _LogitsOnly(model).eval(),
+                (dummy, dummy),
+                tmp_path,
+                input_names=cls.INPUT_NAMES,
+                output_names=["logits"],
+                dynamic_axes=dynamic_axes,
+                opset_version=14,
+            )
+        os.replace(tmp_path, onnx_path)
+
+    def logits(self, inputs: Dict[str, torch.Tensor]) -> torch.Tensor:
+        feeds = {name: inputs[name].numpy().astype("int64") for name in self.INPUT_NAMES}
+        (logits,) = self.session.run(["logits"], feeds)
+        return torch.from_numpy(logits)
+
+    def memory_bytes(self) -> int:
+        return os.path.getsize(self.onnx_path)
+
+
+def create_backend(name: str, model, artifact_path: str) -> InferenceBackend:
+    """
+    Tạo backend theo tên
+
+    Args:
+        name: "fp32", "int8" hoặc "onnx"
+        model: Model fp32 đã load
+        artifact_path: Thư mục artifact, file ONNX được lưu trong đó
+    """
+    if name == "fp32":
+        return EagerBackend(model)
+    if name == "int8":
+        return DynamicInt8Backend(model)
+    if name == "onnx":
+        return OnnxBackend(model, os.path.join(artifact_path, "onnx", "model.onnx"))
+    raise ValueError(f"Backend {name} không được hỗ trợ. Chọn: {list(BACKENDS)}")
+
+
+def predict_labels(backend: InferenceBackend, tokenization, texts: List[str]) -> List[int]:
+    """Argmax của backend trên một batch texts"""
+    inputs = tokenization.tokenizer.pad(tokenization.encode(texts), padding=True, return_tensors="pt")
+    return torch.argmax(backend.logits(inputs), dim=-1).tolist()
+
+
+def check_agreement(reference: InferenceBackend, candidate: InferenceBackend, tokenization, texts: List[str] = EVAL_TEXTS) -> Dict:
+    """So sánh top-1 của candidate với reference (fp32) trên tập đánh giá cố định"""
+    reference_labels = predict_labels(reference, tokenization, texts)
+
+    start = time.perf_counter()
+    candidate_labels = predict_labels(candidate, tokenization, texts)
+    elapsed = time.perf_counter() - start
+
+    matches = sum(1 for a, b in zip(reference_labels, candidate_labels) if a == b)
+    return {
+        "agreement": round(matches / len(texts), 4),
+        "eval_texts": len(texts),
+        "eval_seconds": round(elapsed, 4),
+    }
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Job queue cho batch analysis bất đồng bộ
+Job và kết quả từng text lưu trong SQLite nên không mất khi restart; worker threads của mọi gunicorn worker
+nhận job qua lease, job của process đã chết được chạy tiếp từ các text chưa xong
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from metrics import JOB_ITEMS, JOBS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Trạng thái từng text
+PENDING = "pending"
+DONE = "done"
+SKIPPED = "skipped"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    callback_url TEXT,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+class JobStore:
+    """Truy cập SQLite, mỗi thread một connection"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            # Connection không dùng lại được sau fork
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, texts: List[str], params: Dict, callback_url: Optional[str] = None) -> Dict:
+        """Tạo job, text rỗng được đánh dấu skipped"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        statuses = [PENDING if text and text.strip() else SKIPPED for text in texts]
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, callback_url, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), callback_url, statuses.count(PENDING), now),
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, text, status) VALUES (?, ?, ?, ?)",
+                [(job_id, i, text or "", status) for i, (text, status) in enumerate(zip(texts, statuses))],
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job_from_row(row) if row else None
+
+    def items(self, job_id: str, offset: int = 0, limit: int = 100, status: Optional[str] = None) -> List[Dict]:
+        query = "SELECT idx, status, result FROM job_items WHERE job_id = ?"
+        args: list = [job_id]
+        if status:
+            query += " AND status = ?"
+            args.append(status)
+        query += " ORDER BY idx LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        return [
+            {"index": row["idx"], "status": row["status"], **(json.loads(row["result"]) if row["result"] else {})}
+            for row in self._connect().execute(query, args)
+        ]
+
+    def pending_items(self, job_id: str, limit: int) -> List[sqlite3.Row]:
+        return self._connect().execute(
+            "SELECT idx, text FROM job_items WHERE job_id = ? AND status = ? ORDER BY idx LIMIT ?",
+            (job_id, PENDING, limit),
+        ).fetchall()
+
+    def all_results(self, job_id: str) -> List[Dict]:
+        return [
+            json.loads(row["result"])
+            for row in self._connect().execute(
+                "SELECT result FROM job_items WHERE job_id = ? AND status = ? ORDER BY idx", (job_id, DONE)
+            )
+        ]
+
+    def claim(self, owner: str, lease_seconds: float) -> Optional[Dict]:
+        """Nhận job queued cũ nhất hoặc job running đã hết lease (process chạy nó đã chết)"""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = ?, lease_until = ?, attempts = attempts + 1,"
+                " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (RUNNING, owner, now + lease_seconds, now, row["id"]),
+            )
+        return self.get(row["id"])
+
+    def renew(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Gia hạn lease, False nếu job không còn thuộc owner (bị huỷ hoặc process khác đã nhận)"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+            (time.time() + lease_seconds, job_id, owner, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def release(self, job_id: str, owner: str):
+        """Trả job đang chạy về hàng đợi (khi worker shutdown)"""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, lease_owner = NULL, lease_until = NULL WHERE id = ? AND lease_owner = ? AND status = ?",
+            (QUEUED, job_id, owner, RUNNING),
+        )
+
+    def save_items(self, job_id: str, owner: str, results: Dict[int, Dict]) -> bool:
+        """Ghi kết quả các text, False nếu job không còn thuộc owner"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            owned = conn.execute(
+                "SELECT 1 FROM jobs WHERE id = ? AND lease_owner = ? AND status = ?", (job_id, owner, RUNNING)
+            ).fetchone()
+            if not owned:
+                return False
+            conn.executemany(
+                "UPDATE job_items SET status = ?, result = ? WHERE job_id = ? AND idx = ? AND status = ?",
+                [(DONE, json.dumps(result), job_id, idx, PENDING) for idx, result in results.items()],
+            )
+            conn.execute(
+                "UPDATE jobs SET completed = (SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status = ?) WHERE id = ?",
+                (job_id, DONE, job_id),
+            )
+        return True
+
+    def finish(self, job_id: str, owner: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL"
+            " WHERE id = ? AND lease_owner = ? AND status = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, owner, RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Huỷ job chưa xong; job đang chạy dừng sau sub-batch hiện tại"""
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, lease_owner = NULL, lease_until = NULL"
+            " WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING),
+        )
+        return self.get(job_id)
+
+    def count(self, status: str) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def purge(self, older_than: float) -> int:
+        """Xoá job đã kết thúc trước thời điểm older_than"""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [row["id"] for row in conn.execute(
+                f"SELECT id FROM jobs WHERE status IN ({','.join('?' * len(FINISHED))}) AND finished_at < ?",
+                (*FINISHED, older_than),
+            )]
+            for job_id in ids:
+                conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+
+def _job_from_row(row: sqlite3.Row) -> Dict:
+    job = {
+        "job_id": row["id"],
+        "status": row["status"],
+        "total": row["total"],
+        "completed": row["completed"],
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+        "attempts": row["attempts"],
+        "params": json.loads(row["params"]),
+        "callback_url": row["callback_url"],
+    }
+    if row["result"]:
+        job["result"] = json.loads(row["result"])
+    if row["error"]:
+        job["error"] = row["error"]
+    return job
+
+
+def sign_payload(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+class JobRunner:
+    """
+    Worker threads chạy job từ JobStore
+
+    process_chunk(texts, params) trả về list kết quả (dict) cùng thứ tự texts;
+    finalize(results, params) tính kết quả tổng hợp của job từ kết quả mọi text
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        process_chunk: Callable[[List[str], Dict], List[Dict]],
+        finalize: Callable[[List[Dict], Dict], Dict],
+        workers: int = 2,
+        chunk_size: int = 32,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 1.0,
+        retention_seconds: float = 7 * 24 * 3600,
+        max_attempts: int = 3,
+        callback_secret: str = "",
+        callback_timeout: float = 10.0,
+        callback_retries: int = 3,
+        ready: Optional[threading.Event] = None,
+    ):
+        """
+        Initialize Job Runner
+
+        Args:
+            store: JobStore dùng chung
+            process_chunk: Hàm chạy một sub-batch texts
+            finalize: Hàm tính kết quả tổng hợp của job
+            workers: Số worker threads mỗi process
+            chunk_size: Số text mỗi sub-batch, kết quả được lưu và job kiểm tra cancel sau mỗi sub-batch
+            lease_seconds: Thời gian giữ job không gia hạn trước khi process khác được nhận lại; lease được gia hạn
+                mỗi lease_seconds / 3 trong suốt thời gian chạy job nên chỉ hết khi process chết hoặc bị treo
+            poll_interval: Thời gian chờ (giây) khi hàng đợi rỗng
+            retention_seconds: Job đã kết thúc được giữ bao lâu trước khi xoá
+            max_attempts: Số lần nhận job tối đa (job làm process chết nhiều lần sẽ bị đánh dấu failed)
+            callback_secret: Nếu đặt, callback có header X-Signature là HMAC-SHA256 của body
+            callback_timeout: Timeout (giây) của mỗi lần gọi callback
+            callback_retries: Số lần gọi lại callback khi lỗi
+            ready: Event chờ trước khi nhận job (ví dụ model đã load)
+        """
+        self.store = store
+        self.process_chunk = process_chunk
+        self.finalize = finalize
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.max_attempts = max_attempts
+        self.callback_secret = callback_secret
+        self.callback_timeout = callback_timeout
+        self.callback_retries = callback_retries
+        self.ready = ready
+
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._running: Dict[str, str] = {}
+        self._wakeup = threading.Event()
+        self._last_purge = 0.0
+
+    def ensure_started(self):
+        """Khởi động worker threads (lazy, và khởi động lại nếu process đã fork)"""
+        pid = os.getpid()
+        if self.workers < 1 or self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._stop = threading.Event()
+            self._running = {}
+            self._threads = [
+                threading.Thread(target=self._run, args=(f"{pid}-{i}-{uuid.uuid4().hex[:8]}",), name=f"job-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def notify(self):
+        """Báo có job mới để worker không phải chờ hết poll_interval"""
+        self._wakeup.set()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Dừng nhận job; job đang chạy dừng sau sub-batch hiện tại và được trả về hàng đợi"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def _run(self, owner: str):
+        if self.ready is not None:
+            while not self.ready.wait(self.poll_interval):
+                if self._stop.is_set():
+                    return
+
+        while not self._stop.is_set():
+            try:
+                self._maybe_purge()
+                job = self.store.claim(owner, self.lease_seconds)
+            except sqlite3.Error as e:
+                logger.error("Cannot claim job: %s", e)
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._execute(job, owner)
+            except Exception as e:
+                logger.exception("Job %s failed", job["job_id"])
+                if self.store.finish(job["job_id"], owner, FAILED, error=str(e)):
+                    JOBS.inc(outcome=FAILED)
+                    self._send_callback(job["job_id"])
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        purged = self.store.purge(now - self.retention_seconds)
+        if purged:
+            logger.info("Purged %d finished jobs", purged)
+
+    def _execute(self, job: Dict, owner: str):
+        job_id, params = job["job_id"], job["params"]
+        if job["attempts"] > self.max_attempts:
+            if self.store.finish(job_id, owner, FAILED, error=f"Job abandoned after {job['attempts'] - 1} attempts"):
+                JOBS.inc(outcome=FAILED)
+                self._send_callback(job_id)
+            return
+
+        logger.info("Running job", extra={"job_id": job_id, "total": job["total"], "completed": job["completed"]})
+        with self._heartbeat(job_id, owner):
+            self._run_chunks(job_id, owner, params)
+
+    @contextmanager
+    def _heartbeat(self, job_id: str, owner: str):
+        """
+        Gia hạn lease bằng thread riêng trong khi job chạy: một sub-batch có thể lâu hơn lease
+        (chờ slot background, chờ model load, LLM timeout và retry)
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    if not self.store.renew(job_id, owner, self.lease_seconds):
+                        # Job đã bị huỷ, save_items của sub-batch hiện tại sẽ trả về False
+                        return
+                except sqlite3.Error as e:
+                    logger.error("Cannot renew lease of job %s: %s", job_id, e)
+
+        thread = threading.Thread(target=beat, name=f"job-heartbeat-{job_id[:8]}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _run_chunks(self, job_id: str, owner: str, params: Dict):
+        while True:
+            if self._stop.is_set():
+                self.store.release(job_id, owner)
+                return
+
+            rows = self.store.pending_items(job_id, self.chunk_size)
+            if not rows:
+                break
+
+            results = self.process_chunk([row["text"] for row in rows], params)
+            if not self.store.save_items(job_id, owner, {row["idx"]: result for row, result in zip(rows, results)}):
+                # Job đã bị huỷ hoặc lease đã hết và process khác đã nhận
+                return
+            JOB_ITEMS.inc(len(rows))
+            if not self.store.renew(job_id, owner, self.lease_seconds):
+                return
+
+        result = self.finalize(self.store.all_results(job_id), params)
+        if self.store.finish(job_id, owner, SUCCEEDED, result=result):
+            JOBS.inc(outcome=SUCCEEDED)
+            logger.info("Job finished", extra={"job_id": job_id})
+            self._send_callback(job_id)
+
+    def _send_callback(self, job_id: str):
+        job = self.store.get(job_id)
+        if not job or not job.get("callback_url"):
+            return
+
+        payload = {key: job.get(key) for key in ("job_id", "status", "total", "completed", "result", "error")}
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.callback_secret:
+            headers["X-Signature"] = sign_payload(self.callback_secret, body)
+
+        for attempt in range(self.callback_retries + 1):
+            try:
+                # Không theo redirect: host đích phải là host đã kiểm tra lúc submit
+                response = requests.post(
+                    job["callback_url"], data=body, headers=headers, timeout=self.callback_timeout, allow_redirects=False
+                )
+                if response.status_code < 500:
+                    return
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt < self.callback_retries:
+                time.sleep(min(2 ** attempt, 30))
+        logger.warning("Callback for job %s failed: %s", job_id, error)
+
+
+def callback_allowed(url: str, allowed_hosts: List[str]) -> bool:
+    """
+    URL callback hợp lệ: http(s) và host nằm trong allowed_hosts
+
+    Không có allowed_hosts thì không nhận callback nào: /jobs nhận request từ bên ngoài, callback tới host tuỳ ý
+    cho phép gửi request (có chữ ký) tới các host nội bộ
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    return parsed.hostname.lower() in allowed_hosts
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Logging cho sentiment service
+Log có cấu trúc (JSON hoặc text) theo level, sampling log dưới WARNING và ghi qua hàng đợi
+để I/O không nằm trên request thread
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Optional
+
+
+# Các attribute chuẩn của LogRecord, phần còn lại (truyền qua extra=) là field có cấu trúc
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    """Một dòng JSON cho mỗi log record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        payload.update(_extra_fields(record))
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Format dễ đọc cho local dev, field có cấu trúc nối thêm dạng key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Giữ mọi log từ WARNING trở lên, log thấp hơn chỉ giữ theo tỉ lệ sample_rate
+
+    Một log có thể đặt tỉ lệ riêng qua extra={"sample_rate": ...}
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, "sample_rate", self.sample_rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Bỏ log khi hàng đợi đầy thay vì chặn request thread"""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+_pid: Optional[int] = None
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None, sample_rate: Optional[float] = None, queue_size: int = 10000):
+    """
+    Cấu hình root logger một lần cho mỗi process (gọi lại sau fork để khởi động lại listener thread)
+
+    Args:
+        level: Log level, mặc định SENTIMENT_LOG_LEVEL hoặc INFO
+        fmt: "json" hoặc "text", mặc định SENTIMENT_LOG_FORMAT hoặc json
+        sample_rate: Tỉ lệ giữ log dưới WARNING, mặc định SENTIMENT_LOG_SAMPLE_RATE hoặc 1.0
+        queue_size: Số log tối đa chờ ghi, vượt quá thì bỏ
+    """
+    global _listener, _handler, _pid
+
+    pid = os.getpid()
+    if _pid == pid:
+        return
+
+    level = level or os.environ.get("SENTIMENT_LOG_LEVEL", "INFO")
+    fmt = fmt or os.environ.get("SENTIMENT_LOG_FORMAT", "json")
+    if sample_rate is None:
+        sample_rate = float(os.environ.get("SENTIMENT_LOG_SAMPLE_RATE", "1.0"))
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    if _handler is not None:
+        # Listener của process cha không tồn tại sau fork, chỉ cần thay handler
+        root.removeHandler(_handler)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    _handler = handler
+    _pid = pid
+    atexit.register(_stop_listener, pid)
+
+
+def _stop_listener(pid: int):
+    """Ghi nốt log còn trong hàng đợi khi process thoát"""
+    if _listener is not None and _pid == pid == os.getpid():
+        _listener.stop()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Theo dõi bộ nhớ của process
+RSS hiện tại (/proc/self/statm), peak RSS (getrusage) và RSS sau forward pass theo batch size
+để chọn số worker và max tokens mỗi batch vừa với RAM của instance
+"""
+import bisect
+import os
+import resource
+import sys
+import threading
+from typing import Dict, Optional
+
+from metrics import BATCH_SIZE_BUCKETS
+
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# ru_maxrss tính bằng KB trên Linux, bytes trên macOS
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss_bytes() -> int:
+    """Peak RSS của process từ lúc khởi động (với worker fork từ master là peak kể từ lúc fork)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+def rss_bytes() -> int:
+    """RSS hiện tại, dùng peak RSS nếu không có /proc"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def process_memory() -> Dict:
+    return {"pid": os.getpid(), "rss_bytes": rss_bytes(), "peak_rss_bytes": peak_rss_bytes()}
+
+
+class BatchMemoryTracker:
+    """
+    RSS sau từng forward pass, gom theo bucket batch size
+
+    Mỗi bucket giữ số batch, số token (sau padding) lớn nhất, RSS lớn nhất ngay sau forward
+    và tổng phần peak RSS tăng lên trong các batch của bucket (batch size nào đẩy peak lên)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._buckets: Dict[int, Dict[str, int]] = {}
+        self._last_peak: Optional[int] = None
+
+    @staticmethod
+    def bucket_of(batch_size: int) -> int:
+        index = bisect.bisect_left(BATCH_SIZE_BUCKETS, batch_size)
+        return BATCH_SIZE_BUCKETS[index] if index < len(BATCH_SIZE_BUCKETS) else batch_size
+
+    def observe(self, batch_size: int, tokens: int):
+        rss, peak = rss_bytes(), peak_rss_bytes()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Worker fork từ master: số liệu của master không còn đúng
+                self._pid = os.getpid()
+                self._buckets = {}
+                self._last_peak = None
+            raised = peak - self._last_peak if self._last_peak is not None else 0
+            self._last_peak = peak
+
+            stats = self._buckets.setdefault(self.bucket_of(batch_size), {
+                "batches": 0, "max_tokens": 0, "max_rss_bytes": 0, "peak_raised_bytes": 0,
+            })
+            stats["batches"] += 1
+            stats["max_tokens"] = max(stats["max_tokens"], tokens)
+            stats["max_rss_bytes"] = max(stats["max_rss_bytes"], rss)
+            stats["peak_raised_bytes"] += max(raised, 0)
+
+    def snapshot(self) -> Dict[int, Dict[str, int]]:
+        with self._lock:
+            if self._pid != os.getpid():
+                return {}
+            return {bucket: dict(stats) for bucket, stats in sorted(self._buckets.items())}
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics cho sentiment service theo Prometheus text format
+Counter, Gauge, Histogram có labels; mỗi gunicorn worker ghi snapshot ra thư mục chung để /metrics gộp cả process group
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """Metric có labels, giá trị lưu theo tuple label values"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} cần labels {self.label_names}, nhận {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {"type": self.type, "help": self.documentation, "labels": list(self.label_names), "samples": samples}
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    """Histogram với bucket cố định; mỗi label set lưu [count từng bucket..., +Inf, sum]"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = [[list(key), list(counts)] for key, counts in self._values.items()]
+        return {
+            "type": self.type,
+            "help": self.documentation,
+            "labels": list(self.label_names),
+            "buckets": list(self.buckets),
+            "samples": samples,
+        }
+
+
+class MetricsRegistry:
+    """
+    Tập metrics của process
+
+    Khi có multiprocess_dir, mỗi process ghi snapshot ra <dir>/<pid>.json (định kỳ và khi bị scrape),
+    render() gộp snapshot của mọi process: counter/histogram cộng dồn kể cả process đã thoát,
+    gauge chỉ lấy từ process còn sống
+    """
+
+    def __init__(self, multiprocess_dir: Optional[str] = None, flush_interval: float = 5.0):
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._flusher_pid: Optional[int] = None
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} đã được đăng ký")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Hàm cập nhật gauge ngay trước khi snapshot (ví dụ độ dài hàng đợi)"""
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                pass
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def ensure_flusher(self):
+        """Khởi động thread ghi snapshot định kỳ (lazy, và khởi động lại nếu process đã fork)"""
+        pid = os.getpid()
+        if not self.multiprocess_dir or self._flusher_pid == pid:
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def flush(self):
+        """Ghi snapshot của process hiện tại ra thư mục multiprocess"""
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        path = os.path.join(self.multiprocess_dir, f"{os.getpid()}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _process_snapshots(self) -> List[Tuple[bool, Dict]]:
+        """(process còn sống, snapshot) của mọi process trong thư mục multiprocess"""
+        if not self.multiprocess_dir:
+            return [(True, self.snapshot())]
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.multiprocess_dir, "*.json")):
+            try:
+                pid = int(os.path.basename(path)[:-len(".json")])
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((_pid_alive(pid), snapshot))
+        return snapshots
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        merged: Dict[str, Dict] = {}
+        for alive, snapshot in self._process_snapshots():
+            for name, metric in snapshot.items():
+                if metric["type"] == "gauge" and not alive:
+                    continue
+                target = merged.setdefault(name, {**metric, "samples": {}})
+                for labels, value in metric["samples"]:
+                    key = tuple(labels)
+                    if isinstance(value, list):
+                        current = target["samples"].get(key)
+                        target["samples"][key] = [a + b for a, b in zip(current, value)] if current else list(value)
+                    else:
+                        target["samples"][key] = target["samples"].get(key, 0.0) + value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric["samples"].items()):
+                labels = metric["labels"]
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+                    continue
+
+                cumulative = 0
+                bounds = [_format_value(bound) for bound in metric["buckets"]] + ["+Inf"]
+                for bound, count in zip(bounds, value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, key, ('le', bound))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels, key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Registry dùng chung của process, thư mục multiprocess lấy từ env để mọi gunicorn worker dùng chung
+REGISTRY = MetricsRegistry(os.environ.get("SENTIMENT_METRICS_DIR") or None)
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "sentiment_request_seconds", "End-to-end HTTP request latency", ["endpoint", "status"]
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "sentiment_requests_in_flight", "HTTP requests currently being processed", ["endpoint"]
+)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "sentiment_queue_wait_seconds", "Time a text waits in the micro-batcher queue before its forward pass", ["model"]
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "sentiment_queue_depth", "Texts waiting in the micro-batcher queue", ["model"]
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "sentiment_stage_seconds", "Local model latency per stage (tokenize, forward, postprocess) per batch", ["model", "stage"]
+)
+BATCH_SIZE = REGISTRY.histogram(
+    "sentiment_batch_size", "Texts per micro-batch forward pass", ["model"], buckets=BATCH_SIZE_BUCKETS
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "sentiment_cache_lookups_total", "Result cache lookups by result (hit or miss)", ["result"]
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "sentiment_llm_call_seconds", "LLM provider call latency", ["provider", "outcome"]
+)
+LLM_IN_FLIGHT = REGISTRY.gauge(
+    "sentiment_llm_calls_in_flight", "LLM provider calls currently in flight", ["provider"]
+)
+FALLBACKS = REGISTRY.counter(
+    "sentiment_fallbacks_total", "Texts or requests served by a fallback path, by reason", ["reason"]
+)
+ADMISSIONS = REGISTRY.counter(
+    "sentiment_admission_total", "Admission decisions by lane and outcome (admitted, queue_full, queue_timeout, deadline_exceeded, batcher_full)", ["lane", "outcome"]
+)
+ADMISSION_WAITING = REGISTRY.gauge(
+    "sentiment_admission_waiting", "Requests waiting for a model slot", ["lane"]
+)
+JOBS = REGISTRY.counter(
+    "sentiment_jobs_total", "Asynchronous batch jobs by outcome (submitted, succeeded, failed, cancelled)", ["outcome"]
+)
+JOB_ITEMS = REGISTRY.counter(
+    "sentiment_job_items_total", "Texts processed by asynchronous batch jobs"
+)
+FAST_PATH = REGISTRY.counter(
+    "sentiment_fast_path_total", "Texts checked by the pre-model fast path by outcome (rule used, below_threshold or miss)", ["outcome"]
+)
+FAST_PATH_SHADOW = REGISTRY.counter(
+    "sentiment_fast_path_shadow_total", "Sampled fast path results re-scored by the model, by rule and agreement", ["rule", "result"]
+)
+PROCESS_RSS = REGISTRY.gauge(
+    "sentiment_process_rss_bytes", "Resident memory of each worker process", ["pid"]
+)
+PROCESS_PEAK_RSS = REGISTRY.gauge(
+    "sentiment_process_peak_rss_bytes", "Peak resident memory of each worker process", ["pid"]
+)
+FORWARD_RSS = REGISTRY.gauge(
+    "sentiment_forward_rss_bytes", "Max resident memory right after a forward pass, by worker, model and batch size bucket", ["pid", "model", "batch_size"]
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "sentiment_startup_seconds", "Duration of each startup phase of the process that loaded the models", ["pid", "phase"]
+)
+INDEX_QUERY_SECONDS = REGISTRY.histogram(
+    "sentiment_index_query_seconds", "Similarity index query latency, by index kind", ["kind"]
+)
+INDEX_BUILD_SECONDS = REGISTRY.gauge(
+    "sentiment_index_build_seconds", "Duration of the last similarity index build of each worker, by model", ["pid", "model"]
+)
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+Micro Batcher cho local model
+Gom các request đến gần nhau về thời gian thành một batch để chạy một forward pass duy nhất.
+Các batcher (mỗi version model một batcher) có thể dùng chung một BatchScheduler để mọi model
+chạy trên cùng một pool thread thay vì mỗi model một thread tranh CPU
+"""
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from queue import PriorityQueue, Empty
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class BatcherFull(Exception):
+    """Hàng đợi đã đủ max_pending text"""
+
+
+class DeadlineExceeded(Exception):
+    """Text hết deadline trước khi được chạy"""
+
+
+# Sentinel của shutdown xếp sau mọi priority
+_SHUTDOWN_PRIORITY = float("inf")
+
+
+class MicroBatcher:
+    """Gom các text đang chờ thành batch và trả kết quả về cho từng request"""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[str]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        on_batch: Optional[Callable[[int, List[float]], None]] = None,
+        max_pending: int = 0,
+        scheduler: Optional["BatchScheduler"] = None,
+    ):
+        """
+        Initialize Micro Batcher
+
+        Args:
+            predict_fn: Hàm nhận list texts và trả về list kết quả cùng thứ tự
+            max_batch_size: Số text tối đa trong một lần forward pass
+            max_wait_ms: Thời gian tối đa (ms) chờ gom thêm text sau khi nhận text đầu tiên
+            on_batch: Hàm nhận kích thước batch và thời gian chờ trong hàng đợi (giây) của từng text
+            max_pending: Số text chờ tối đa, vượt quá thì submit raise BatcherFull (0 = không giới hạn)
+            scheduler: Scheduler dùng chung, None thì batcher chạy worker thread riêng
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size phải >= 1")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0) / 1000.0
+        self.on_batch = on_batch
+        self.max_pending = max_pending
+
+        # (priority, thứ tự submit, (text, future, thời điểm submit, deadline)): priority nhỏ chạy trước, cùng priority thì FIFO
+        self._queue: PriorityQueue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._closed = False
+        self._drained = threading.Event()
+
+        self.scheduler = scheduler
+        if scheduler is not None:
+            scheduler.register(self)
+
+    def submit(self, text: str, priority: int = 0, deadline: Optional[float] = None) -> Future:
+        """
+        Đưa một text vào hàng đợi, trả về Future chứa kết quả
+
+        Args:
+            text: Text cần chạy
+            priority: Text có priority nhỏ hơn được đưa vào batch trước
+            deadline: time.monotonic() mà sau đó text bị bỏ thay vì chạy
+        """
+        return self.submit_many([text], priority, deadline)[0]
+
+    def submit_many(self, texts: List[str], priority: int = 0, deadline: Optional[float] = None) -> List[Future]:
+        """Đưa nhiều text vào hàng đợi cùng lúc để chúng được gom chung batch (nhận hết hoặc raise BatcherFull)"""
+        if self._closed:
+            raise RuntimeError("MicroBatcher đã shutdown")
+        self._ensure_worker()
+        if self.max_pending and self._queue.qsize() + len(texts) > self.max_pending:
+            raise BatcherFull(f"Hàng đợi đã có {self._queue.qsize()}/{self.max_pending} texts")
+
+        now = time.monotonic()
+        futures = []
+        for text in texts:
+            future: Future = Future()
+            self._queue.put((priority, next(self._sequence), (text, future, now, deadline)))
+            futures.append(future)
+        if self.scheduler is not None:
+            self.scheduler.notify()
+        return futures
+
+    def predict(self, text: str, timeout: Optional[float] = None, priority: int = 0, deadline: Optional[float] = None) -> Any:
+        """Chờ kết quả cho một text"""
+        return self.predict_many([text], timeout, priority, deadline)[0]
+
+    def predict_many(self, texts: List[str], timeout: Optional[float] = None, priority: int = 0, deadline: Optional[float] = None) -> List[Any]:
+        """Chờ kết quả cho nhiều text, giữ nguyên thứ tự đầu vào; raise DeadlineExceeded khi quá deadline"""
+        futures = self.submit_many(texts, priority, deadline)
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        wait_until = time.monotonic() + timeout if timeout is not None else None
+        try:
+            return [
+                future.result(timeout=None if wait_until is None else max(wait_until - time.monotonic(), 0.0))
+                for future in futures
+            ]
+        except FutureTimeoutError:
+            # Text chưa chạy được bỏ khỏi batch tiếp theo
+            for future in futures:
+                future.cancel()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("Deadline exceeded while waiting for the model")
+            raise
+
+    def pending(self) -> int:
+        """Số text đang chờ trong hàng đợi"""
+        return self._queue.qsize()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        Ngừng nhận text mới và chờ worker xử lý hết các text đang chờ
+
+        Args:
+            timeout: Thời gian tối đa (giây) chờ drain hàng đợi
+        """
+        with self._lock:
+            self._closed = True
+            worker = self._worker if self._worker_pid == os.getpid() else None
+
+        if self.scheduler is not None:
+            if self._worker_pid == os.getpid():
+                self._queue.put((_SHUTDOWN_PRIORITY, next(self._sequence), None))
+                self.scheduler.notify()
+                self._drained.wait(timeout)
+            self.scheduler.unregister(self)
+        elif worker is not None and worker.is_alive():
+            # Sentinel nằm sau tất cả text đã submit nên các batch đang chờ vẫn được chạy
+            self._queue.put((_SHUTDOWN_PRIORITY, next(self._sequence), None))
+            worker.join(timeout)
+
+        # Text submit đồng thời với shutdown (sau sentinel) sẽ không được chạy
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Empty:
+                break
+            if item[2] is not None:
+                item[2][1].set_exception(RuntimeError("MicroBatcher đã shutdown"))
+
+    def _ensure_worker(self):
+        """Khởi động worker thread (lazy, và khởi động lại nếu process đã fork)"""
+        pid = os.getpid()
+        if self.scheduler is not None:
+            with self._lock:
+                if self._worker_pid != pid:
+                    self._queue = PriorityQueue()
+                    self._worker_pid = pid
+            self.scheduler.ensure_started()
+            return
+        if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if self._worker is not None and self._worker_pid == pid and self._worker.is_alive():
+                return
+            if self._worker_pid != pid:
+                # Thread không tồn tại sau fork, queue cũ có thể giữ lock của process cha
+                self._queue = PriorityQueue()
+            self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._worker_pid = pid
+            self._worker.start()
+
+    def head(self) -> Optional[Tuple[float, float]]:
+        """(priority, thời điểm submit) của text đầu hàng đợi, None nếu hàng đợi rỗng"""
+        with self._queue.mutex:
+            if not self._queue.queue:
+                return None
+            priority, _, item = self._queue.queue[0]
+        return (priority, item[2] if item is not None else 0.0)
+
+    def _collect_batch(self, block: bool = True) -> Tuple[List[Tuple[str, Future, float, Optional[float]]], bool]:
+        """
+        Chờ text đầu tiên (hoặc trả về batch rỗng ngay nếu block=False và hàng đợi rỗng),
+        sau đó gom thêm cho tới khi đủ batch hoặc hết thời gian chờ
+
+        Returns:
+            (batch, stop) với stop=True khi gặp sentinel của shutdown
+        """
+        try:
+            item = self._queue.get(block)[2]
+        except Empty:
+            return [], False
+        if item is None:
+            self._drained.set()
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)[2]
+                else:
+                    item = self._queue.get_nowait()[2]
+            except Empty:
+                break
+            if item is None:
+                self._drained.set()
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _run(self):
+        """Vòng lặp của worker thread"""
+        while True:
+            batch, stop = self._collect_batch()
+            if batch:
+                self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch: List[Tuple[str, Future, float, Optional[float]]]):
+        """Chạy predict_fn cho cả batch và trả kết quả về từng Future"""
+        now = time.monotonic()
+        runnable = []
+        for item in batch:
+            if not item[1].set_running_or_notify_cancel():
+                continue
+            if item[3] is not None and item[3] <= now:
+                # Caller không còn chờ kết quả, không tốn forward pass cho text này
+                item[1].set_exception(DeadlineExceeded("Deadline exceeded in the batch queue"))
+                continue
+            runnable.append(item)
+        batch = runnable
+        if not batch:
+            return
+
+        if self.on_batch is not None:
+            try:
+                self.on_batch(len(batch), [now - enqueued_at for _, _, enqueued_at, _ in batch])
+            except Exception:
+                pass  # Lỗi khi ghi metrics không được làm hỏng batch
+
+        texts = [text for text, _, _, _ in batch]
+        try:
+            results = self.predict_fn(texts)
+            if len(results) != len(texts):
+                raise RuntimeError(f"predict_fn trả về {len(results)} kết quả cho {len(texts)} texts")
+        except Exception as e:
+            for _, future, _, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _, _), result in zip(batch, results):
+            future.set_result(result)
+
+
+class BatchScheduler:
+    """
+    Pool thread dùng chung cho nhiều MicroBatcher
+
+    Mỗi lần rảnh, một thread chọn batcher có text đầu hàng đợi ưu tiên nhất (priority nhỏ nhất,
+    cùng priority thì text chờ lâu nhất), gom batch của batcher đó và chạy forward pass.
+    Với workers=1 các model chạy lần lượt, không tranh intra-op threads của torch với nhau
+    """
+
+    def __init__(self, workers: int = 1):
+        """
+        Initialize Batch Scheduler
+
+        Args:
+            workers: Số thread chạy forward pass đồng thời cho mọi model
+        """
+        self.workers = max(1, workers)
+        self._batchers: List[MicroBatcher] = []
+        self._condition = threading.Condition()
+        self._start_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+
+    def register(self, batcher: MicroBatcher):
+        with self._condition:
+            self._batchers.append(batcher)
+
+    def unregister(self, batcher: MicroBatcher):
+        with self._condition:
+            if batcher in self._batchers:
+                self._batchers.remove(batcher)
+
+    def notify(self):
+        """Báo có text mới (hoặc sentinel shutdown) trong một batcher"""
+        self.ensure_started()
+        with self._condition:
+            self._condition.notify()
+
+    def ensure_started(self):
+        """Khởi động các thread (lazy, và khởi động lại nếu process đã fork)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            if self._pid is not None:
+                # Sau fork, lock của condition có thể đang bị thread của process cha giữ
+                self._condition = threading.Condition()
+            self._threads = [
+                threading.Thread(target=self._run, name=f"batch-scheduler-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            self._pid = pid
+            for thread in self._threads:
+                thread.start()
+
+    def _next_batcher(self) -> Optional[MicroBatcher]:
+        best, best_head = None, None
+        for batcher in self._batchers:
+            head = batcher.head()
+            if head is not None and (best_head is None or head < best_head):
+                best, best_head = batcher, head
+        return best
+
+    def _run(self):
+        """Vòng lặp của thread: chờ tới khi có batcher có text rồi chạy một batch của batcher đó"""
+        while True:
+            with self._condition:
+                batcher = self._next_batcher()
+                while batcher is None:
+                    self._condition.wait()
+                    batcher = self._next_batcher()
+
+            batch, _ = batcher._collect_batch(block=False)
+            if batch:
+                batcher._process(batch)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                "workers": self.workers,
+                "batchers": len(self._batchers),
+                "pending": sum(batcher.pending() for batcher in self._batchers),
+            }
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Model Loader cho sentiment service
+Giữ model trong thư mục artifact local (pin theo revision, kiểm tra checksum) thay vì tải lại mỗi lần khởi động.
+Weights được load bằng mmap từ một file trong thư mục artifact nên mọi process trên host
+(gunicorn workers, backfill) dùng chung page cache thay vì mỗi process một bản copy
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import torch
+from transformers import AutoConfig, AutoModelForSequenceClassification
+
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST_FILE = ".manifest.json"
+SAFETENSORS_WEIGHTS = "model.safetensors"
+PYTORCH_WEIGHTS = "pytorch_model.bin"
+# State dict (kể cả buffer non-persistent) theo format torch.save, load bằng torch.load(mmap=True)
+MMAP_WEIGHTS = "model.mmap.pt"
+
+
+def default_artifact_dir() -> str:
+    """Thư mục chứa model artifacts, mặc định là sentiment-service/models"""
+    return os.environ.get("SENTIMENT_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+
+
+def env_flag(name: str, default: str = "0") -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def sha256_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Tính sha256 của file theo từng chunk"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_entry(path: str, checksum: Optional[str] = None) -> Dict:
+    """Entry manifest của một file: sha256 (tính nếu chưa có), size và mtime"""
+    stat = os.stat(path)
+    return {"sha256": checksum or sha256_file(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _manifest_entry(entry) -> Optional[Dict]:
+    # Manifest cũ chỉ lưu sha256 dạng chuỗi
+    return {"sha256": entry} if isinstance(entry, str) else entry
+
+
+def _stat_matches(path: str, entry: Dict) -> bool:
+    stat = os.stat(path)
+    return entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns
+
+
+class ModelLoader:
+    """Tải (một lần), kiểm tra và load model từ thư mục artifact local"""
+
+    def __init__(
+        self,
+        model_id: str,
+        revision: Optional[str] = None,
+        artifact_dir: Optional[str] = None,
+        offline: Optional[bool] = None,
+        verify: Optional[bool] = None,
+        expected_sha256: Optional[str] = None,
+        mmap_weights: Optional[bool] = None,
+        verify_full: Optional[bool] = None,
+    ):
+        """
+        Initialize Model Loader
+
+        Args:
+            model_id: Hugging Face model id hoặc đường dẫn thư mục local
+            revision: Branch/tag/commit để pin version (nên dùng commit hash)
+            artifact_dir: Thư mục gốc chứa artifacts
+            offline: Không truy cập mạng, chỉ dùng artifacts đã có
+            verify: Kiểm tra checksum các file theo manifest khi load
+            expected_sha256: Checksum bắt buộc của file weights
+            mmap_weights: Load weights bằng mmap để các process dùng chung một bản trong RAM
+            verify_full: Hash lại mọi file mỗi lần load; mặc định chỉ hash file có size hoặc mtime
+                khác manifest (hash weights và bản mmap mỗi lần khởi động làm chậm cold start)
+        """
+        self.model_id = model_id
+        self.revision = revision or "main"
+        self.artifact_dir = artifact_dir or default_artifact_dir()
+        self.offline = env_flag("SENTIMENT_OFFLINE") if offline is None else offline
+        self.verify = env_flag("SENTIMENT_VERIFY_CHECKSUM", "1") if verify is None else verify
+        self.expected_sha256 = expected_sha256
+        self.mmap_weights = env_flag("SENTIMENT_MMAP_WEIGHTS", "1") if mmap_weights is None else mmap_weights
+        self.verify_full = env_flag("SENTIMENT_VERIFY_FULL") if verify_full is None else verify_full
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def local_path(self) -> str:
+        """Thư mục chứa artifacts của model + revision này"""
+        if os.path.isdir(self.model_id):
+            return self.model_id
+        return os.path.join(self.artifact_dir, self.model_id.replace("/", "--"), self.revision)
+
+    def fetch(self) -> str:
+        """Đảm bảo artifacts có trong thư mục local, chỉ tải khi chưa có"""
+        start = time.perf_counter()
+        path = self.local_path
+
+        if os.path.isdir(path) and self._has_weights(path):
+            self.timings["fetch"] = 0.0
+        elif self.offline:
+            raise FileNotFoundError(f"Offline mode: không tìm thấy artifacts của {self.model_id}@{self.revision} tại {path}")
+        else:
+            from huggingface_hub import snapshot_download
+
+            logger.info("Downloading %s@%s to %s", self.model_id, self.revision, path)
+            snapshot_download(
+                repo_id=self.model_id,
+                revision=self.revision,
+                local_dir=path,
+                local_dir_use_symlinks=False,
+            )
+            self.write_manifest(path)
+            self.timings["fetch"] = round(time.perf_counter() - start, 4)
+
+        if self.verify:
+            verify_start = time.perf_counter()
+            self.verify_manifest(path)
+            self.timings["verify"] = round(time.perf_counter() - verify_start, 4)
+
+        return path
+
+    def load_model(self, path: Optional[str] = None):
+        """Load model ở chế độ eval, ưu tiên weights mmap dùng chung rồi tới safetensors"""
+        path = path or self.fetch()
+        start = time.perf_counter()
+
+        mmap_file = os.path.join(path, MMAP_WEIGHTS)
+        if self.mmap_weights and os.path.exists(mmap_file):
+            try:
+                model = self._load_mmap(path, mmap_file)
+                self.timings["model_load"] = round(time.perf_counter() - start, 4)
+                return model
+            except Exception as e:
+                logger.warning("Could not load mmap weights, loading %s normally: %s", self.model_id, e)
+
+        use_safetensors = os.path.exists(os.path.join(path, SAFETENSORS_WEIGHTS))
+        model = AutoModelForSequenceClassification.from_pretrained(
+            path,
+            local_files_only=True,
+            use_safetensors=use_safetensors,
+        )
+        model.eval()
+
+        if not use_safetensors and not self.expected_sha256 and not os.path.isdir(self.model_id):
+            # Chuyển sang safetensors một lần để các lần khởi động sau load bằng mmap
+            self._convert_to_safetensors(model, path)
+
+        if self.mmap_weights and self._export_mmap(model, mmap_file, path):
+            # Load lại để chính process này cũng dùng bản mmap, bản copy riêng được giải phóng
+            model = self._load_mmap(path, mmap_file)
+
+        self.timings["model_load"] = round(time.perf_counter() - start, 4)
+        return model
+
+    def write_manifest(self, path: str) -> Dict[str, Dict]:
+        """
+        Ghi sha256, size và mtime của tất cả file artifacts vào manifest
+
+        File có size và mtime giống manifest cũ giữ checksum cũ thay vì hash lại
+        """
+        previous = self._read_manifest(path).get("files", {})
+        files = {}
+        for root, dirs, names in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                if name.startswith("."):
+                    continue
+                full_path = os.path.join(root, name)
+                relative = os.path.relpath(full_path, path)
+                entry = _manifest_entry(previous.get(relative))
+                files[relative] = _file_entry(full_path, entry["sha256"] if entry and _stat_matches(full_path, entry) else None)
+
+        self._save_manifest(path, {"model_id": self.model_id, "revision": self.revision, "files": files})
+        return files
+
+    def verify_manifest(self, path: str):
+        """
+        Kiểm tra checksum artifacts, raise ValueError nếu không khớp
+
+        Chỉ hash file có size hoặc mtime khác manifest (hoặc mọi file nếu verify_full); hash khớp thì
+        ghi size / mtime mới để lần sau không phải hash lại
+        """
+        manifest = self._read_manifest(path)
+        if not manifest:
+            # Artifacts được copy vào thủ công, tạo manifest để lần sau kiểm tra
+            files = self.write_manifest(path)
+        else:
+            files, changed = {}, False
+            for name, entry in manifest.get("files", {}).items():
+                file_path = os.path.join(path, name)
+                if not os.path.exists(file_path):
+                    raise ValueError(f"Thiếu file artifact: {name}")
+                entry = _manifest_entry(entry)
+                if self.verify_full or not _stat_matches(file_path, entry):
+                    if sha256_file(file_path) != entry["sha256"]:
+                        raise ValueError(f"Checksum của {name} không khớp với manifest")
+                    refreshed = _file_entry(file_path, entry["sha256"])
+                    changed = changed or refreshed != entry
+                    entry = refreshed
+                files[name] = entry
+            if changed:
+                self._save_manifest(path, {**manifest, "files": files})
+
+        weights = self._weights_file(path)
+        if self.expected_sha256 and weights:
+            entry = files.get(os.path.relpath(weights, path))
+            # Checksum trong manifest đã được kiểm tra (hoặc size / mtime chưa đổi) ở trên
+            actual = entry["sha256"] if entry else sha256_file(weights)
+            if actual != self.expected_sha256:
+                raise ValueError(f"Checksum của {weights} không khớp: {actual} != {self.expected_sha256}")
+
+    @staticmethod
+    def _read_manifest(path: str) -> Dict:
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_manifest(path: str, manifest: Dict):
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+
+    def _convert_to_safetensors(self, model, path: str):
+        try:
+            model.save_pretrained(path, safe_serialization=True)
+            os.remove(os.path.join(path, PYTORCH_WEIGHTS))
+            self.write_manifest(path)
+            logger.info("Converted %s weights to safetensors", self.model_id)
+        except Exception as e:
+            logger.warning("Could not convert weights to safetensors: %s", e)
+
+    @staticmethod
+    def _load_mmap(path: str, mmap_file: str):
+        """
+        Tạo model trên meta device rồi gán thẳng các tensor mmap vào (không copy, không khởi tạo weights ngẫu nhiên)
+
+        Trang weights nằm trong page cache của file, các process cùng đọc file dùng chung một bản
+        và chỉ copy trang nào bị ghi (inference không ghi weights)
+        """
+        config = AutoConfig.from_pretrained(path, local_files_only=True)
+        with torch.device("meta"):
+            model = AutoModelForSequenceClassification.from_config(config)
+
+        tensors = torch.load(mmap_file, map_location="cpu", mmap=True, weights_only=True)
+        persistent = set(model.state_dict())
+        model.load_state_dict({name: tensors[name] for name in persistent}, strict=True, assign=True)
+        for name, tensor in tensors.items():
+            if name not in persistent:
+                module_name, _, buffer_name = name.rpartition(".")
+                model.get_submodule(module_name).register_buffer(buffer_name, tensor, persistent=False)
+
+        remaining = [name for name, tensor in itertools.chain(model.named_parameters(), model.named_buffers()) if tensor.is_meta]
+        if remaining:
+            raise ValueError(f"Thiếu tensor trong {MMAP_WEIGHTS}: {remaining[:5]}")
+
+        model.requires_grad_(False)
+        model.eval()
+        return model
+
+    def _export_mmap(self, model, mmap_file: str, path: str) -> bool:
+        """Ghi state dict một lần để các lần load sau (và các process khác) dùng mmap"""
+        tmp_file = f"{mmap_file}.{os.getpid()}.tmp"
+        try:
+            tensors = {**model.state_dict(), **dict(model.named_buffers())}
+            torch.save({name: tensor.contiguous() for name, tensor in tensors.items()}, tmp_file)
+            os.replace(tmp_file, mmap_file)
+            if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+                self.write_manifest(path)
+            logger.info("Exported %s weights for mmap loading", self.model_id)
+            return True
+        except Exception as e:
+            logger.warning("Could not export mmap weights: %s", e)
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            return False
+
+    @staticmethod
+    def _weights_file(path: str) -> Optional[str]:
+        for name in (SAFETENSORS_WEIGHTS, PYTORCH_WEIGHTS):
+            full_path = os.path.join(path, name)
+            if os.path.exists(full_path):
+                return full_path
+        return None
+
+    @classmethod
+    def _has_weights(cls, path: str) -> bool:
+        return cls._weights_file(path) is not None
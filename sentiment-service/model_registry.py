@@ -0,0 +1,545 @@
+# -*- coding: utf-8 -*-
+"""
+Model Registry cho sentiment service
+Giữ nhiều version model (ví dụ v1, v2) load lazy, đo latency theo version và hot swap version mặc định
+sau khi warm-up, đồng bộ giữa các gunicorn workers qua một control file
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from inference_backends import EVAL_TEXTS, EagerBackend, check_agreement, create_backend
+from memory import BatchMemoryTracker
+from metrics import BATCH_SIZE, QUEUE_WAIT_SECONDS, STAGE_SECONDS
+from micro_batcher import BatchScheduler, MicroBatcher
+from model_loader import ModelLoader
+from routing import LatencyTracker
+from tokenization import TokenizationStage
+
+
+logger = logging.getLogger(__name__)
+
+
+class ModelVersion:
+    """Một version model: tokenizer, backend, micro-batcher riêng (có thể chung scheduler) và thống kê latency"""
+
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(
+        self,
+        name: str,
+        model_id: str,
+        revision: Optional[str] = None,
+        expected_sha256: Optional[str] = None,
+        backend: str = "fp32",
+        min_agreement: float = 0.95,
+        tokenizer_mode: str = "auto",
+        max_length: int = 256,
+        max_batch_size: int = 32,
+        max_batch_tokens: int = 0,
+        max_wait_ms: float = 5.0,
+        max_pending: int = 0,
+        scheduler: Optional[BatchScheduler] = None,
+        warmup_batch_sizes: Sequence[int] = (),
+    ):
+        """
+        Initialize Model Version
+
+        Args:
+            name: Tên version dùng trong request (ví dụ "v2")
+            model_id: Hugging Face model id hoặc thư mục local
+            revision: Revision để pin (nên dùng commit hash)
+            expected_sha256: Checksum bắt buộc của file weights
+            backend: Inference backend "fp32", "int8" hoặc "onnx"
+            min_agreement: Tỉ lệ top-1 trùng với fp32 tối thiểu của backend khác fp32
+            tokenizer_mode: "auto", "fast" hoặc "slow"
+            max_length: Số token tối đa mỗi text
+            max_batch_size: Số text tối đa mỗi forward pass
+            max_batch_tokens: Số token tối đa (sau padding) mỗi forward pass, 0 = không giới hạn
+            max_wait_ms: Thời gian micro-batcher chờ gom batch
+            max_pending: Số text chờ tối đa trong micro-batcher (0 = không giới hạn)
+            scheduler: Scheduler dùng chung với các version khác, None thì batcher có thread riêng
+            warmup_batch_sizes: Batch size chạy warm-up với input tổng hợp ở mọi bucket độ dài trước khi ready
+        """
+        self.name = name
+        self.model_id = model_id
+        self.revision = revision
+        self.expected_sha256 = expected_sha256
+        self.backend_name = backend
+        self.min_agreement = min_agreement
+        self.tokenizer_mode = tokenizer_mode
+        self.max_length = max_length
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait_ms = max_wait_ms
+        self.max_pending = max_pending
+        self.scheduler = scheduler
+        self.warmup_batch_sizes = sorted({size for size in warmup_batch_sizes if size > 0})
+
+        self.state = self.UNLOADED
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.backend_info: Dict = {}
+        self.tokenization: Optional[TokenizationStage] = None
+        self.backend = None
+        self.batcher = self._create_batcher()
+        # Batcher riêng cho request cần embedding: mỗi text nhận (scores, embedding) của cùng một forward pass
+        self.embedding_batcher = self._create_batcher(self.predict_embeddings_batch)
+        self.latency = LatencyTracker()
+        self.memory = BatchMemoryTracker()
+        self.texts_served = 0
+        self.batches = 0
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _create_batcher(self, predict_fn=None) -> MicroBatcher:
+        return MicroBatcher(
+            predict_fn or self.predict_scores_batch,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait_ms,
+            on_batch=self._record_batch,
+            max_pending=self.max_pending,
+            scheduler=self.scheduler,
+        )
+
+    def _record_batch(self, size: int, queue_waits: List[float]):
+        BATCH_SIZE.observe(size, model=self.name)
+        for wait in queue_waits:
+            QUEUE_WAIT_SECONDS.observe(wait, model=self.name)
+
+    @property
+    def cache_model(self) -> str:
+        """Model id cho cache key, kết quả của các version khác nhau không dùng lẫn"""
+        return f"{self.model_id}@{self.revision or 'main'}"
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def spec(self) -> Dict:
+        return {"model_id": self.model_id, "revision": self.revision, "backend": self.backend_name}
+
+    def start_loading(self) -> bool:
+        """Load trong background nếu chưa load, trả về True nếu version đã sẵn sàng"""
+        with self._lock:
+            if self.state == self.READY:
+                return True
+            if self.state != self.LOADING:
+                self.state = self.LOADING
+                threading.Thread(target=self._load_quietly, name=f"model-loader-{self.name}", daemon=True).start()
+        return False
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.error("Error loading model %s: %s", self.name, e)
+
+    def load(self):
+        """Tải artifacts, load tokenizer + model + backend và warm-up trước khi nhận traffic"""
+        with self._load_lock:
+            if self.state == self.READY:
+                return
+            with self._lock:
+                self.state = self.LOADING
+                self.error = None
+
+            try:
+                loader = ModelLoader(self.model_id, revision=self.revision, expected_sha256=self.expected_sha256)
+                path = loader.fetch()
+
+                tokenizer_start = time.perf_counter()
+                # Fast tokenizer chỉ được dùng khi cho kết quả giống slow tokenizer (tokenizer.json có thể bị lỗi)
+                tokenization = TokenizationStage.load(path, mode=self.tokenizer_mode, max_length=self.max_length, local_files_only=True)
+                loader.timings["tokenizer_load"] = round(time.perf_counter() - tokenizer_start, 4)
+
+                model = loader.load_model(path)
+
+                backend_start = time.perf_counter()
+                backend = self._create_backend(model, path, tokenization)
+                loader.timings["backend_load"] = round(time.perf_counter() - backend_start, 4)
+
+                warmup_start = time.perf_counter()
+                self._forward(tokenization, backend, EVAL_TEXTS)
+                loader.timings["warmup"] = round(time.perf_counter() - warmup_start, 4)
+
+                if self.warmup_batch_sizes:
+                    warmup_start = time.perf_counter()
+                    shapes = self._warmup_shapes(tokenization, backend)
+                    loader.timings["warmup_shapes"] = round(time.perf_counter() - warmup_start, 4)
+                    logger.info("Warmed up %d batch shapes (%s)", len(shapes), self.name, extra={"shapes": shapes})
+            except Exception as e:
+                with self._lock:
+                    self.state = self.FAILED
+                    self.error = str(e)
+                raise
+
+            with self._lock:
+                self.tokenization = tokenization
+                self.backend = backend
+                self.timings = loader.timings
+                self.state = self.READY
+
+    def _create_backend(self, model, path: str, tokenization: TokenizationStage):
+        """Tạo inference backend theo config, từ chối backend lệch quá nhiều so với fp32"""
+        candidate = create_backend(self.backend_name, model, path)
+        self.backend_info = candidate.info()
+        if self.backend_name == "fp32":
+            return candidate
+
+        parity = check_agreement(EagerBackend(model), candidate, tokenization)
+        self.backend_info.update(parity)
+        logger.info("Backend %s parity with fp32 (%s)", self.backend_name, self.name, extra=parity)
+
+        if parity["agreement"] < self.min_agreement:
+            raise RuntimeError(
+                f"Backend {self.backend_name} top-1 agreement {parity['agreement']} < {self.min_agreement}"
+            )
+        return candidate
+
+    def warmup_plan(self, tokenization: TokenizationStage) -> List[Tuple[int, int]]:
+        """
+        Các shape (batch size, số token) của warm-up: mỗi bucket độ dài với mỗi batch size đã cấu hình,
+        giới hạn bởi max_batch_size và max_batch_tokens như plan_batches; shape lớn nhất chạy trước
+        """
+        shapes = set()
+        for length in tokenization.bucket_boundaries:
+            for size in self.warmup_batch_sizes:
+                size = min(size, self.max_batch_size)
+                if self.max_batch_tokens > 0:
+                    size = min(size, max(self.max_batch_tokens // length, 1))
+                shapes.add((size, length))
+        return sorted(shapes, key=lambda shape: (shape[0] * shape[1], shape), reverse=True)
+
+    def _warmup_shapes(self, tokenization: TokenizationStage, backend) -> List[Tuple[int, int]]:
+        """Forward pass với input tổng hợp cho từng shape, để allocator và kernel của mọi shape sẵn sàng trước request đầu tiên"""
+        shapes = self.warmup_plan(tokenization)
+        for size, length in shapes:
+            inputs = tokenization.synthetic_batch(size, length)
+            with torch.inference_mode():
+                backend.logits(inputs)
+        return shapes
+
+    def _forward(
+        self,
+        tokenization: TokenizationStage,
+        backend,
+        texts: List[str],
+        stages: Optional[Dict[str, float]] = None,
+        embeddings: Optional[List] = None,
+    ) -> List[List[float]]:
+        """
+        Tokenize, forward và softmax; cộng thời gian từng stage vào stages nếu có
+
+        Args:
+            embeddings: List rỗng để nhận sentence embedding (float32) của từng text từ cùng forward pass
+        """
+        stages = stages if stages is not None else {}
+        clock = time.perf_counter()
+        encodings = tokenization.encode(texts)
+        all_scores = [None] * len(texts)
+        if embeddings is not None:
+            embeddings.extend([None] * len(texts))
+
+        # Text có độ dài gần nhau được pad chung để giảm token thừa
+        for indices in tokenization.plan_batches(encodings, self.max_batch_size, self.max_batch_tokens):
+            inputs = tokenization.pad([encodings[i] for i in indices])
+            now = time.perf_counter()
+            stages["tokenize"] = stages.get("tokenize", 0.0) + now - clock
+            clock = now
+
+            with torch.inference_mode():
+                logits, pooled = backend.forward(inputs, pooled=embeddings is not None)
+            now = time.perf_counter()
+            stages["forward"] = stages.get("forward", 0.0) + now - clock
+            self.memory.observe(len(indices), int(inputs["input_ids"].numel()))
+            clock = time.perf_counter()
+
+            predictions = torch.nn.functional.softmax(logits, dim=-1)
+            for i, scores in zip(indices, predictions.tolist()):
+                all_scores[i] = scores
+            if pooled is not None:
+                for i, vector in zip(indices, pooled.numpy()):
+                    embeddings[i] = vector
+            now = time.perf_counter()
+            stages["postprocess"] = stages.get("postprocess", 0.0) + now - clock
+            clock = now
+
+        return all_scores
+
+    def predict_scores_batch(self, texts: List[str]) -> List[List[float]]:
+        """Chạy forward pass cho cả batch, trả về list 7 scores cho mỗi text"""
+        tokenization, backend = self.tokenization, self.backend
+        if backend is None:
+            raise RuntimeError(f"Model {self.name} chưa được load")
+
+        start = time.perf_counter()
+        stages: Dict[str, float] = {}
+        all_scores = self._forward(tokenization, backend, texts, stages)
+        self.latency.record(time.perf_counter() - start)
+        for stage, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, model=self.name, stage=stage)
+
+        with self._lock:
+            self.texts_served += len(texts)
+            self.batches += 1
+        return all_scores
+
+    def predict_embeddings_batch(self, texts: List[str]) -> List[Tuple[List[float], np.ndarray]]:
+        """Như predict_scores_batch, kèm sentence embedding chuẩn hoá L2 của từng text"""
+        tokenization, backend = self.tokenization, self.backend
+        if backend is None:
+            raise RuntimeError(f"Model {self.name} chưa được load")
+        if not backend.supports_embeddings:
+            raise RuntimeError(f"Backend {self.backend_name} không hỗ trợ embedding")
+
+        start = time.perf_counter()
+        stages: Dict[str, float] = {}
+        embeddings: List = []
+        all_scores = self._forward(tokenization, backend, texts, stages, embeddings)
+        self.latency.record(time.perf_counter() - start)
+        for stage, seconds in stages.items():
+            STAGE_SECONDS.observe(seconds, model=self.name, stage=stage)
+
+        with self._lock:
+            self.texts_served += len(texts)
+            self.batches += 1
+        return list(zip(all_scores, embeddings))
+
+    def unload(self, timeout: Optional[float] = None, reopen: bool = True):
+        """
+        Giải phóng model sau khi đã drain các batch đang chờ
+
+        Args:
+            timeout: Thời gian tối đa (giây) chờ drain mỗi micro-batcher
+            reopen: Tạo batcher mới để load lại sau; False khi version bị bỏ khỏi registry
+        """
+        with self._load_lock:
+            self.batcher.shutdown(timeout)
+            self.embedding_batcher.shutdown(timeout)
+            with self._lock:
+                if reopen:
+                    self.batcher = self._create_batcher()
+                    self.embedding_batcher = self._create_batcher(self.predict_embeddings_batch)
+                self.tokenization = None
+                self.backend = None
+                self.state = self.UNLOADED
+
+    def info(self) -> Dict:
+        with self._lock:
+            texts_served, batches = self.texts_served, self.batches
+        return {
+            "version": self.name,
+            "model_id": self.model_id,
+            "revision": self.revision or "main",
+            "state": self.state,
+            "error": self.error,
+            "backend": self.backend_info or {"name": self.backend_name},
+            "timings": self.timings,
+            "latency": self.latency.snapshot(),
+            "texts_served": texts_served,
+            "batches": batches,
+            "avg_batch_size": round(texts_served / batches, 2) if batches else None,
+            "tokenization": self.tokenization.stats() if self.tokenization else None,
+            "max_batch_tokens": self.max_batch_tokens,
+            "warmup_batch_sizes": self.warmup_batch_sizes,
+            "memory_by_batch_size": self.memory.snapshot(),
+        }
+
+
+class ModelRegistry:
+    """Các version model của process và version mặc định đang nhận traffic"""
+
+    def __init__(self, control_file: Optional[str] = None, poll_interval: float = 2.0, **version_defaults):
+        """
+        Initialize Model Registry
+
+        Args:
+            control_file: File JSON ghi version mặc định, mọi worker đọc file này để cùng hot swap
+            poll_interval: Khoảng thời gian (giây) tối thiểu giữa hai lần kiểm tra control file
+            **version_defaults: Tham số mặc định cho ModelVersion (backend, tokenizer_mode, max_batch_size...)
+        """
+        self.control_file = control_file
+        self.poll_interval = poll_interval
+        self.version_defaults = version_defaults
+        self.activating: Optional[str] = None
+
+        self._versions: Dict[str, ModelVersion] = {}
+        self._default: Optional[str] = None
+        self._lock = threading.Lock()
+        self._control_mtime: Optional[float] = None
+        self._next_poll = 0.0
+
+    def add(self, name: str, model_id: str, revision: Optional[str] = None, default: bool = False, **options) -> ModelVersion:
+        """
+        Đăng ký version (chưa load), giữ version cũ nếu tên đã tồn tại với cùng spec
+
+        Tên đã tồn tại với spec khác thì version cũ bị unload và gỡ batcher khỏi scheduler
+        """
+        replaced = None
+        with self._lock:
+            existing = self._versions.get(name)
+            if existing is not None and existing.model_id == model_id and existing.revision == revision:
+                version = existing
+            else:
+                if existing is not None and name == self._default:
+                    raise ValueError(f"Không thể thay version {name} đang là mặc định")
+                version = ModelVersion(name, model_id, revision, **{**self.version_defaults, **options})
+                self._versions[name] = version
+                replaced = existing
+            if default or self._default is None:
+                self._default = name
+
+        if replaced is not None:
+            logger.info("Model version %s replaced (%s -> %s)", name, replaced.cache_model, version.cache_model)
+            replaced.unload(reopen=False)
+        return version
+
+    def get(self, name: Optional[str] = None) -> ModelVersion:
+        """Version theo tên, None là version mặc định; raise KeyError nếu không có"""
+        with self._lock:
+            version = self._versions.get(name or self._default)
+        if version is None:
+            raise KeyError(f"Model version '{name}' không tồn tại. Chọn: {self.names()}")
+        return version
+
+    @property
+    def default(self) -> ModelVersion:
+        return self.get()
+
+    def names(self) -> List[str]:
+        with self._lock:
+            return list(self._versions)
+
+    def activate(self, name: str, unload_previous: bool = False):
+        """
+        Hot swap: load và warm-up version mới rồi mới chuyển traffic sang
+
+        Version cũ vẫn phục vụ request trong lúc load; lỗi load không làm thay đổi version mặc định
+        """
+        version = self.get(name)
+        with self._lock:
+            self.activating = name
+        try:
+            version.load()
+            with self._lock:
+                previous = self._versions.get(self._default)
+                self._default = name
+        finally:
+            with self._lock:
+                self.activating = None
+
+        logger.info("Model version %s is now the default (%s)", name, version.cache_model)
+        if unload_previous and previous is not None and previous is not version:
+            previous.unload()
+
+    def request_activation(self, name: str, spec: Optional[Dict] = None, unload_previous: bool = False):
+        """Ghi control file cho mọi worker và hot swap trong background ở worker hiện tại"""
+        if spec:
+            self.add(name, spec["model_id"], spec.get("revision"), **({"backend": spec["backend"]} if spec.get("backend") else {}))
+        else:
+            self.get(name)
+
+        if self.control_file:
+            control = {
+                "default": name,
+                "unload_previous": unload_previous,
+                "versions": {key: self.get(key).spec() for key in self.names()},
+                "updated_at": time.time(),
+            }
+            tmp_path = self.control_file + ".tmp"
+            os.makedirs(os.path.dirname(os.path.abspath(self.control_file)), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(control, f, indent=2)
+            os.replace(tmp_path, self.control_file)
+
+        self._activate_background(name, unload_previous)
+
+    def _activate_background(self, name: str, unload_previous: bool):
+        with self._lock:
+            if self.activating == name:
+                return
+            self.activating = name
+
+        def run():
+            try:
+                self.activate(name, unload_previous)
+            except Exception as e:
+                logger.error("Hot swap to model version %s failed: %s", name, e)
+
+        threading.Thread(target=run, name=f"model-activate-{name}", daemon=True).start()
+
+    def load_control(self):
+        """Áp dụng control file lúc khởi động (trước khi load version mặc định)"""
+        control = self._read_control()
+        if control is not None:
+            self._register_from_control(control)
+            if control.get("default") in self.names():
+                with self._lock:
+                    self._default = control["default"]
+
+    def poll(self):
+        """Kiểm tra control file (tối đa mỗi poll_interval giây), hot swap nếu worker khác đã đổi version mặc định"""
+        now = time.monotonic()
+        if not self.control_file or now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_interval
+
+        control = self._read_control()
+        if control is None:
+            return
+        self._register_from_control(control)
+        name = control.get("default")
+        if name in self.names() and name != self._default:
+            self._activate_background(name, bool(control.get("unload_previous")))
+
+    def _read_control(self) -> Optional[Dict]:
+        try:
+            mtime = os.path.getmtime(self.control_file)
+        except (OSError, TypeError):
+            return None
+        if mtime == self._control_mtime:
+            return None
+        try:
+            with open(self.control_file) as f:
+                control = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot read model control file %s: %s", self.control_file, e)
+            return None
+        self._control_mtime = mtime
+        return control
+
+    def _register_from_control(self, control: Dict):
+        for name, spec in (control.get("versions") or {}).items():
+            try:
+                self.add(name, spec["model_id"], spec.get("revision"), **({"backend": spec["backend"]} if spec.get("backend") else {}))
+            except (KeyError, ValueError) as e:
+                logger.warning("Ignoring model version %s from control file: %s", name, e)
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Drain micro-batcher của mọi version"""
+        with self._lock:
+            versions = list(self._versions.values())
+        for version in versions:
+            version.batcher.shutdown(timeout)
+            version.embedding_batcher.shutdown(timeout)
+
+    def info(self) -> Dict:
+        with self._lock:
+            versions = list(self._versions.values())
+            default, activating = self._default, self.activating
+        return {
+            "default": default,
+            "activating": activating,
+            "models": [{**version.info(), "default": version.name == default} for version in versions],
+        }
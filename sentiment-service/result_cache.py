@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Result Cache cho sentiment analysis
+Cache kết quả theo hash của text đã chuẩn hóa + model id, gồm LRU trong process và shared tier tùy chọn
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedCacheBackend:
+    """Interface cho shared tier dùng chung giữa nhiều process/instance"""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+
+class InMemorySharedBackend(SharedCacheBackend):
+    """Shared tier chạy trong process, dùng cho local/test thay cho Redis"""
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+
+
+class RedisSharedBackend(SharedCacheBackend):
+    """Shared tier trên Redis (cần cài package redis)"""
+
+    def __init__(self, url: str, prefix: str = "sentiment:"):
+        import redis  # Optional dependency
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str, ttl: float):
+        self.client.set(self.prefix + key, value, ex=max(int(ttl), 1))
+
+
+def create_shared_backend(spec: str) -> Optional[SharedCacheBackend]:
+    """
+    Tạo shared tier từ config
+
+    Args:
+        spec: "" (tắt), "memory" hoặc URL redis://...
+    """
+    if not spec:
+        return None
+    if spec == "memory":
+        return InMemorySharedBackend()
+    if spec.startswith(("redis://", "rediss://")):
+        return RedisSharedBackend(spec)
+    raise ValueError(f"Shared cache backend không hợp lệ: {spec}")
+
+
+class ResultCache:
+    """LRU cache có TTL cho kết quả phân tích, key theo text đã chuẩn hóa + model id"""
+
+    _WHITESPACE_RE = re.compile(r"\s+")
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = 10000,
+        ttl_seconds: float = 3600,
+        shared: Optional[SharedCacheBackend] = None,
+    ):
+        """
+        Initialize Result Cache
+
+        Args:
+            model_id: Model id mặc định khi get / set không truyền model
+            max_entries: Số entries tối đa trong LRU
+            ttl_seconds: Thời gian sống của một entry
+            shared: Shared tier tùy chọn (Redis, InMemorySharedBackend...)
+        """
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.shared = shared
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def normalize_text(cls, text: str) -> str:
+        """Chuẩn hóa Unicode (NFC) và khoảng trắng để các text giống nhau dùng chung key"""
+        text = unicodedata.normalize("NFC", text)
+        return cls._WHITESPACE_RE.sub(" ", text).strip()
+
+    def make_key(self, text: str, model: Optional[str] = None) -> str:
+        """Tạo key từ model id và text đã chuẩn hóa"""
+        model = model or self.model_id
+        payload = f"{model}\x00{self.normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, text: str, model: Optional[str] = None) -> Optional[Any]:
+        """Lấy kết quả đã cache, trả về None nếu miss"""
+        key = self.make_key(text, model)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.shared is not None:
+            try:
+                raw = self.shared.get(key)
+                # Entry hỏng (bị cắt, ghi bởi phiên bản khác) được coi như miss
+                value = json.loads(raw) if raw is not None else None
+            except Exception as e:
+                logger.warning("Shared cache get failed: %s", e)
+                raw = None
+            if raw is not None:
+                self._store_local(key, value, now)
+                with self._lock:
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, text: str, value: Any, model: Optional[str] = None):
+        """Lưu kết quả (phải serialize được sang JSON)"""
+        key = self.make_key(text, model)
+        self._store_local(key, value, time.monotonic())
+
+        if self.shared is not None:
+            try:
+                self.shared.set(key, json.dumps(value), self.ttl)
+            except Exception as e:
+                logger.warning("Shared cache set failed: %s", e)
+
+    def _store_local(self, key: str, value: Any, now: float):
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Xóa toàn bộ LRU trong process"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Thống kê hit/miss cho /health"""
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "model": self.model_id,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "shared_backend": type(self.shared).__name__ if self.shared else None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Emotion rollups theo user và conversation
+Tổng scores, số text và số text theo emotion top-1 trong từng bucket thời gian (mặc định 1 giờ), cập nhật dần
+khi text được chấm điểm. Truy vấn cộng các bucket trong khoảng thời gian (O(số bucket), không đọc lại từng text).
+
+Mỗi nội dung (entity_type + entity_id) chỉ được tính một lần: chấm lại (sửa bài, hoặc lần gọi background sau lần
+gọi interactive) thay phần đóng góp cũ. Dữ liệu lưu trong SQLite dùng chung mọi gunicorn worker, một row mỗi
+(scope, key, bucket) nên không mất khi restart; các lần cập nhật được gom trong bộ nhớ và ghi theo đợt
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aggregation import EMOTION_LABELS, NUM_EMOTIONS
+
+logger = logging.getLogger(__name__)
+
+USER = "user"
+CONVERSATION = "conversation"
+
+# Độ dài một điểm của series khi truy vấn, "total" là không chia series
+GRANULARITIES = {"hour": 3600, "day": 86400, "week": 7 * 86400, "total": 0}
+
+SUM_COLUMNS = [f"sum_{label}" for label in EMOTION_LABELS]
+TOP_COLUMNS = [f"top_{label}" for label in EMOTION_LABELS]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS rollup_buckets (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    {", ".join(f"{column} REAL NOT NULL" for column in SUM_COLUMNS)},
+    {", ".join(f"{column} INTEGER NOT NULL" for column in TOP_COLUMNS)},
+    PRIMARY KEY (scope, key, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_entities (
+    entity TEXT PRIMARY KEY,
+    user_id TEXT,
+    conversation_id TEXT,
+    bucket INTEGER NOT NULL,
+    scores BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rollup_entities_bucket ON rollup_entities (bucket);
+"""
+
+SCORES_DTYPE = np.dtype("<f8")
+
+
+def entity_key(entity_type: Optional[str], entity_id) -> str:
+    return f"{entity_type or ''}:{entity_id}"
+
+
+def parse_timestamp(value) -> Optional[float]:
+    """
+    Unix seconds hoặc chuỗi ISO 8601 (createdAt của Prisma, ví dụ "2025-11-21T09:40:36.000Z") thành unix seconds,
+    None nếu không có; chuỗi không có múi giờ được hiểu là UTC
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError("'timestamp' must be unix seconds or an ISO 8601 string")
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if text[-1:] in ("Z", "z"):
+        # datetime.fromisoformat chỉ nhận hậu tố "Z" từ Python 3.11
+        text = text[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError("'timestamp' must be unix seconds or an ISO 8601 string") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class RollupStore:
+    """Bucket và phần đóng góp của từng entity trong SQLite, mỗi thread một connection"""
+
+    def __init__(self, path: str, bucket_seconds: int = 3600):
+        self.path = path
+        self.bucket_seconds = bucket_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            # Connection không dùng lại được sau fork
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def bucket_of(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds) * self.bucket_seconds
+
+    def apply(self, events: Dict[str, Dict]):
+        """
+        Ghi các event (entity -> event) trong một transaction
+
+        Event: {"scores": 7 scores hoặc None (xoá), "user_id", "conversation_id", "timestamp", "received_at"};
+        user_id / conversation_id / timestamp không có thì giữ giá trị của lần ghi trước
+        """
+        deltas: Dict[Tuple[str, str, int], List] = {}
+
+        def add(user_id, conversation_id, bucket, scores: np.ndarray, sign: int):
+            top = np.zeros(NUM_EMOTIONS, dtype=np.int64)
+            top[int(scores.argmax())] = 1
+            for scope, key in ((USER, user_id), (CONVERSATION, conversation_id)):
+                if key is None:
+                    continue
+                delta = deltas.setdefault((scope, key, bucket), [0, np.zeros(NUM_EMOTIONS), np.zeros(NUM_EMOTIONS, dtype=np.int64)])
+                delta[0] += sign
+                delta[1] += sign * scores
+                delta[2] += sign * top
+
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for entity, event in events.items():
+                old = conn.execute(
+                    "SELECT user_id, conversation_id, bucket, scores FROM rollup_entities WHERE entity = ?", (entity,)
+                ).fetchone()
+                if old is not None:
+                    add(old[0], old[1], old[2], np.frombuffer(old[3], dtype=SCORES_DTYPE), -1)
+
+                if event["scores"] is None:
+                    if old is not None:
+                        conn.execute("DELETE FROM rollup_entities WHERE entity = ?", (entity,))
+                    continue
+
+                user_id = event.get("user_id") if event.get("user_id") is not None else (old[0] if old else None)
+                conversation_id = event.get("conversation_id") if event.get("conversation_id") is not None else (old[1] if old else None)
+                if event.get("timestamp") is not None:
+                    bucket = self.bucket_of(event["timestamp"])
+                else:
+                    # Chấm lại giữ bucket của lần đầu (thời điểm nội dung được tạo)
+                    bucket = old[2] if old is not None else self.bucket_of(event["received_at"])
+                scores = np.asarray(event["scores"], dtype=SCORES_DTYPE)
+                add(user_id, conversation_id, bucket, scores, 1)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rollup_entities (entity, user_id, conversation_id, bucket, scores) VALUES (?, ?, ?, ?, ?)",
+                    (entity, user_id, conversation_id, bucket, scores.tobytes()),
+                )
+
+            columns = ["count", *SUM_COLUMNS, *TOP_COLUMNS]
+            conn.executemany(
+                f"INSERT INTO rollup_buckets (scope, key, bucket, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 3))}) "
+                f"ON CONFLICT (scope, key, bucket) DO UPDATE SET {', '.join(f'{column} = {column} + excluded.{column}' for column in columns)}",
+                [
+                    (scope, key, bucket, count, *sums.tolist(), *tops.tolist())
+                    for (scope, key, bucket), (count, sums, tops) in deltas.items()
+                    if count or sums.any() or tops.any()
+                ],
+            )
+            conn.execute("DELETE FROM rollup_buckets WHERE count <= 0")
+
+    def query(self, scope: str, key: str, start: float, end: float, step: int = 0, offset: int = 0) -> List[Tuple]:
+        """
+        Tổng các bucket trong [start, end) của (scope, key), gom theo step giây (0 = một dòng tổng)
+
+        Returns:
+            List (điểm bắt đầu, count, 7 tổng scores, 7 số text top-1), offset giây dịch ranh giới ngày theo múi giờ
+        """
+        if step and step % GRANULARITIES["week"] == 0:
+            # Ngày 0 của unix time là thứ Năm, tuần bắt đầu từ thứ Hai
+            offset -= 4 * 86400
+        point = f"((bucket + {int(offset)}) / {int(step)}) * {int(step)} - {int(offset)}" if step else "MIN(bucket)"
+        columns = ", ".join(f"SUM({column})" for column in ["count", *SUM_COLUMNS, *TOP_COLUMNS])
+        query = (
+            f"SELECT {point} AS point, {columns} FROM rollup_buckets "
+            f"WHERE scope = ? AND key = ? AND bucket >= ? AND bucket < ?"
+        )
+        if step:
+            query += " GROUP BY point ORDER BY point"
+        rows = self._connect().execute(query, (scope, key, self.bucket_of(start), end)).fetchall()
+        return [row for row in rows if row[1]]
+
+    def purge(self, older_than: float) -> int:
+        """Xoá bucket và phần đóng góp của entity cũ hơn older_than"""
+        bucket = self.bucket_of(older_than)
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM rollup_entities WHERE bucket < ?", (bucket,))
+            return conn.execute("DELETE FROM rollup_buckets WHERE bucket < ?", (bucket,)).rowcount
+
+
+class RollupRecorder:
+    """
+    Gom các event trong bộ nhớ (entity ghi sau thay entity ghi trước) và ghi vào RollupStore định kỳ
+    bằng một background thread, request không phải chờ SQLite
+    """
+
+    def __init__(
+        self,
+        store: RollupStore,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        retention_seconds: float = 400 * 86400,
+    ):
+        """
+        Initialize Rollup Recorder
+
+        Args:
+            store: RollupStore dùng chung giữa các process
+            flush_interval: Số giây giữa hai lần ghi
+            max_pending: Số entity chờ ghi, vượt quá thì ghi ngay thay vì chờ flush_interval
+            retention_seconds: Bucket cũ hơn bị xoá (kiểm tra mỗi giờ)
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[str, Dict] = {}
+        self._pid: Optional[int] = None
+        self._wakeup = threading.Event()
+        self._last_purge = 0.0
+        self.recorded = 0
+        self.flushed = 0
+        self.errors = 0
+        self.last_flush_seconds: Optional[float] = None
+
+    def record(self, entity: str, scores, user_id=None, conversation_id=None, timestamp: Optional[float] = None):
+        """Ghi nhận scores của một entity cho user và/hoặc conversation"""
+        self._put(entity, {
+            "scores": [float(score) for score in scores],
+            "user_id": None if user_id is None else str(user_id),
+            "conversation_id": None if conversation_id is None else str(conversation_id),
+            "timestamp": timestamp,
+            "received_at": time.time(),
+        })
+
+    def remove(self, entity: str):
+        """Bỏ phần đóng góp của entity (nội dung đã bị xoá)"""
+        self._put(entity, {"scores": None, "received_at": time.time()})
+
+    def _put(self, entity: str, event: Dict):
+        self.ensure_started()
+        with self._lock:
+            previous = self._pending.get(entity)
+            if previous is not None and event["scores"] is not None:
+                # Field không có trong event sau giữ giá trị của event trước chưa ghi
+                for field in ("user_id", "conversation_id", "timestamp"):
+                    if event[field] is None:
+                        event[field] = previous.get(field)
+            self._pending[entity] = event
+            self.recorded += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self._wakeup.set()
+
+    def ensure_started(self):
+        """Khởi động thread ghi (lazy, và khởi động lại nếu process đã fork)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._pending = {}
+            self._wakeup = threading.Event()
+        threading.Thread(target=self._run, name="rollup-flusher", daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            self._maybe_purge()
+
+    def flush(self) -> int:
+        """Ghi các event đang chờ, trả về số entity đã ghi; lỗi thì giữ lại event để ghi ở lần sau"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._pending = self._pending, {}
+            if not events:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.store.apply(events)
+            except sqlite3.Error as e:
+                logger.error("Cannot write emotion rollups: %s", e)
+                with self._lock:
+                    self.errors += 1
+                    # Event mới hơn của cùng entity được giữ
+                    self._pending = {**events, **self._pending}
+                return 0
+
+            with self._lock:
+                self.flushed += len(events)
+                self.last_flush_seconds = round(time.perf_counter() - start, 4)
+            return len(events)
+
+    def _maybe_purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        try:
+            purged = self.store.purge(now - self.retention_seconds)
+        except sqlite3.Error as e:
+            logger.error("Cannot purge emotion rollups: %s", e)
+            return
+        if purged:
+            logger.info("Purged %d rollup buckets", purged)
+
+    def shutdown(self):
+        """Ghi nốt các event đang chờ trước khi worker thoát"""
+        if self._pid == os.getpid():
+            self.flush()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "recorded": self.recorded,
+                "flushed": self.flushed,
+                "errors": self.errors,
+                "last_flush_seconds": self.last_flush_seconds,
+            }
+
+
+def summarize_rows(rows: List[Tuple], step: int) -> Dict:
+    """Tổng và series (nếu step > 0) từ các dòng của RollupStore.query"""
+    if rows:
+        data = np.asarray([row[1:] for row in rows], dtype=np.float64)
+    else:
+        data = np.zeros((0, 1 + 2 * NUM_EMOTIONS))
+    counts, sums, tops = data[:, 0], data[:, 1:1 + NUM_EMOTIONS], data[:, 1 + NUM_EMOTIONS:]
+
+    def point(count: float, point_sums: np.ndarray, point_tops: np.ndarray) -> Dict:
+        mean = point_sums / count if count else np.zeros(NUM_EMOTIONS)
+        dominant = int(mean.argmax()) if count else NUM_EMOTIONS - 1
+        return {
+            "count": int(count),
+            "emotion_class": dominant,
+            "emotion": EMOTION_LABELS[dominant],
+            "mean_scores": [round(float(score), 4) for score in mean],
+            "counts": {label: int(value) for label, value in zip(EMOTION_LABELS, point_tops)},
+            "percentages": {
+                label: round(float(value) / count * 100, 2) if count else 0.0
+                for label, value in zip(EMOTION_LABELS, point_tops)
+            },
+        }
+
+    result = point(counts.sum(), sums.sum(axis=0), tops.sum(axis=0))
+    if step:
+        result["series"] = [
+            {"start": int(row[0]), **point(count, row_sums, row_tops)}
+            for row, count, row_sums, row_tops in zip(rows, counts, sums, tops)
+        ]
+    return result
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Routing giữa LLM provider và local model
+Circuit breaker theo provider và theo dõi latency p50/p95 để chuyển traffic sang local model khi provider chậm hoặc lỗi
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class CircuitBreaker:
+    """Circuit breaker 3 trạng thái: closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, half_open_probes: int = 1):
+        """
+        Initialize Circuit Breaker
+
+        Args:
+            failure_threshold: Số lỗi liên tiếp để mở breaker
+            reset_timeout: Thời gian (giây) giữ breaker mở trước khi cho probe
+            half_open_probes: Số request probe đồng thời khi half-open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self.times_opened = 0
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self) -> bool:
+        """Có cho request đi qua không (half-open chỉ cho một số probe)"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+            self._probes_in_flight = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probes_in_flight = 0
+                self.times_opened += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            state = self._current_state()
+            retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0) if state == self.OPEN else 0
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "retry_in_seconds": round(retry_in, 2),
+            }
+
+
+class LatencyTracker:
+    """Rolling window latency, tính p50/p95"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Percentile (0-100) của window hiện tại, None nếu chưa có sample"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(int(round(p / 100.0 * (len(samples) - 1))), len(samples) - 1)
+        return samples[index]
+
+    def snapshot(self) -> Dict:
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        with self._lock:
+            count = len(self._samples)
+        return {
+            "samples": count,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+class ProviderRouter:
+    """Quyết định gửi request tới LLM provider hay local model"""
+
+    LLM = "llm"
+    LOCAL = "local"
+
+    def __init__(self, provider: str, breaker: Optional[CircuitBreaker] = None, latency: Optional[LatencyTracker] = None):
+        self.provider = provider
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or LatencyTracker()
+        self._lock = threading.Lock()
+        self.routed = {self.LLM: 0, self.LOCAL: 0}
+        self.local_reasons: Dict[str, int] = {}
+
+    def choose(self, budget_ms: Optional[float] = None) -> Tuple[str, Optional[str]]:
+        """
+        Chọn đường đi cho request
+
+        Args:
+            budget_ms: Latency budget của request, None nếu không giới hạn
+
+        Returns:
+            (route, reason) với reason là lý do khi chọn local model
+        """
+        route, reason = self.LLM, None
+        p95 = self.latency.percentile(95)
+        if budget_ms is not None and p95 is not None and p95 * 1000 > budget_ms:
+            route, reason = self.LOCAL, "latency_budget"
+        elif not self.breaker.allow_request():
+            route, reason = self.LOCAL, "breaker_open"
+
+        with self._lock:
+            self.routed[route] += 1
+            if reason:
+                self.local_reasons[reason] = self.local_reasons.get(reason, 0) + 1
+        return route, reason
+
+    def record_fallback(self, reason: str):
+        """Ghi nhận request đã chọn LLM nhưng phải chuyển sang local model"""
+        with self._lock:
+            self.local_reasons[reason] = self.local_reasons.get(reason, 0) + 1
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        Gọi provider, ghi nhận latency và kết quả cho breaker
+
+        Latency được ghi cả khi lỗi: timeout và lỗi chậm phải làm p95 tăng để request sau chuyển sang local model
+        """
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            self.latency.record(time.perf_counter() - start)
+        self.breaker.record_success()
+        return result
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            routed = dict(self.routed)
+            reasons = dict(self.local_reasons)
+        return {
+            "provider": self.provider,
+            "breaker": self.breaker.snapshot(),
+            "latency": self.latency.snapshot(),
+            "routed": routed,
+            "local_reasons": reasons,
+        }
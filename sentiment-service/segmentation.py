@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Chia văn bản dài thành các đoạn vừa max_length của model
+Tách câu theo dấu câu và xuống dòng (không tách sau viết tắt tiếng Việt như TP., Q., v.v.),
+gộp các câu liên tiếp thành đoạn gần đầy token budget; câu quá dài được cắt thành cửa sổ từ có overlap.
+Đoạn của mọi text được chạy chung một lần predict, kết quả gộp lại theo số token của từng đoạn
+"""
+import re
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from tokenization import TokenizationStage
+
+# Dấu kết thúc câu (kể cả lặp lại như "!!!", "?!", "...") rồi khoảng trắng, hoặc xuống dòng
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+|\s*\n+\s*")
+
+# Từ viết tắt kết thúc bằng dấu chấm không phải cuối câu
+ABBREVIATIONS = frozenset({
+    "tp", "q", "p", "h", "x", "tx", "tt", "ths", "ts", "pgs", "gs", "bs", "ks", "cn", "ls", "nxb", "vd", "v.v",
+    "ubnd", "hđnd", "mr", "mrs", "ms", "dr", "st", "no", "vs", "etc",
+})
+
+
+def split_sentences(text: str) -> List[str]:
+    """Tách text thành các câu, giữ nguyên dấu câu"""
+    sentences: List[str] = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        piece = text[start:match.start()]
+        if "\n" not in match.group() and piece.endswith("."):
+            last_word = piece.rsplit(None, 1)[-1].rstrip(".").lower() if piece.strip() else ""
+            # "TP.", "Q.", "v.v." hoặc một chữ cái viết tắt: câu chưa kết thúc
+            if last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha()):
+                continue
+        if piece.strip():
+            sentences.append(piece.strip())
+        start = match.end()
+
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
+
+
+def word_windows(sentence: str, tokens: int, budget: int, overlap_words: int) -> List[Tuple[str, int]]:
+    """Cắt câu quá budget thành các cửa sổ từ liên tiếp có overlap, số token mỗi cửa sổ ước lượng theo tỉ lệ từ"""
+    words = sentence.split()
+    # Chừa 10% vì số token trên mỗi từ không đều
+    size = max(1, int(len(words) * budget * 0.9 / tokens))
+    step = max(1, size - min(overlap_words, size // 2))
+    windows = []
+    for start in range(0, len(words), step):
+        window = words[start:start + size]
+        windows.append((" ".join(window), max(1, round(tokens * len(window) / len(words)))))
+        if start + size >= len(words):
+            break
+    return windows
+
+
+def pack_sentences(sentences: Sequence[str], counts: Sequence[int], budget: int, overlap_words: int) -> List[Tuple[str, int]]:
+    """Gộp các câu liên tiếp thành đoạn tối đa budget token"""
+    chunks: List[Tuple[str, int]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for sentence, tokens in zip(sentences, counts):
+        if tokens > budget:
+            if current:
+                chunks.append((" ".join(current), current_tokens))
+                current, current_tokens = [], 0
+            chunks.extend(word_windows(sentence, tokens, budget, overlap_words))
+            continue
+        if current and current_tokens + tokens > budget:
+            chunks.append((" ".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+
+    if current:
+        chunks.append((" ".join(current), current_tokens))
+    return chunks
+
+
+class SegmentedTexts:
+    """
+    Các đoạn của một batch text
+
+    chunks[starts[i]:starts[i + 1]] là các đoạn của text i (text ngắn chỉ có một đoạn là chính nó),
+    weights là số token của từng đoạn
+    """
+
+    def __init__(self, chunks: List[str], starts: np.ndarray, weights: np.ndarray):
+        self.chunks = chunks
+        self.starts = starts
+        self.weights = weights
+
+    @property
+    def segmented(self) -> bool:
+        return len(self.chunks) > len(self.starts) - 1
+
+    def chunks_of(self, index: int) -> List[Tuple[str, int]]:
+        start, end = self.starts[index], self.starts[index + 1]
+        return list(zip(self.chunks[start:end], self.weights[start:end].astype(int).tolist()))
+
+    def counts(self) -> np.ndarray:
+        """Số đoạn của từng text"""
+        return np.diff(self.starts)
+
+
+class TextSegmenter:
+    """Chia các text vượt quá token budget của model thành đoạn"""
+
+    def __init__(self, tokenization: TokenizationStage, max_chunks: int = 32, overlap_words: int = 8):
+        """
+        Initialize Text Segmenter
+
+        Args:
+            tokenization: Tokenization stage của version model (dùng để đếm token)
+            max_chunks: Số đoạn tối đa mỗi text, text dài hơn được lấy mẫu đều các đoạn
+            overlap_words: Số từ overlap giữa các cửa sổ của một câu quá dài
+        """
+        self.tokenization = tokenization
+        self.budget = tokenization.content_budget
+        self.max_chunks = max_chunks
+        self.overlap_words = overlap_words
+
+    def segment(self, texts: List[str]) -> SegmentedTexts:
+        """Chia batch texts, tokenizer chỉ được gọi hai lần cho cả batch"""
+        # Mỗi token ứng với ít nhất một ký tự nên text ngắn hơn budget ký tự không cần đếm token
+        candidates = [i for i, text in enumerate(texts) if len(text) > self.budget]
+        counts = self.tokenization.count_tokens([texts[i] for i in candidates])
+        long_texts = [i for i, tokens in zip(candidates, counts) if tokens > self.budget]
+
+        per_text: List[List[Tuple[str, int]]] = [[(text, 1)] for text in texts]
+        if long_texts:
+            sentences = [split_sentences(texts[i]) for i in long_texts]
+            flat = [sentence for group in sentences for sentence in group]
+            flat_counts = iter(self.tokenization.count_tokens(flat))
+            for i, group in zip(long_texts, sentences):
+                group_counts = [next(flat_counts) for _ in group]
+                chunks = pack_sentences(group, group_counts, self.budget, self.overlap_words)
+                if len(chunks) > self.max_chunks:
+                    keep = np.linspace(0, len(chunks) - 1, self.max_chunks).round().astype(int)
+                    chunks = [chunks[k] for k in keep]
+                per_text[i] = chunks
+
+        starts = np.zeros(len(texts) + 1, dtype=np.int64)
+        starts[1:] = np.cumsum([len(chunks) for chunks in per_text])
+        chunks = [chunk for group in per_text for chunk, _ in group]
+        weights = np.asarray([tokens for group in per_text for _, tokens in group], dtype=np.float32)
+        return SegmentedTexts(chunks, starts, weights)
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Similarity Index cho nội dung đã phân tích
+Sentence embedding (chuẩn hoá L2) của post/comment/message lưu trong SQLite theo model, mỗi process giữ
+một index NumPy trong bộ nhớ và đọc thêm các thay đổi mới (theo seq) trước mỗi truy vấn nên mọi gunicorn worker
+thấy cùng dữ liệu. Index "exact" so với mọi vector; "ivf" chia vector thành cụm bằng k-means và chỉ so với các
+cụm gần nhất (nhanh hơn, có thể bỏ sót một phần kết quả)
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import INDEX_BUILD_SECONDS, INDEX_QUERY_SECONDS
+from routing import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+INDEX_KINDS = ("exact", "ivf")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    id TEXT NOT NULL,
+    vector BLOB,
+    updated_at REAL NOT NULL,
+    UNIQUE (model, id)
+);
+CREATE INDEX IF NOT EXISTS vectors_model_seq ON vectors (model, seq);
+"""
+
+VECTOR_DTYPE = np.dtype("<f4")
+
+
+class VectorStore:
+    """
+    Vector theo (model, id) trong SQLite, mỗi thread một connection
+
+    Mỗi lần ghi tạo row với seq mới (xoá là row có vector NULL), process khác đọc các row có seq lớn hơn
+    seq đã thấy để cập nhật index trong bộ nhớ
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            # Connection không dùng lại được sau fork
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, model: str, rows: List[Tuple[str, Optional[bytes]]]):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Xoá rồi insert để row nhận seq mới, process khác thấy thay đổi dù id đã có
+            conn.executemany("DELETE FROM vectors WHERE model = ? AND id = ?", [(model, item_id) for item_id, _ in rows])
+            conn.executemany(
+                "INSERT INTO vectors (model, id, vector, updated_at) VALUES (?, ?, ?, ?)",
+                [(model, item_id, blob, now) for item_id, blob in rows],
+            )
+
+    def put(self, model: str, ids: Sequence[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=VECTOR_DTYPE)
+        self._write(model, [(item_id, vector.tobytes()) for item_id, vector in zip(ids, vectors)])
+
+    def delete(self, model: str, ids: Sequence[str]):
+        self._write(model, [(item_id, None) for item_id in ids])
+
+    def changes(self, model: str, after_seq: int = 0) -> List[Tuple[int, str, Optional[bytes]]]:
+        """Các row (seq, id, vector) có seq > after_seq theo thứ tự ghi, vector None là id đã xoá"""
+        return self._connect().execute(
+            "SELECT seq, id, vector FROM vectors WHERE model = ? AND seq > ? ORDER BY seq", (model, after_seq)
+        ).fetchall()
+
+
+def top_k(similarities: np.ndarray, k: int) -> np.ndarray:
+    """Index của k phần tử lớn nhất mỗi hàng, giảm dần"""
+    k = min(k, similarities.shape[1])
+    if k <= 0:
+        return np.empty((similarities.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(similarities, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+class BruteForceIndex:
+    """Ma trận (N, dim) các vector chuẩn hoá, cosine similarity là tích vô hướng với mọi vector"""
+
+    kind = "exact"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:len(self.ids)]
+
+    def _grow(self, size: int):
+        # Tăng capacity gấp đôi để thêm từng vector vẫn là O(1) trung bình
+        if size > self._vectors.shape[0]:
+            grown = np.empty((max(size, 2 * self._vectors.shape[0], 64), self.dim), dtype=np.float32)
+            grown[:len(self.ids)] = self.vectors
+            self._vectors = grown
+
+    def upsert(self, item_id: str, vector: np.ndarray) -> int:
+        row = self._rows.get(item_id)
+        if row is None:
+            row = len(self.ids)
+            self._grow(row + 1)
+            self.ids.append(item_id)
+            self._rows[item_id] = row
+        self._vectors[row] = vector
+        return row
+
+    def remove(self, item_id: str) -> Optional[Tuple[int, int]]:
+        """Xoá bằng cách chuyển hàng cuối vào chỗ trống, trả về (hàng bị xoá, hàng cuối cũ)"""
+        row = self._rows.pop(item_id, None)
+        if row is None:
+            return None
+        last = len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.ids[row] = moved
+            self._rows[moved] = row
+            self._vectors[row] = self._vectors[last]
+        self.ids.pop()
+        return row, last
+
+    def vector_of(self, item_id: str) -> Optional[np.ndarray]:
+        row = self._rows.get(item_id)
+        return None if row is None else self._vectors[row].copy()
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """k vector gần nhất (id, cosine similarity) của từng query, mọi query chung một phép nhân ma trận"""
+        similarities = queries @ self.vectors.T
+        best = top_k(similarities, k)
+        return [
+            [(self.ids[row], float(row_similarities[row])) for row in rows]
+            for rows, row_similarities in zip(best, similarities)
+        ]
+
+    def build(self):
+        """Index exact không cần build"""
+
+    def needs_build(self) -> bool:
+        return False
+
+    def info(self) -> Dict:
+        return {"kind": self.kind, "size": len(self), "dim": self.dim}
+
+
+class IVFIndex(BruteForceIndex):
+    """
+    Inverted file index: k-means (cosine) chia vector thành n_lists cụm, query chỉ so với vector thuộc
+    nprobe cụm có centroid gần nhất. Chưa đủ vector để train thì tìm như exact
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim: int, n_lists: int = 64, nprobe: int = 8, train_sample: int = 256, iterations: int = 10):
+        super().__init__(dim)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.train_sample = train_sample
+        self.iterations = iterations
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self._lists = np.empty(0, dtype=np.int32)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def upsert(self, item_id: str, vector: np.ndarray) -> int:
+        row = super().upsert(item_id, vector)
+        if self.centroids is not None:
+            if row >= self._lists.shape[0]:
+                grown = np.zeros(self._vectors.shape[0], dtype=np.int32)
+                grown[:self._lists.shape[0]] = self._lists
+                self._lists = grown
+            self._lists[row] = self._assign(vector[None, :])[0]
+        return row
+
+    def remove(self, item_id: str) -> Optional[Tuple[int, int]]:
+        moved = super().remove(item_id)
+        if moved is not None and self.centroids is not None:
+            row, last = moved
+            self._lists[row] = self._lists[last]
+        return moved
+
+    def build(self):
+        """Train k-means trên một mẫu vector (tối đa train_sample mỗi cụm) rồi gán cụm cho mọi vector"""
+        size = len(self)
+        if size < self.n_lists * 4:
+            self.centroids, self.trained_size = None, 0
+            return
+
+        rng = np.random.default_rng(0)
+        sample = self.vectors[rng.choice(size, min(size, self.n_lists * self.train_sample), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], self.n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            # Cụm rỗng giữ centroid cũ
+            empty = np.bincount(assign, minlength=self.n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(min=1e-12)
+
+        self.centroids = centroids.astype(np.float32)
+        self._lists = np.zeros(self._vectors.shape[0], dtype=np.int32)
+        self._lists[:size] = self._assign(self.vectors)
+        self.trained_size = size
+
+    def needs_build(self) -> bool:
+        """Train lại khi số vector tăng gấp đôi so với lần train trước"""
+        return len(self) >= self.n_lists * 4 and len(self) >= 2 * self.trained_size
+
+    def search(self, queries: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        if self.centroids is None:
+            return super().search(queries, k)
+        results = []
+        probes = top_k(queries @ self.centroids.T, self.nprobe)
+        for query, probe in zip(queries, probes):
+            probed = np.zeros(self.n_lists, dtype=bool)
+            probed[probe] = True
+            rows = np.flatnonzero(probed[self._lists[:len(self)]])
+            similarities = self.vectors[rows] @ query
+            best = top_k(similarities[None, :], k)[0]
+            results.append([(self.ids[rows[i]], float(similarities[i])) for i in best])
+        return results
+
+    def info(self) -> Dict:
+        return {
+            **super().info(),
+            "n_lists": self.n_lists,
+            "nprobe": self.nprobe,
+            "trained": self.centroids is not None,
+            "trained_size": self.trained_size,
+        }
+
+
+class SimilarityIndex:
+    """Index của một model (embedding của các model khác nhau không so sánh được), đồng bộ với VectorStore"""
+
+    def __init__(self, store: VectorStore, model: str, kind: str = "exact", n_lists: int = 64, nprobe: int = 8):
+        """
+        Initialize Similarity Index
+
+        Args:
+            store: VectorStore dùng chung giữa các process
+            model: Model key (ModelVersion.cache_model) của embedding
+            kind: "exact" (NumPy brute force) hoặc "ivf" (approximate)
+            n_lists: Số cụm của index ivf
+            nprobe: Số cụm được so với mỗi query của index ivf
+        """
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Index {kind} không được hỗ trợ. Chọn: {list(INDEX_KINDS)}")
+        self.store = store
+        self.model = model
+        self.kind = kind
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+
+        self.index: Optional[BruteForceIndex] = None
+        self.build_seconds: Optional[float] = None
+        self.latency = LatencyTracker()
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _create(self, dim: int) -> BruteForceIndex:
+        if self.kind == "ivf":
+            return IVFIndex(dim, n_lists=self.n_lists, nprobe=self.nprobe)
+        return BruteForceIndex(dim)
+
+    def _apply(self, rows) -> int:
+        for seq, item_id, blob in rows:
+            self._seq = seq
+            if blob is None:
+                if self.index is not None:
+                    self.index.remove(item_id)
+                continue
+            vector = np.frombuffer(blob, dtype=VECTOR_DTYPE)
+            if self.index is None:
+                self.index = self._create(vector.shape[0])
+            self.index.upsert(item_id, vector)
+        return len(rows)
+
+    def _sync(self):
+        """Đọc các thay đổi từ store (kể cả của process khác); lần đầu là load toàn bộ, có tính thời gian build"""
+        first = self.index is None
+        start = time.perf_counter()
+        self._apply(self.store.changes(self.model, self._seq))
+        if self.index is not None and (first or self.index.needs_build()):
+            self.index.build()
+            self._record_build(time.perf_counter() - start)
+
+    def _record_build(self, seconds: float):
+        self.build_seconds = round(seconds, 4)
+        INDEX_BUILD_SECONDS.set(self.build_seconds, pid=str(os.getpid()), model=self.model)
+        logger.info("Similarity index built", extra={"model": self.model, **self.index.info(), "build_seconds": self.build_seconds})
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray):
+        """Thêm hoặc thay vector của các id"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.index is not None and vectors.shape[1] != self.index.dim:
+                raise ValueError(f"Embedding có {vectors.shape[1]} chiều, index có {self.index.dim} chiều")
+            self.store.put(self.model, ids, vectors)
+            self._sync()
+
+    def remove(self, ids: Sequence[str]):
+        with self._lock:
+            self.store.delete(self.model, ids)
+            self._sync()
+
+    def rebuild(self) -> Dict:
+        """Load lại toàn bộ từ store và build lại index (train lại các cụm của ivf)"""
+        with self._lock:
+            self.index, self._seq = None, 0
+            start = time.perf_counter()
+            self._apply(self.store.changes(self.model, 0))
+            if self.index is not None:
+                self.index.build()
+                self._record_build(time.perf_counter() - start)
+        return self.stats()
+
+    def vector_of(self, item_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            self._sync()
+            return self.index.vector_of(item_id) if self.index is not None else None
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int = 10,
+        min_score: Optional[float] = None,
+        exclude: Optional[Sequence[Optional[str]]] = None,
+    ) -> List[List[Dict]]:
+        """
+        Các id gần nhất của từng query
+
+        Args:
+            queries: Ma trận (Q, dim) embedding chuẩn hoá
+            k: Số kết quả tối đa mỗi query
+            min_score: Chỉ giữ kết quả có cosine similarity >= min_score (near-duplicate)
+            exclude: Id bỏ qua của từng query (ví dụ chính id được dùng làm query)
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        with self._lock:
+            self._sync()
+            if self.index is None or not len(self.index):
+                return [[] for _ in range(queries.shape[0])]
+            if queries.shape[1] != self.index.dim:
+                raise ValueError(f"Query có {queries.shape[1]} chiều, index có {self.index.dim} chiều")
+
+            start = time.perf_counter()
+            found = self.index.search(queries, k + 1 if exclude else k)
+            elapsed = time.perf_counter() - start
+        self.latency.record(elapsed)
+        INDEX_QUERY_SECONDS.observe(elapsed, kind=self.kind)
+
+        results = []
+        for i, matches in enumerate(found):
+            skip = exclude[i] if exclude else None
+            kept = [
+                {"id": item_id, "score": round(score, 4)}
+                for item_id, score in matches
+                if item_id != skip and (min_score is None or score >= min_score)
+            ]
+            results.append(kept[:k])
+        return results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            info = self.index.info() if self.index is not None else {"kind": self.kind, "size": 0}
+        return {
+            "model": self.model,
+            **info,
+            "build_seconds": self.build_seconds,
+            "query_latency": self.latency.snapshot(),
+        }
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Startup Report cho sentiment service
+Thời gian từng phase khởi động (import, LLM client, fetch/verify/load/warm-up từng version model...) để biết
+rolling deploy chậm ở đâu; báo cáo được log một lần khi ready, trả về trong /health và export qua /metrics
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import STARTUP_SECONDS
+
+
+class StartupReport:
+    """Thời gian các phase khởi động theo thứ tự ghi nhận"""
+
+    def __init__(self, started_at: Optional[float] = None):
+        """
+        Initialize Startup Report
+
+        Args:
+            started_at: time.perf_counter() lúc bắt đầu khởi động, mặc định là lúc tạo report
+        """
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.ready_seconds: Optional[float] = None
+        self._phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        seconds = round(seconds, 4)
+        with self._lock:
+            self._phases[name] = seconds
+        STARTUP_SECONDS.set(seconds, pid=str(os.getpid()), phase=name)
+
+    @contextmanager
+    def phase(self, name: str):
+        """Đo thời gian một phase, vẫn ghi nhận khi phase raise"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def add(self, prefix: str, timings: Dict[str, float]):
+        """Ghi các timing đã đo sẵn (ví dụ ModelVersion.timings) với tiền tố"""
+        for name, seconds in timings.items():
+            self.record(f"{prefix}.{name}", seconds)
+
+    def mark_ready(self) -> float:
+        """Ghi tổng thời gian từ lúc bắt đầu tới khi ready"""
+        self.ready_seconds = round(time.perf_counter() - self.started_at, 4)
+        STARTUP_SECONDS.set(self.ready_seconds, pid=str(os.getpid()), phase="ready")
+        return self.ready_seconds
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            phases = dict(self._phases)
+        return {"phases": phases, "ready_seconds": self.ready_seconds}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures dùng chung cho tests
+Model BERT nhỏ khởi tạo ngẫu nhiên (7 nhãn như model thật) và tokenizer WordPiece từ vocab tự sinh,
+không cần tải model từ Hugging Face
+"""
+import os
+import string
+
+import pytest
+
+VOCAB = (
+    ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    + list(string.ascii_lowercase + string.digits + string.punctuation)
+    + [f"##{char}" for char in string.ascii_lowercase + string.digits]
+    + ["vui", "buon", "qua", "toi", "rat", "thich", "gian", "so", "ghe", "bat", "ngo", "hom", "nay"]
+)
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """Thư mục model local (config, weights, tokenizer fast + slow) cho ModelVersion / ModelLoader"""
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizer, BertTokenizerFast
+
+    path = tmp_path_factory.mktemp("tiny-model")
+    vocab_file = path / "vocab.txt"
+    vocab_file.write_text("\n".join(VOCAB) + "\n")
+
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(VOCAB),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=512,
+        num_labels=7,
+    )
+    BertForSequenceClassification(config).eval().save_pretrained(str(path), safe_serialization=True)
+    # Lưu cả hai loại để TokenizationStage "auto" chạy parity check
+    BertTokenizer(str(vocab_file)).save_pretrained(str(path))
+    BertTokenizerFast(vocab_file=str(vocab_file)).save_pretrained(str(path))
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def service(tiny_model_dir, tmp_path_factory):
+    """Module api_service chạy với model nhỏ, SQLite tạm, không job worker và không gọi LLM"""
+    data = tmp_path_factory.mktemp("service")
+    os.environ.update({
+        "SENTIMENT_MODEL_ID": tiny_model_dir,
+        "SENTIMENT_V1_MODEL_ID": tiny_model_dir,
+        "SENTIMENT_MODEL_CONTROL": str(data / "active-model.json"),
+        "SENTIMENT_WARMUP_BATCH_SIZES": "0",
+        "SENTIMENT_JOB_WORKERS": "0",
+        "SENTIMENT_JOB_DB": str(data / "jobs.sqlite3"),
+        "SENTIMENT_INDEX_DB": str(data / "index.sqlite3"),
+        "SENTIMENT_ROLLUP_DB": str(data / "rollups.sqlite3"),
+        "SENTIMENT_ADMIN_TOKEN": "test-admin",
+        "LLM_ENABLED": "0",
+    })
+    import api_service
+
+    api_service.wait_until_ready(timeout=120)
+    return api_service
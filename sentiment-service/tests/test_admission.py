@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Tests cho admission control: slot theo lane, ưu tiên interactive và các response 429 / 503 / 504"""
+import threading
+import time
+
+import pytest
+
+from admission import BACKGROUND, INTERACTIVE, AdmissionController, Rejected
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def acquire_in_thread(controller, lane, admitted, **kwargs):
+    def run():
+        try:
+            controller.acquire(lane, **kwargs)
+            admitted.append(lane)
+        except Rejected as e:
+            admitted.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_background_lane_is_limited_to_its_share():
+    controller = AdmissionController(max_concurrent=4, background_share=0.5, max_queue_wait=0.05)
+    controller.acquire(BACKGROUND)
+    controller.acquire(BACKGROUND)
+
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire(BACKGROUND)
+    assert rejected.value.status == 429
+    assert rejected.value.reason == "queue_timeout"
+    assert rejected.value.retry_after >= 1
+
+    # Slot còn lại vẫn dành cho interactive
+    controller.acquire(INTERACTIVE)
+    controller.acquire(INTERACTIVE)
+    assert controller.active(INTERACTIVE) == 2 and controller.active(BACKGROUND) == 2
+
+
+def test_full_queue_is_rejected_immediately():
+    controller = AdmissionController(max_concurrent=1, max_queue_interactive=0, max_queue_background=0, max_queue_wait=5)
+    controller.acquire(INTERACTIVE)
+
+    start = time.monotonic()
+    with pytest.raises(Rejected) as interactive:
+        controller.acquire(INTERACTIVE)
+    with pytest.raises(Rejected) as background:
+        controller.acquire(BACKGROUND)
+
+    assert time.monotonic() - start < 1
+    assert (interactive.value.status, interactive.value.reason) == (503, "queue_full")
+    assert (background.value.status, background.value.reason) == (429, "queue_full")
+    assert interactive.value.retry_after >= 1 and background.value.retry_after >= 1
+    assert controller.stats()["lanes"][INTERACTIVE]["queue_full"] == 1
+
+
+def test_expired_deadline_is_rejected_with_504():
+    controller = AdmissionController(max_concurrent=1)
+
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire(INTERACTIVE, deadline=time.monotonic() - 0.01)
+    assert (rejected.value.status, rejected.value.retry_after) == (504, None)
+
+    # Deadline hết khi đang chờ slot
+    controller.acquire(INTERACTIVE)
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire(INTERACTIVE, deadline=time.monotonic() + 0.05)
+    assert (rejected.value.status, rejected.value.reason) == (504, "deadline_exceeded")
+    assert controller.waiting(INTERACTIVE) == 0
+    assert controller.stats()["lanes"][INTERACTIVE]["deadline_exceeded"] == 2
+
+
+def test_waiting_interactive_request_is_admitted_before_background():
+    controller = AdmissionController(max_concurrent=2, background_share=0.5, max_queue_wait=2)
+    controller.acquire(INTERACTIVE)
+    controller.acquire(INTERACTIVE)
+
+    admitted = []
+    threads = [acquire_in_thread(controller, BACKGROUND, admitted)]
+    wait_for(lambda: controller.waiting(BACKGROUND) == 1)
+    threads.append(acquire_in_thread(controller, INTERACTIVE, admitted))
+    wait_for(lambda: controller.waiting(INTERACTIVE) == 1)
+
+    controller.release(INTERACTIVE, 0.01)
+    wait_for(lambda: len(admitted) == 1)
+    assert admitted == [INTERACTIVE]
+
+    controller.release(INTERACTIVE, 0.01)
+    for thread in threads:
+        thread.join(2)
+    assert admitted == [INTERACTIVE, BACKGROUND]
+
+
+def test_admit_releases_slot_after_block():
+    controller = AdmissionController(max_concurrent=1)
+    with controller.admit(INTERACTIVE):
+        assert controller.active(INTERACTIVE) == 1
+    with pytest.raises(RuntimeError):
+        with controller.admit(INTERACTIVE):
+            raise RuntimeError("view failed")
+    assert controller.active(INTERACTIVE) == 0
+    assert controller.stats()["lanes"][INTERACTIVE]["admitted"] == 2
+
+
+@pytest.fixture
+def saturated(service, monkeypatch):
+    """Admission controller một slot đang bị chiếm, hàng đợi 0"""
+    controller = AdmissionController(max_concurrent=1, max_queue_interactive=0, max_queue_background=0)
+    monkeypatch.setattr(service, "admission", controller)
+    controller.acquire(INTERACTIVE)
+    return controller
+
+
+def test_saturated_interactive_route_returns_503(service, saturated):
+    response = service.app.test_client().post('/analyze', json={"text": "vui qua"})
+
+    assert response.status_code == 503
+    assert response.get_json()["reason"] == "queue_full"
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_saturated_background_route_returns_429(service, saturated):
+    client = service.app.test_client()
+
+    batch = client.post('/analyze/batch', json={"texts": ["vui qua"]})
+    prioritized = client.post('/analyze', json={"text": "vui qua"}, headers={"X-Priority": "background"})
+
+    for response in (batch, prioritized):
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_expired_request_deadline_returns_504(service, saturated):
+    client = service.app.test_client()
+
+    timeout = client.post('/analyze', json={"text": "vui qua"}, headers={"X-Request-Timeout-Ms": "0"})
+    deadline = client.post('/analyze', json={"text": "vui qua"}, headers={"X-Request-Deadline": str((time.time() - 1) * 1000)})
+
+    for response in (timeout, deadline):
+        assert response.status_code == 504
+        assert response.get_json()["reason"] == "deadline_exceeded"
+        assert "Retry-After" not in response.headers
+
+
+def test_unknown_priority_returns_400(service):
+    response = service.app.test_client().post('/analyze', json={"text": "vui qua"}, headers={"X-Priority": "urgent"})
+    assert response.status_code == 400
+
+
+def test_admitted_request_releases_slot(service, saturated):
+    saturated.release(INTERACTIVE, 0.01)
+    response = service.app.test_client().post('/analyze', json={"text": "vui qua"})
+
+    assert response.status_code == 200
+    assert saturated.active(INTERACTIVE) == 0
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Tests cho AIBatchProcessor: retry, backoff, Retry-After và khôi phục JSON array bị cắt, với mock server OpenAI-compatible"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from ai_batch_processor import AIBatchProcessor
+from benchmarks.mock_llm import MockLLMConfig, MockLLMServer
+
+
+@pytest.fixture
+def server():
+    server = MockLLMServer(MockLLMConfig(latency_ms=0, jitter_ms=0, per_item_ms=0)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def make_processor(server):
+    processors = []
+
+    def make(**kwargs):
+        kwargs.setdefault("backoff_base", 0.01)
+        kwargs.setdefault("backoff_max", 0.05)
+        processor = AIBatchProcessor(base_url=server.base_url, api_key="mock", model="mock", **kwargs)
+        processors.append(processor)
+        return processor
+
+    yield make
+    for processor in processors:
+        processor.close()
+
+
+def script(server, draws, **rates):
+    """Cho mock server trả lỗi theo thứ tự draws thay vì ngẫu nhiên"""
+    for key, value in rates.items():
+        setattr(server.config, key, value)
+    remaining = iter(draws)
+    server.config.draw = lambda: next(remaining, 1.0)
+
+
+def record_delays(processor):
+    delays = []
+    retry_delay = processor._retry_delay
+
+    def recording(attempt, error):
+        delays.append(retry_delay(attempt, error))
+        return delays[-1]
+
+    processor._retry_delay = recording
+    return delays
+
+
+def is_scored(processor, result):
+    """Kết quả lấy từ LLM (không phải default scores khi lỗi)"""
+    return result != processor._get_default_scores() and sum(result.values()) == pytest.approx(100)
+
+
+def error_with_headers(**headers):
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+def test_rate_limit_is_retried_after_retry_after(server, make_processor):
+    # Lần đầu 429 kèm Retry-After: 1, lần sau thành công
+    script(server, [0.1, 0.9], rate_limit_rate=0.5)
+    processor = make_processor(max_retries=2)
+    delays = record_delays(processor)
+
+    result = processor.analyze_single_text("toi rat vui")
+
+    assert is_scored(processor, result)
+    assert server.config.stats["rate_limited"] == 1
+    assert server.config.stats["requests"] == 2
+    # Retry-After được ưu tiên hơn jitter nhưng không vượt backoff_max
+    assert delays == [0.05]
+
+
+def test_server_errors_exhaust_retries_and_return_default_scores(server, make_processor):
+    script(server, [0.0] * 10, error_rate=1.0)
+    processor = make_processor(max_retries=2)
+    delays = record_delays(processor)
+
+    result = processor.analyze_single_text("toi rat buon")
+
+    assert result == processor._get_default_scores()
+    assert server.config.stats["requests"] == 3
+    assert len(delays) == 2
+    assert all(0 <= delay <= 0.05 for delay in delays)
+
+
+def test_timeout_is_retried(server, make_processor):
+    script(server, [0.1, 0.9], timeout_rate=0.5, timeout_seconds=1.0)
+    processor = make_processor(max_retries=1, call_timeout=0.2)
+
+    assert is_scored(processor, processor.analyze_single_text("so qua"))
+    assert server.config.stats["timeouts"] == 1
+
+
+def test_failed_results_are_not_cached(server, make_processor):
+    class Cache(dict):
+        def get(self, text, model):
+            return dict.get(self, (text, model))
+
+        def set(self, text, result, model):
+            self[(text, model)] = result
+
+    cache = Cache()
+    script(server, [0.0], error_rate=1.0)
+    processor = make_processor(max_retries=0, cache=cache)
+
+    assert processor.analyze_single_text("gian") == processor._get_default_scores()
+    assert cache == {}
+    assert is_scored(processor, processor.analyze_single_text("gian"))
+    assert len(cache) == 1
+
+
+def test_retry_delay_prefers_retry_after_headers():
+    processor = AIBatchProcessor(base_url="http://127.0.0.1:1/v1", api_key="x", backoff_base=0.5, backoff_max=8.0)
+
+    assert processor._retry_delay(0, error_with_headers(**{"retry-after-ms": "250"})) == 0.25
+    assert processor._retry_delay(0, error_with_headers(**{"retry-after": "3"})) == 3.0
+    assert processor._retry_delay(0, error_with_headers(**{"retry-after": "120"})) == 8.0
+    # Retry-After dạng HTTP date không parse được thì dùng backoff
+    assert 0 <= processor._retry_delay(0, error_with_headers(**{"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) <= 0.5
+
+
+def test_retry_delay_uses_full_jitter_capped_by_backoff_max():
+    processor = AIBatchProcessor(base_url="http://127.0.0.1:1/v1", api_key="x", backoff_base=0.5, backoff_max=2.0)
+
+    for attempt, bound in [(0, 0.5), (1, 1.0), (2, 2.0), (6, 2.0)]:
+        delays = [processor._retry_delay(attempt, None) for _ in range(200)]
+        assert all(0 <= delay <= bound for delay in delays)
+        # Full jitter: trải đều trên [0, bound] chứ không cố định ở bound
+        assert min(delays) < bound / 2 < max(delays)
+
+
+def scores(i=None, enjoyment=60, sadness=10):
+    item = {"enjoyment": enjoyment, "sadness": sadness, "anger": 10, "fear": 5, "disgust": 5, "surprise": 5, "other": 5}
+    if i is not None:
+        item = {"i": i, **item}
+    return item
+
+
+def dumps(items):
+    return json.dumps(items, ensure_ascii=False)
+
+
+@pytest.fixture
+def parser():
+    return AIBatchProcessor(base_url="http://127.0.0.1:1/v1", api_key="x")
+
+
+@pytest.mark.parametrize("text", [
+    dumps([scores(1), scores(2)]),
+    "```json\n" + dumps([scores(1), scores(2)]) + "\n```",
+    "Kết quả phân tích:\n" + dumps([scores(1), scores(2)]) + "\nHy vọng hữu ích!",
+    dumps({"results": [scores(1), scores(2)]}),
+])
+def test_extract_json_array_accepts_wrapped_arrays(parser, text):
+    assert parser.extract_json_array(text) == [scores(1), scores(2)]
+
+
+def test_extract_json_array_wraps_single_object(parser):
+    assert parser.extract_json_array(dumps(scores(1))) == [scores(1)]
+
+
+def test_extract_json_array_recovers_truncated_array(parser):
+    full = dumps([scores(1), scores(2), scores(3)])
+    truncated = full[: full.rindex('"fear"')]
+
+    assert parser.extract_json_array(truncated) == [scores(1), scores(2)]
+    assert parser.extract_json_array("```json\n" + truncated) == [scores(1), scores(2)]
+
+
+def test_extract_json_array_keeps_place_of_garbled_objects(parser):
+    text = "[" + dumps(scores(1)) + ', {"i": 2, "anger": 5,,}, ' + dumps(scores(3))
+
+    assert parser.extract_json_array(text) == [scores(1), None, scores(3)]
+
+
+@pytest.mark.parametrize("text", ["", "Xin lỗi, tôi không thể phân tích.", "[", '[{"i": 1, "enjoyment": 60'])
+def test_extract_json_array_returns_none_without_objects(parser, text):
+    assert parser.extract_json_array(text) is None
+
+
+def test_align_batch_items_uses_index_then_position(parser):
+    items = [scores(3, enjoyment=30), scores(None, enjoyment=10), None, scores(1, enjoyment=50)]
+
+    assert parser._align_batch_items(items, 3) == [
+        parser._normalize_scores(items[3]),
+        parser._normalize_scores(items[1]),
+        parser._normalize_scores(items[0]),
+    ]
+
+
+def test_align_batch_items_drops_invalid_and_duplicate_items(parser):
+    # i=2 thiếu emotions, i=7 ngoài phạm vi nên theo vị trí, i=1 lặp lại bị bỏ
+    items = [scores(1), {"i": 2, "enjoyment": 60}, scores(7, enjoyment=20), scores(1, enjoyment=90)]
+
+    assert parser._align_batch_items(items, 3) == [
+        parser._normalize_scores(items[0]),
+        None,
+        parser._normalize_scores(items[2]),
+    ]
+
+
+def test_truncated_batch_response_keeps_recovered_items(server, make_processor):
+    texts = ["toi rat vui", "hom nay buon qua", "so ghe", "bat ngo qua"]
+    # Request batch thành công nhưng response bị cắt ở 2/3
+    script(server, [0.9, 0.0], truncate_rate=1.0)
+    processor = make_processor(max_retries=0)
+
+    results = processor.analyze_batch_optimized(texts, fallback=False)
+
+    assert server.config.stats["truncated"] == 1
+    recovered = [result is not None for result in results]
+    assert recovered[0] and not recovered[-1]
+    assert all(is_scored(processor, result) for result in results if result is not None)
+    # Chỉ các text bị mất mới gọi lại LLM từng câu
+    script(server, [0.9, 0.0], truncate_rate=1.0)
+    requests = server.config.stats["requests"]
+    fallback = processor.analyze_batch_optimized(texts)
+
+    assert all(is_scored(processor, result) for result in fallback)
+    assert server.config.stats["requests"] - requests == 1 + recovered.count(False)
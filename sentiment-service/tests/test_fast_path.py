@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Tests cho fast path: emoji, câu ngắn, text thường phải qua model và ngưỡng confidence"""
+import numpy as np
+import pytest
+
+from fast_path import FastPath, emotion_vector
+
+
+@pytest.fixture
+def fast_path():
+    return FastPath(threshold=0.7, shadow_rate=0)
+
+
+@pytest.mark.parametrize("text, emotion, strength", [
+    ("😂😂😂", "enjoyment", 0.9),
+    ("😭", "sadness", 0.85),
+    # Skin tone và variation selector không làm đổi emoji
+    ("👍🏻", "enjoyment", 0.85),
+    ("❤️", "enjoyment", 0.85),
+    (" :(( ", "sadness", 0.85),
+])
+def test_emoji_only_text_is_classified(fast_path, text, emotion, strength):
+    result = fast_path.classify(text)
+
+    assert result.rule == "emoji"
+    np.testing.assert_allclose(result.scores, emotion_vector(emotion, strength))
+
+
+def test_mixed_emojis_are_averaged(fast_path):
+    result = fast_path.classify("😂😭")
+
+    np.testing.assert_allclose(result.scores, (emotion_vector("enjoyment", 0.9) + emotion_vector("sadness", 0.85)) / 2)
+
+
+@pytest.mark.parametrize("text, emotion, strength", [
+    ("Cảm ơn!!", "enjoyment", 0.85),
+    ("okeee", "other", 0.85),
+    ("huhuuu", "sadness", 0.85),
+    ("TRỜI ƠI", "surprise", 0.8),
+    ("wow https://example.com/post/1", "surprise", 0.8),
+])
+def test_short_phrase_is_classified(fast_path, text, emotion, strength):
+    result = fast_path.classify(text)
+
+    assert result.rule == "phrase"
+    np.testing.assert_allclose(result.scores, emotion_vector(emotion, strength))
+
+
+def test_laugh_and_phrase_with_emoji(fast_path):
+    assert fast_path.classify("hahaha").scores == pytest.approx(emotion_vector("enjoyment", 0.85).tolist())
+
+    result = fast_path.classify("vui quá 😍")
+    assert result.rule == "phrase"
+    np.testing.assert_allclose(result.scores, (emotion_vector("enjoyment", 0.9) + emotion_vector("enjoyment", 0.85)) / 2)
+
+
+@pytest.mark.parametrize("text, rule", [("  ...!?  ", "empty"), ("https://example.com www.example.org", "url")])
+def test_empty_and_link_only_text(fast_path, text, rule):
+    result = fast_path.classify(text)
+
+    assert result.rule == rule
+    assert result.emotion_class == 6
+
+
+@pytest.mark.parametrize("text", [
+    "hôm nay đi làm mệt nhưng vẫn vui vì gặp bạn",
+    "ok nhưng sao vậy",
+    "😂 hôm nay đi học",
+    "buồn 😭 vì thi trượt",
+    "vui " * 20,
+])
+def test_mixed_text_falls_through_to_model(fast_path, text):
+    assert fast_path.classify(text) is None
+    assert fast_path.lookup([text]) == [None]
+
+
+def test_unknown_emoji_lowers_confidence_below_threshold(fast_path):
+    # 🦄 không có trong bảng: kết quả bị kéo một nửa về phân phối đều
+    result = fast_path.classify("😂🦄")
+    assert result.confidence == pytest.approx(0.5 * 0.9 + 0.5 / 7)
+
+    assert fast_path.lookup(["😂🦄", "😂"])[0] is None
+    assert fast_path.stats()["below_threshold"] == 1
+
+
+def test_threshold_decides_which_hits_bypass_the_model():
+    fast_path = FastPath(threshold=0.86, shadow_rate=0)
+
+    results = fast_path.lookup(["ok", "😂", "hôm nay đi làm mệt nhưng vẫn vui vì gặp bạn", "😤"])
+
+    # "ok" (0.85) và 😤 (0.7) dưới ngưỡng nên vẫn chạy model
+    assert [result and result.rule for result in results] == [None, "emoji", None, None]
+    stats = fast_path.stats()
+    assert stats["checked"] == 4
+    assert stats["below_threshold"] == 2
+    assert stats["bypassed"]["emoji"] == 1
+    assert stats["bypass_rate"] == 0.25
+
+
+def test_shadow_records_agreement(fast_path):
+    result = fast_path.classify("😂")
+
+    assert fast_path.record_shadow(result, emotion_vector("enjoyment", 0.6).tolist())
+    assert not fast_path.record_shadow(result, emotion_vector("sadness", 0.6).tolist())
+    assert fast_path.stats()["shadow_agreement"]["emoji"] == 0.5
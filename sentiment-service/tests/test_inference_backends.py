@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tests cho inference backends: ngưỡng top-1 agreement của INT8 / ONNX so với fp32"""
+import pytest
+import torch
+
+import model_registry
+from engine import model_method
+from inference_backends import EVAL_TEXTS, EagerBackend, InferenceBackend, OnnxBackend, check_agreement
+from model_loader import ModelLoader
+from model_registry import ModelVersion
+
+
+class FixedLabels(InferenceBackend):
+    """Backend trả về logits cho trước nhãn top-1 của từng text theo thứ tự"""
+
+    name = "fixed"
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def logits(self, inputs):
+        logits = torch.zeros((inputs["input_ids"].shape[0], 7))
+        logits[torch.arange(len(self.labels)), torch.tensor(self.labels)] = 1.0
+        return logits
+
+
+@pytest.fixture(scope="module")
+def fp32(tiny_model_dir):
+    version = ModelVersion("fp32", tiny_model_dir, max_length=64)
+    version.load()
+    yield version
+    version.unload()
+
+
+def test_check_agreement_counts_matching_top1(fp32):
+    texts = EVAL_TEXTS[:4]
+    reference = FixedLabels([0, 1, 2, 3])
+
+    assert check_agreement(reference, FixedLabels([0, 1, 2, 3]), fp32.tokenization, texts)["agreement"] == 1.0
+    assert check_agreement(reference, FixedLabels([0, 1, 6, 6]), fp32.tokenization, texts)["agreement"] == 0.5
+
+
+def test_eager_backend_agrees_with_itself(fp32):
+    parity = check_agreement(fp32.backend, EagerBackend(fp32.backend.model), fp32.tokenization)
+    assert parity["agreement"] == 1.0
+    assert parity["eval_texts"] == len(EVAL_TEXTS)
+
+
+def test_int8_backend_passes_agreement_check(tiny_model_dir):
+    version = ModelVersion("int8", tiny_model_dir, backend="int8", min_agreement=0.5, max_length=64)
+    version.load()
+    try:
+        assert version.backend.name == "int8"
+        assert version.backend_info["agreement"] >= 0.5
+    finally:
+        version.unload()
+
+
+def test_backend_below_min_agreement_is_rejected(tiny_model_dir, monkeypatch):
+    monkeypatch.setattr(model_registry, "check_agreement", lambda *args, **kwargs: {"agreement": 0.9})
+    version = ModelVersion("int8", tiny_model_dir, backend="int8", min_agreement=0.95, max_length=64)
+
+    with pytest.raises(RuntimeError, match="agreement"):
+        version.load()
+    assert version.state == ModelVersion.FAILED
+    assert version.backend is None
+
+
+def test_onnx_backend_matches_fp32(tiny_model_dir, fp32):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    version = ModelVersion("onnx", tiny_model_dir, backend="onnx", min_agreement=0.95, max_length=64)
+    version.load()
+    try:
+        assert version.backend_info["agreement"] >= 0.95
+        texts = ["vui qua", "toi rat thich hom nay"]
+        expected = torch.tensor(fp32.predict_scores_batch(texts))
+        actual = torch.tensor(version.predict_scores_batch(texts))
+        assert torch.allclose(actual, expected, atol=1e-4)
+    finally:
+        version.unload()
+
+
+def test_onnx_export_leaves_model_in_eval_mode(tiny_model_dir, tmp_path):
+    pytest.importorskip("onnx")
+    model = ModelLoader(tiny_model_dir).load_model()
+    OnnxBackend.export(model, str(tmp_path / "model.onnx"))
+    assert not model.training
+
+
+def test_model_method_names_backend(fp32):
+    assert model_method(fp32) == "pytorch"
+    assert model_method(ModelVersion("int8", "unused", backend="int8")) == "int8"
+    assert model_method(ModelVersion("onnx", "unused", backend="onnx")) == "onnx"
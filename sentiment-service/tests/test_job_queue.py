@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Tests cho job queue: nhận job, lease, huỷ job và callback host"""
+import time
+
+import pytest
+
+from job_queue import CANCELLED, DONE, FAILED, QUEUED, RUNNING, SKIPPED, SUCCEEDED, JobRunner, JobStore, callback_allowed
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def make_runner(store, process_chunk, **kwargs):
+    return JobRunner(store, process_chunk, lambda results, params: {"count": len(results)}, workers=0, **kwargs)
+
+
+def upper_chunk(chunks):
+    """process_chunk ghi lại các sub-batch đã chạy"""
+    def process(texts, params):
+        chunks.append(list(texts))
+        return [{"text": text.upper()} for text in texts]
+    return process
+
+
+def test_claim_takes_oldest_queued_job_once(store):
+    first = store.create(["a", "", "b"], {"aggregation": "mean"})
+    second = store.create(["c"], {})
+
+    assert first["status"] == QUEUED and first["total"] == 2
+    assert [item["status"] for item in store.items(first["job_id"])] == ["pending", SKIPPED, "pending"]
+
+    claimed = store.claim("owner-1", 60)
+    assert claimed["job_id"] == first["job_id"]
+    assert (claimed["status"], claimed["attempts"]) == (RUNNING, 1)
+    assert store.claim("owner-2", 60)["job_id"] == second["job_id"]
+    assert store.claim("owner-3", 60) is None
+
+
+def test_expired_lease_is_claimed_by_another_owner(store):
+    job = store.create(["a", "b"], {})
+    store.claim("dead", 0.05)
+    assert store.claim("other", 60) is None
+
+    time.sleep(0.1)
+    reclaimed = store.claim("other", 60)
+    assert reclaimed["job_id"] == job["job_id"]
+    assert reclaimed["attempts"] == 2
+
+    # Owner cũ không còn ghi được kết quả
+    assert not store.renew(job["job_id"], "dead", 60)
+    assert not store.save_items(job["job_id"], "dead", {0: {"text": "A"}})
+    assert not store.finish(job["job_id"], "dead", SUCCEEDED)
+    assert store.save_items(job["job_id"], "other", {0: {"text": "A"}})
+
+
+def test_runner_processes_chunks_and_finishes(store):
+    job = store.create(["a", "b", None, "c", "d", "e"], {})
+    chunks = []
+    runner = make_runner(store, upper_chunk(chunks), chunk_size=2)
+
+    runner._execute(store.claim("owner", 60), "owner")
+
+    finished = store.get(job["job_id"])
+    assert chunks == [["a", "b"], ["c", "d"], ["e"]]
+    assert (finished["status"], finished["completed"], finished["result"]) == (SUCCEEDED, 5, {"count": 5})
+    assert [item.get("text") for item in store.items(job["job_id"], status=DONE)] == ["A", "B", "C", "D", "E"]
+
+
+def test_reclaimed_job_resumes_from_saved_items(store):
+    job = store.create(["a", "b", "c", "d"], {})
+    claimed = store.claim("dead", 0.05)
+    store.save_items(job["job_id"], "dead", {0: {"text": "A"}, 1: {"text": "B"}})
+    time.sleep(0.1)
+
+    chunks = []
+    make_runner(store, upper_chunk(chunks), chunk_size=2)._execute(store.claim("owner", 60), "owner")
+
+    assert claimed["job_id"] == job["job_id"]
+    assert chunks == [["c", "d"]]
+    assert store.get(job["job_id"])["result"] == {"count": 4}
+
+
+def test_job_over_max_attempts_fails(store):
+    job = store.create(["a"], {})
+    for owner in ("one", "two"):
+        store.claim(owner, 0)
+        time.sleep(0.01)
+
+    chunks = []
+    make_runner(store, upper_chunk(chunks), max_attempts=2)._execute(store.claim("three", 60), "three")
+
+    failed = store.get(job["job_id"])
+    assert chunks == []
+    assert (failed["status"], failed["error"]) == (FAILED, "Job abandoned after 2 attempts")
+
+
+def test_cancel_queued_job(store):
+    job = store.create(["a"], {})
+
+    assert store.cancel(job["job_id"])["status"] == CANCELLED
+    assert store.claim("owner", 60) is None
+
+
+def test_cancel_running_job_stops_after_current_chunk(store):
+    job = store.create(["a", "b", "c", "d", "e", "f"], {})
+    chunks = []
+
+    def cancelling(texts, params):
+        chunks.append(list(texts))
+        store.cancel(job["job_id"])
+        return [{"text": text} for text in texts]
+
+    make_runner(store, cancelling, chunk_size=2)._execute(store.claim("owner", 60), "owner")
+
+    cancelled = store.get(job["job_id"])
+    assert chunks == [["a", "b"]]
+    assert (cancelled["status"], cancelled["completed"]) == (CANCELLED, 0)
+    assert "result" not in cancelled
+
+
+def test_cancel_does_not_change_finished_job(store):
+    job = store.create(["a"], {})
+    make_runner(store, upper_chunk([]))._execute(store.claim("owner", 60), "owner")
+
+    assert store.cancel(job["job_id"])["status"] == SUCCEEDED
+
+
+def test_stopped_runner_releases_job(store):
+    job = store.create(["a", "b", "c"], {})
+    runner = make_runner(store, upper_chunk([]), chunk_size=1)
+    runner._stop.set()
+
+    runner._execute(store.claim("owner", 60), "owner")
+
+    released = store.get(job["job_id"])
+    assert released["status"] == QUEUED
+    assert store.claim("other", 60)["job_id"] == job["job_id"]
+
+
+@pytest.mark.parametrize("url", [
+    "http://169.254.169.254/latest/meta-data/",
+    "http://127.0.0.1:8000/jobs",
+    "http://backend:3000/hooks/sentiment",
+])
+def test_callback_rejected_without_allowlist(url):
+    assert not callback_allowed(url, [])
+
+
+def test_callback_allowlist():
+    allowed = ["backend"]
+    assert callback_allowed("http://backend:3000/hooks/sentiment", allowed)
+    assert callback_allowed("https://BACKEND/hooks", allowed)
+    assert not callback_allowed("http://backend.evil.com/hooks", allowed)
+    assert not callback_allowed("ftp://backend/hooks", allowed)
+    assert not callback_allowed("http:///hooks", allowed)
+
+
+def test_heartbeat_keeps_lease_during_long_chunk(store):
+    store.create(["a", "b"], {})
+    stolen = []
+
+    def slow_chunk(texts, params):
+        # Sub-batch lâu hơn nhiều lần lease, process khác không được nhận lại job
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            stolen.append(store.claim("other", 0.3))
+            time.sleep(0.1)
+        return [{"scores": [0.0]} for _ in texts]
+
+    runner = make_runner(store, slow_chunk, lease_seconds=0.3)
+    job = store.claim("owner", runner.lease_seconds)
+    runner._execute(job, "owner")
+
+    assert not any(stolen)
+    assert store.get(job["job_id"])["status"] == SUCCEEDED
+
+
+def test_job_routes_submit_poll_and_cancel(service):
+    client = service.app.test_client()
+
+    submitted = client.post('/jobs', json={"texts": ["vui qua", "toi rat buon"]})
+    assert submitted.status_code == 202
+    job_id = submitted.get_json()["job_id"]
+    assert submitted.headers["Location"].endswith(f"/jobs/{job_id}")
+
+    service.job_runner._execute(service.job_store.claim("test", 60), "test")
+    finished = client.get(f'/jobs/{job_id}').get_json()
+    assert finished["status"] == SUCCEEDED and finished["completed"] == 2
+    assert client.delete(f'/jobs/{job_id}').status_code == 409
+
+    queued = client.post('/jobs', json={"texts": ["so qua"]}).get_json()["job_id"]
+    cancelled = client.post(f'/jobs/{queued}/cancel')
+    assert (cancelled.status_code, cancelled.get_json()["status"]) == (200, CANCELLED)
+    assert service.job_store.claim("test", 60) is None
+    assert client.delete('/jobs/missing').status_code == 404
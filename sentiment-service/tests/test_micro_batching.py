@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests cho micro-batching: kết quả theo batch giống kết quả từng text"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from micro_batcher import BatcherFull, MicroBatcher
+from model_registry import ModelVersion
+
+TEXTS = [
+    "vui qua",
+    "toi rat thich",
+    "buon qua, toi rat buon",
+    "so",
+    "hom nay bat ngo ghe, toi rat rat rat thich hom nay",
+    "ok",
+]
+
+
+@pytest.fixture(scope="module")
+def version(tiny_model_dir):
+    version = ModelVersion("test", tiny_model_dir, max_batch_size=4, max_wait_ms=20, max_length=64)
+    version.load()
+    yield version
+    version.unload()
+
+
+def test_batched_scores_match_single_text_scores(version):
+    batched = np.asarray(version.predict_scores_batch(TEXTS))
+    single = np.asarray([version.predict_scores_batch([text])[0] for text in TEXTS])
+
+    assert batched.shape == (len(TEXTS), 7)
+    np.testing.assert_allclose(batched, single, atol=1e-5)
+
+
+def test_concurrent_requests_are_coalesced(version):
+    single = np.asarray([version.predict_scores_batch([text])[0] for text in TEXTS])
+    batches_before = version.batches
+
+    with ThreadPoolExecutor(len(TEXTS)) as pool:
+        results = list(pool.map(version.batcher.predict, TEXTS))
+
+    np.testing.assert_allclose(np.asarray(results), single, atol=1e-5)
+    # Các request đến cùng lúc chạy chung forward pass
+    assert version.batches - batches_before < len(TEXTS)
+
+
+def test_micro_batcher_groups_requests_and_keeps_order():
+    sizes = []
+    release = threading.Event()
+
+    def predict(texts):
+        release.wait(1)
+        return [text.upper() for text in texts]
+
+    batcher = MicroBatcher(predict, max_batch_size=8, max_wait_ms=50, on_batch=lambda size, waits: sizes.append(size))
+    try:
+        futures = batcher.submit_many(["a", "b", "c"])
+        futures.append(batcher.submit("d"))
+        release.set()
+        assert [future.result(timeout=2) for future in futures] == ["A", "B", "C", "D"]
+        assert sum(sizes) == 4 and len(sizes) < 4
+    finally:
+        batcher.shutdown(timeout=2)
+
+
+def test_micro_batcher_respects_max_batch_size_and_max_pending():
+    sizes = []
+    batcher = MicroBatcher(lambda texts: texts, max_batch_size=2, max_wait_ms=20, max_pending=5,
+                           on_batch=lambda size, waits: sizes.append(size))
+    try:
+        with pytest.raises(BatcherFull):
+            batcher.submit_many(list("abcdef"))
+        assert batcher.predict_many(list("abcde"), timeout=2) == list("abcde")
+        assert max(sizes) <= 2
+    finally:
+        batcher.shutdown(timeout=2)
+
+
+def test_micro_batcher_predict_error_reaches_every_caller():
+    def predict(texts):
+        time.sleep(0.01)
+        raise RuntimeError("forward failed")
+
+    batcher = MicroBatcher(predict, max_batch_size=4, max_wait_ms=5)
+    try:
+        futures = batcher.submit_many(["a", "b"])
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=2)
+    finally:
+        batcher.shutdown(timeout=2)
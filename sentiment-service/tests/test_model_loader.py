@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Tests cho manifest checksum của model artifacts"""
+import hashlib
+import json
+import os
+
+import pytest
+
+import model_loader
+from model_loader import MANIFEST_FILE, ModelLoader
+
+
+@pytest.fixture
+def artifacts(tmp_path):
+    (tmp_path / "model.safetensors").write_bytes(b"weights" * 100)
+    (tmp_path / "config.json").write_text("{}")
+    return tmp_path
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    """Tên các file đã bị hash"""
+    calls = []
+    sha256_file = model_loader.sha256_file
+
+    def counting(path, *args, **kwargs):
+        calls.append(os.path.basename(path))
+        return sha256_file(path, *args, **kwargs)
+
+    monkeypatch.setattr(model_loader, "sha256_file", counting)
+    return calls
+
+
+def loader(path, **kwargs):
+    return ModelLoader(str(path), verify=True, mmap_weights=False, verify_full=kwargs.pop("verify_full", False), **kwargs)
+
+
+def test_unchanged_artifacts_are_not_rehashed(artifacts, hashed):
+    loader(artifacts).write_manifest(str(artifacts))
+    hashed.clear()
+
+    loader(artifacts).verify_manifest(str(artifacts))
+    assert hashed == []
+
+    loader(artifacts, verify_full=True).verify_manifest(str(artifacts))
+    assert sorted(hashed) == ["config.json", "model.safetensors"]
+
+
+def test_changed_file_fails_verification(artifacts):
+    loader(artifacts).write_manifest(str(artifacts))
+    (artifacts / "model.safetensors").write_bytes(b"tampered")
+
+    with pytest.raises(ValueError):
+        loader(artifacts).verify_manifest(str(artifacts))
+
+
+def test_touched_file_is_rehashed_once(artifacts, hashed):
+    loader(artifacts).write_manifest(str(artifacts))
+    os.utime(artifacts / "config.json", ns=(0, 0))
+    hashed.clear()
+
+    loader(artifacts).verify_manifest(str(artifacts))
+    loader(artifacts).verify_manifest(str(artifacts))
+    assert hashed == ["config.json"]
+
+
+def test_legacy_manifest_is_upgraded(artifacts, hashed):
+    files = {name: hashlib.sha256((artifacts / name).read_bytes()).hexdigest() for name in ("model.safetensors", "config.json")}
+    (artifacts / MANIFEST_FILE).write_text(json.dumps({"files": files}))
+
+    loader(artifacts).verify_manifest(str(artifacts))
+    hashed.clear()
+    loader(artifacts).verify_manifest(str(artifacts))
+
+    assert hashed == []
+    manifest = json.loads((artifacts / MANIFEST_FILE).read_text())
+    assert manifest["files"]["config.json"]["sha256"] == files["config.json"]
+
+
+def test_expected_sha256(artifacts):
+    digest = hashlib.sha256((artifacts / "model.safetensors").read_bytes()).hexdigest()
+    loader(artifacts, expected_sha256=digest).verify_manifest(str(artifacts))
+
+    with pytest.raises(ValueError):
+        loader(artifacts, expected_sha256="0" * 64).verify_manifest(str(artifacts))
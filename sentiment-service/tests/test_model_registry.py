@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Tests cho ModelRegistry.add: giữ version cùng spec, thay version khác spec mà không giữ lại model và batcher cũ"""
+import pytest
+
+from micro_batcher import BatchScheduler
+from model_registry import ModelRegistry, ModelVersion
+
+
+@pytest.fixture
+def scheduler():
+    return BatchScheduler()
+
+
+@pytest.fixture
+def registry(scheduler):
+    return ModelRegistry(scheduler=scheduler, max_length=64, warmup_batch_sizes=[0])
+
+
+def test_same_spec_keeps_existing_version(registry, scheduler, tiny_model_dir):
+    registry.add("v1", tiny_model_dir, default=True)
+    canary = registry.add("v2", tiny_model_dir)
+
+    assert registry.add("v2", tiny_model_dir) is canary
+    assert scheduler.stats()["batchers"] == 4
+
+
+def test_readding_name_with_new_spec_unloads_old_version(registry, scheduler, tiny_model_dir, tmp_path):
+    registry.add("v1", tiny_model_dir, default=True)
+    old = registry.add("v2", tiny_model_dir)
+    old.load()
+    assert old.batcher.predict("vui qua")
+
+    new = registry.add("v2", str(tmp_path))
+
+    assert registry.get("v2") is new and new is not old
+    assert old.state == ModelVersion.UNLOADED and old.backend is None
+    # Chỉ còn batcher của v1 và v2 mới trong scheduler
+    assert scheduler.stats()["batchers"] == 4
+    with pytest.raises(RuntimeError):
+        old.batcher.submit("vui qua")
+
+
+def test_default_version_cannot_be_replaced(registry, scheduler, tiny_model_dir, tmp_path):
+    default = registry.add("v1", tiny_model_dir, default=True)
+
+    with pytest.raises(ValueError):
+        registry.add("v1", str(tmp_path))
+    assert registry.default is default
+    assert scheduler.stats()["batchers"] == 2
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Tests cho ResultCache: LRU trong process, shared tier và entry hỏng trong shared tier"""
+import logging
+
+from result_cache import InMemorySharedBackend, ResultCache
+
+
+def test_shared_hit_fills_local_tier():
+    shared = InMemorySharedBackend()
+    ResultCache("m", shared=shared).set("Vui  quá", [0.9, 0.1])
+    cache = ResultCache("m", shared=shared)
+
+    assert cache.get("vui quá") is None
+    assert cache.get(" Vui quá ") == [0.9, 0.1]
+    assert cache.get("Vui quá") == [0.9, 0.1]
+    assert (cache.hits, cache.shared_hits, cache.misses) == (1, 1, 1)
+
+
+def test_model_is_part_of_the_key():
+    cache = ResultCache("m1")
+    cache.set("vui", [1.0])
+
+    assert cache.get("vui", model="m2") is None
+    assert cache.get("vui") == [1.0]
+
+
+def test_corrupt_shared_entry_is_a_miss(caplog):
+    shared = InMemorySharedBackend()
+    cache = ResultCache("m", shared=shared)
+    shared.set(cache.make_key("vui"), '[0.9, 0.1', 60)
+
+    with caplog.at_level(logging.WARNING, logger="result_cache"):
+        assert cache.get("vui") is None
+
+    assert "Shared cache get failed" in caplog.text
+    assert (cache.shared_hits, cache.misses) == (0, 1)
+    # Ghi lại entry hợp lệ thì đọc được như thường
+    cache.set("vui", [0.9, 0.1])
+    cache.clear()
+    assert cache.get("vui") == [0.9, 0.1]
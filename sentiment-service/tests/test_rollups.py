@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Tests cho rollups: cập nhật dần khi thêm / chấm lại / xoá nội dung, truy vấn theo khoảng thời gian, parse_timestamp"""
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from rollups import CONVERSATION, GRANULARITIES, USER, RollupRecorder, RollupStore, entity_key, parse_timestamp, summarize_rows
+
+
+PRISMA_CREATED_AT = "2025-11-21T09:40:36.000Z"
+EXPECTED = datetime(2025, 11, 21, 9, 40, 36, tzinfo=timezone.utc).timestamp()
+
+
+def test_parse_timestamp_accepts_z_suffix():
+    assert parse_timestamp(PRISMA_CREATED_AT) == EXPECTED
+
+
+def test_parse_timestamp_treats_naive_strings_as_utc():
+    assert parse_timestamp("2025-11-21T09:40:36") == EXPECTED
+    assert parse_timestamp("2025-11-21T16:40:36+07:00") == EXPECTED
+
+
+def test_parse_timestamp_numbers_and_empty():
+    assert parse_timestamp(1700000000) == 1700000000.0
+    assert parse_timestamp(None) is None
+    assert parse_timestamp("") is None
+
+
+@pytest.mark.parametrize("value", ["yesterday", True, "2025-13-40T00:00:00Z"])
+def test_parse_timestamp_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+# Thứ Hai 00:00 UTC
+MONDAY = datetime(2025, 11, 17, tzinfo=timezone.utc).timestamp()
+HOUR = 3600
+DAY = 86400
+JOY = [0.7, 0.1, 0.0, 0.0, 0.0, 0.0, 0.2]
+SAD = [0.1, 0.6, 0.1, 0.0, 0.0, 0.0, 0.2]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RollupStore(str(tmp_path / "rollups.sqlite3"), bucket_seconds=HOUR)
+
+
+@pytest.fixture
+def recorder(store):
+    # Không để flusher tự ghi, test gọi flush()
+    recorder = RollupRecorder(store, flush_interval=3600)
+    yield recorder
+    recorder._pid = None
+
+
+def event(scores, user_id=None, conversation_id=None, timestamp=None):
+    return {"scores": scores, "user_id": user_id, "conversation_id": conversation_id, "timestamp": timestamp, "received_at": MONDAY}
+
+
+def total(store, scope, key, start=MONDAY - 30 * DAY, end=MONDAY + 30 * DAY):
+    return summarize_rows(store.query(scope, key, start, end), 0)
+
+
+def test_added_entities_are_summed_per_scope(store):
+    store.apply({
+        "post:1": event(JOY, "u1", "c1", MONDAY),
+        "post:2": event(SAD, "u1", "c2", MONDAY + 10),
+        "post:3": event(JOY, "u2", "c1", MONDAY + 20),
+    })
+
+    user = total(store, USER, "u1")
+    assert user["count"] == 2
+    assert user["mean_scores"] == pytest.approx([(a + b) / 2 for a, b in zip(JOY, SAD)])
+    assert (user["counts"]["enjoyment"], user["counts"]["sadness"]) == (1, 1)
+    assert total(store, CONVERSATION, "c1")["count"] == 2
+    assert total(store, CONVERSATION, "c2")["emotion"] == "sadness"
+
+
+def test_reanalyzed_entity_replaces_previous_contribution(store):
+    store.apply({"post:1": event(JOY, "u1", "c1", MONDAY + 5 * HOUR)})
+    # Lần chấm sau không gửi user / conversation / timestamp
+    store.apply({"post:1": event(SAD)})
+
+    user = total(store, USER, "u1")
+    assert user["count"] == 1
+    assert user["mean_scores"] == pytest.approx(SAD)
+    assert (user["counts"]["enjoyment"], user["counts"]["sadness"]) == (0, 1)
+    assert total(store, CONVERSATION, "c1")["count"] == 1
+    # Vẫn nằm ở bucket của lần ghi đầu
+    assert [row[0] for row in store.query(USER, "u1", MONDAY, MONDAY + DAY, GRANULARITIES["hour"])] == [MONDAY + 5 * HOUR]
+
+
+def test_reanalyzed_entity_moves_to_new_owner_and_bucket(store):
+    store.apply({"post:1": event(JOY, "u1", "c1", MONDAY)})
+    store.apply({"post:1": event(JOY, "u2", "c2", MONDAY + 2 * DAY)})
+
+    assert total(store, USER, "u1")["count"] == 0
+    assert total(store, CONVERSATION, "c1")["count"] == 0
+    assert [row[0] for row in store.query(USER, "u2", MONDAY, MONDAY + 7 * DAY, DAY)] == [MONDAY + 2 * DAY]
+
+
+def test_removed_entity_leaves_no_bucket(store):
+    store.apply({"post:1": event(JOY, "u1", "c1", MONDAY), "post:2": event(SAD, "u1", None, MONDAY)})
+    store.apply({"post:1": {"scores": None, "received_at": MONDAY}, "post:9": {"scores": None, "received_at": MONDAY}})
+
+    assert total(store, USER, "u1")["count"] == 1
+    assert store.query(CONVERSATION, "c1", MONDAY - DAY, MONDAY + DAY) == []
+
+    store.apply({"post:2": {"scores": None, "received_at": MONDAY}})
+    assert total(store, USER, "u1") == summarize_rows([], 0)
+
+
+def test_query_groups_buckets_by_step_and_utc_offset(store):
+    store.apply({
+        "post:1": event(JOY, "u1", timestamp=MONDAY + 1 * HOUR),
+        "post:2": event(JOY, "u1", timestamp=MONDAY + 2 * HOUR),
+        "post:3": event(SAD, "u1", timestamp=MONDAY + 25 * HOUR),
+        "post:4": event(SAD, "u1", timestamp=MONDAY + 7 * DAY + HOUR),
+    })
+    start, end = MONDAY - DAY, MONDAY + 14 * DAY
+
+    def series(step, offset=0):
+        return [(row[0], row[1]) for row in store.query(USER, "u1", start, end, step, offset)]
+
+    assert series(GRANULARITIES["hour"]) == [(MONDAY + HOUR, 1), (MONDAY + 2 * HOUR, 1), (MONDAY + 25 * HOUR, 1), (MONDAY + 7 * DAY + HOUR, 1)]
+    assert series(DAY) == [(MONDAY, 2), (MONDAY + DAY, 1), (MONDAY + 7 * DAY, 1)]
+    # UTC-2: 01:00 UTC thứ Hai là 23:00 Chủ nhật giờ địa phương, 01:00 UTC thứ Ba vẫn là thứ Hai
+    assert series(DAY, -2 * HOUR) == [(MONDAY - DAY + 2 * HOUR, 1), (MONDAY + 2 * HOUR, 2), (MONDAY + 6 * DAY + 2 * HOUR, 1)]
+    # Tuần bắt đầu từ thứ Hai
+    assert series(GRANULARITIES["week"]) == [(MONDAY, 3), (MONDAY + 7 * DAY, 1)]
+    assert store.query(USER, "u1", MONDAY, MONDAY + DAY)[0][1] == 2
+
+    summary = summarize_rows(store.query(USER, "u1", start, end, DAY), DAY)
+    assert [point["count"] for point in summary["series"]] == [2, 1, 1]
+    assert summary["count"] == 4 and summary["percentages"]["enjoyment"] == 50.0
+
+
+def test_purge_drops_old_buckets_and_entities(store):
+    store.apply({"post:1": event(JOY, "u1", timestamp=MONDAY), "post:2": event(SAD, "u1", timestamp=MONDAY + 3 * DAY)})
+
+    assert store.purge(MONDAY + DAY) == 1
+    assert total(store, USER, "u1")["count"] == 1
+    # Entity đã bị purge chấm lại được tính như nội dung mới
+    store.apply({"post:1": event(SAD, "u1", timestamp=MONDAY + 3 * DAY)})
+    assert total(store, USER, "u1")["count"] == 2
+
+
+def test_recorder_coalesces_pending_events(store, recorder):
+    recorder.record(entity_key("post", 1), JOY, user_id=7, conversation_id="c1", timestamp=MONDAY)
+    recorder.record(entity_key("post", 1), SAD)
+    recorder.record(entity_key("post", 2), JOY, user_id=7, timestamp=MONDAY)
+    recorder.remove(entity_key("post", 2))
+
+    assert total(store, USER, "7")["count"] == 0
+    assert recorder.flush() == 2
+    assert recorder.flush() == 0
+
+    user = total(store, USER, "7")
+    assert user["count"] == 1 and user["mean_scores"] == pytest.approx(SAD)
+    assert total(store, CONVERSATION, "c1")["count"] == 1
+    assert recorder.stats()["recorded"] == 4 and recorder.stats()["flushed"] == 2
+
+
+def test_recorder_keeps_events_when_write_fails(store, recorder, monkeypatch):
+    recorder.record("post:1", JOY, user_id="u1", timestamp=MONDAY)
+
+    def locked(events):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "apply", locked)
+    assert recorder.flush() == 0
+    assert recorder.stats()["errors"] == 1 and recorder.stats()["pending"] == 1
+
+    monkeypatch.undo()
+    recorder.record("post:1", SAD)
+    assert recorder.flush() == 1
+    assert total(store, USER, "u1")["mean_scores"] == pytest.approx(SAD)
+
+
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+def test_rollup_routes_follow_analyze_and_remove(service):
+    client = service.app.test_client()
+    body = {"entity_id": "r1", "entity_type": "post", "user_id": "rollup-user", "conversation_id": "rollup-conv",
+            "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")}
+
+    def rollup(scope):
+        return client.get(f'/rollups/{scope}?granularity=total').get_json()["count"]
+
+    assert client.post('/analyze', json={"text": "vui qua", **body}, headers=ADMIN).status_code == 200
+    assert client.post('/analyze', json={"text": "toi rat buon", **body}, headers=ADMIN).status_code == 200
+    assert rollup("users/rollup-user") == 1
+    assert rollup("conversations/rollup-conv") == 1
+
+    removed = client.post('/rollups/remove', json={"entities": [{"entity_id": "r1", "entity_type": "post"}]})
+    assert removed.status_code == 200
+    assert rollup("users/rollup-user") == 0
+    assert client.post('/analyze', json={"text": "vui", **body, "timestamp": "yesterday"}, headers=ADMIN).status_code == 400
+
+
+def test_rollup_fields_without_admin_token_are_ignored(service):
+    client = service.app.test_client()
+    body = {"entity_id": "public-1", "entity_type": "post", "user_id": "victim", "conversation_id": "victim-conv"}
+
+    single = client.post('/analyze', json={"text": "vui qua", **body})
+    batch = client.post('/analyze/batch', json={"texts": ["vui qua"], "entities": [body]}, headers={"X-Admin-Token": "guess"})
+
+    assert single.status_code == 200 and batch.status_code == 200
+    assert client.get('/rollups/users/victim?granularity=total').get_json()["count"] == 0
+    assert client.get('/rollups/conversations/victim-conv?granularity=total').get_json()["count"] == 0
+
+    # Entity thật của backend không bị caller bên ngoài ghi đè
+    client.post('/analyze', json={"text": "vui qua", **body}, headers=ADMIN)
+    client.post('/analyze', json={"text": "toi rat buon", **body, "user_id": "attacker"})
+    assert client.get('/rollups/users/victim?granularity=total').get_json()["count"] == 1
+    assert client.get('/rollups/users/attacker?granularity=total').get_json()["count"] == 0
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Tests cho routing giữa LLM provider và local model"""
+import time
+
+import pytest
+
+from routing import ProviderRouter
+
+
+def slow_timeout():
+    time.sleep(0.05)
+    raise TimeoutError("LLM call timed out")
+
+
+def test_failed_calls_count_toward_latency():
+    router = ProviderRouter("test")
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            router.call(slow_timeout)
+
+    assert router.latency.percentile(95) >= 0.05
+    assert router.choose(budget_ms=10) == (ProviderRouter.LOCAL, "latency_budget")
+
+
+def test_successful_call_closes_breaker():
+    router = ProviderRouter("test")
+    assert router.call(lambda: "ok") == "ok"
+    assert router.latency.snapshot()["samples"] == 1
+    assert router.breaker.state == router.breaker.CLOSED
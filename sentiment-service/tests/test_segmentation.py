@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Tests cho chia đoạn text dài (tách câu, cửa sổ từ, gộp câu) và gộp scores theo đoạn / theo batch"""
+import numpy as np
+import pytest
+
+from aggregation import aggregate, combine_chunks, summarize
+from segmentation import TextSegmenter, pack_sentences, split_sentences, word_windows
+
+
+class WordTokens:
+    """Tokenization giả: mỗi từ là một token"""
+
+    def __init__(self, content_budget):
+        self.content_budget = content_budget
+
+    def count_tokens(self, texts):
+        return [len(text.split()) for text in texts]
+
+
+def row(**scores):
+    labels = ["enjoyment", "sadness", "anger", "fear", "disgust", "surprise", "other"]
+    return [scores.get(label, 0.0) for label in labels]
+
+
+@pytest.mark.parametrize("text, sentences", [
+    ("Tôi ở TP. Hồ Chí Minh. Hôm nay vui quá!!! Còn bạn?",
+     ["Tôi ở TP. Hồ Chí Minh.", "Hôm nay vui quá!!!", "Còn bạn?"]),
+    ("Mua táo, cam v.v. rồi về nhà. Xong", ["Mua táo, cam v.v. rồi về nhà.", "Xong"]),
+    ("Ông Nguyễn V. An đến Q. 1 chơi... Vui ghê", ["Ông Nguyễn V. An đến Q. 1 chơi...", "Vui ghê"]),
+    ("dòng một\n\n  dòng hai?! dòng ba", ["dòng một", "dòng hai?!", "dòng ba"]),
+    ("  không có dấu câu  ", ["không có dấu câu"]),
+])
+def test_split_sentences_skips_vietnamese_abbreviations(text, sentences):
+    assert split_sentences(text) == sentences
+
+
+def test_word_windows_overlap():
+    sentence = " ".join(f"w{i}" for i in range(20))
+
+    windows = word_windows(sentence, tokens=40, budget=20, overlap_words=2)
+
+    # 9 từ mỗi cửa sổ (chừa 10% budget), bước 7 nên hai cửa sổ liền nhau chung 2 từ
+    assert windows == [
+        (" ".join(f"w{i}" for i in range(0, 9)), 18),
+        (" ".join(f"w{i}" for i in range(7, 16)), 18),
+        (" ".join(f"w{i}" for i in range(14, 20)), 12),
+    ]
+
+
+def test_word_windows_overlap_is_at_most_half_window():
+    windows = word_windows("a b c d e f", tokens=12, budget=5, overlap_words=8)
+
+    # size 2, overlap bị giới hạn còn 1 từ
+    assert [window for window, _ in windows] == ["a b", "b c", "c d", "d e", "e f"]
+
+
+def test_pack_sentences_fills_budget_and_windows_long_sentences():
+    long_sentence = " ".join(f"w{i}" for i in range(20))
+
+    chunks = pack_sentences(["a b", "c d e", long_sentence, "f"], [3, 4, 40, 2], budget=20, overlap_words=2)
+
+    assert chunks == [("a b c d e", 7)] + word_windows(long_sentence, 40, 20, 2) + [("f", 2)]
+
+
+def test_segmenter_keeps_short_texts_and_splits_long_ones():
+    long_text = "Hôm nay trời đẹp quá. Tôi đi chơi ở TP. Hồ Chí Minh. Buồn vì phải về sớm."
+
+    segmented = TextSegmenter(WordTokens(10)).segment(["vui qua", long_text])
+
+    assert segmented.segmented
+    assert segmented.counts().tolist() == [1, 3]
+    assert segmented.chunks_of(0) == [("vui qua", 1)]
+    assert segmented.chunks_of(1) == [
+        ("Hôm nay trời đẹp quá.", 5),
+        ("Tôi đi chơi ở TP. Hồ Chí Minh.", 8),
+        ("Buồn vì phải về sớm.", 5),
+    ]
+
+
+def test_segmenter_samples_chunks_evenly_over_max_chunks():
+    text = " ".join(f"Câu số {i} đây." for i in range(10))
+
+    segmented = TextSegmenter(WordTokens(4), max_chunks=4).segment([text])
+
+    assert [chunk for chunk, _ in segmented.chunks_of(0)] == ["Câu số 0 đây.", "Câu số 3 đây.", "Câu số 6 đây.", "Câu số 9 đây."]
+
+
+def test_combine_chunks_weights_by_tokens():
+    matrix = np.asarray([
+        row(enjoyment=1.0),
+        row(enjoyment=0.5, other=0.5),
+        row(sadness=1.0),
+        row(sadness=0.5, anger=0.5),
+    ], dtype=np.float32)
+    starts = np.asarray([0, 1, 4])
+    weights = np.asarray([1, 5, 8, 5], dtype=np.float32)
+
+    combined = combine_chunks(matrix, starts, weights)
+
+    assert combined.shape == (2, 7)
+    np.testing.assert_allclose(combined[0], row(enjoyment=1.0))
+    # (5 * [.5 enjoyment, .5 other] + 8 * sadness + 5 * [.5 sadness, .5 anger]) / 18
+    np.testing.assert_allclose(combined[1], row(enjoyment=2.5 / 18, sadness=10.5 / 18, anger=2.5 / 18, other=2.5 / 18), rtol=1e-6)
+
+
+def test_combine_chunks_without_segmentation_returns_matrix():
+    matrix = np.asarray([row(enjoyment=1.0), row(fear=1.0)], dtype=np.float32)
+    assert combine_chunks(matrix, np.asarray([0, 1, 2]), np.ones(2, dtype=np.float32)) is matrix
+
+
+# Một text rất chắc chắn là enjoyment, hai text hơi nghiêng về sadness
+BATCH = np.asarray([
+    row(enjoyment=0.9, other=0.1),
+    row(sadness=0.6, other=0.4),
+    row(sadness=0.5, anger=0.2, other=0.3),
+], dtype=np.float32)
+
+
+@pytest.mark.parametrize("strategy, kwargs, expected", [
+    ("mean", {}, row(enjoyment=0.9 / 3, sadness=1.1 / 3, anger=0.2 / 3, other=0.8 / 3)),
+    # Trọng số 0.9, 0.6, 0.5 (max score từng hàng)
+    ("confidence", {}, row(enjoyment=0.81 / 2, sadness=0.61 / 2, anger=0.1 / 2, other=0.48 / 2)),
+    # half_life mặc định 1: trọng số 0.25, 0.5, 1
+    ("recency", {}, row(enjoyment=0.225 / 1.75, sadness=0.8 / 1.75, anger=0.2 / 1.75, other=0.525 / 1.75)),
+    # half_life 2: trọng số 0.5, 1/sqrt(2), 1
+    ("recency", {"half_life": 2}, (0.5 * BATCH[0] + 2 ** -0.5 * BATCH[1] + BATCH[2]) / (1.5 + 2 ** -0.5)),
+    ("majority", {}, (np.asarray(row(enjoyment=1, sadness=2)) + BATCH.mean(axis=0) * 1e-3) / 3.001),
+])
+def test_aggregate_strategies(strategy, kwargs, expected):
+    aggregated = aggregate(BATCH, strategy, **kwargs)
+
+    np.testing.assert_allclose(aggregated, expected, rtol=1e-5)
+    assert aggregated.sum() == pytest.approx(1.0, abs=1e-5)
+
+
+def test_aggregate_strategies_pick_different_emotions():
+    picked = {strategy: summarize(aggregate(BATCH, strategy))["emotion"] for strategy in ("mean", "confidence", "recency", "majority")}
+    assert picked == {"mean": "sadness", "confidence": "enjoyment", "recency": "sadness", "majority": "sadness"}
+
+
+def test_aggregate_majority_tie_goes_to_higher_mean():
+    matrix = np.asarray([row(fear=0.9, other=0.1), row(anger=0.6, other=0.4)], dtype=np.float32)
+    assert summarize(aggregate(matrix, "majority"))["emotion"] == "fear"
+
+
+def test_aggregate_rejects_bad_input():
+    with pytest.raises(ValueError):
+        aggregate(BATCH, "median")
+    with pytest.raises(ValueError):
+        aggregate(np.zeros((0, 7), dtype=np.float32))
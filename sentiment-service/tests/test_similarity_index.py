@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""Tests cho similarity index: top-k, xoá khỏi index exact / ivf, lọc kết quả, đồng bộ qua SQLite và quyền ghi qua /analyze"""
+import numpy as np
+import pytest
+
+from similarity_index import BruteForceIndex, IVFIndex, SimilarityIndex, VectorStore, top_k
+
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+# Bốn vector 3 chiều: a gần b, c gần d
+VECTORS = {
+    "a": unit(1, 0, 0),
+    "b": unit(0.9, 0.1, 0),
+    "c": unit(0, 1, 0),
+    "d": unit(0.1, 0.9, 0),
+}
+
+
+def clustered(count, dim=8, seed=0):
+    """Vector chuẩn hoá quanh dim trục toạ độ, đủ để train ivf"""
+    rng = np.random.default_rng(seed)
+    vectors = np.eye(dim, dtype=np.float32)[np.arange(count) % dim] + rng.normal(0, 0.05, (count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def filled(index):
+    for item_id, vector in VECTORS.items():
+        index.upsert(item_id, vector)
+    return index
+
+
+@pytest.fixture
+def store(tmp_path):
+    return VectorStore(str(tmp_path / "index.sqlite3"))
+
+
+def test_top_k_orders_each_row():
+    similarities = np.array([[0.1, 0.9, 0.5, 0.7], [0.8, 0.2, 0.3, 0.1]])
+
+    assert top_k(similarities, 2).tolist() == [[1, 3], [0, 2]]
+    assert top_k(similarities, 10).tolist() == [[1, 3, 2, 0], [0, 2, 1, 3]]
+    assert top_k(similarities, 0).shape == (2, 0)
+
+
+def test_brute_force_search_is_exact():
+    index = filled(BruteForceIndex(3))
+    [matches] = index.search(VECTORS["a"][None, :], 2)
+
+    assert [item_id for item_id, _ in matches] == ["a", "b"]
+    assert matches[0][1] == pytest.approx(1.0)
+    assert matches[1][1] == pytest.approx(float(VECTORS["a"] @ VECTORS["b"]))
+
+
+def test_brute_force_remove_moves_last_row_into_gap():
+    index = filled(BruteForceIndex(3))
+
+    assert index.remove("b") == (1, 3)
+    assert index.ids == ["a", "d", "c"]
+    np.testing.assert_array_equal(index.vector_of("d"), VECTORS["d"])
+    assert index.remove("b") is None
+    assert index.remove("c") == (2, 2)
+    assert index.ids == ["a", "d"]
+
+    [matches] = index.search(VECTORS["d"][None, :], 5)
+    assert [item_id for item_id, _ in matches] == ["d", "a"]
+
+
+def test_upsert_replaces_vector_of_existing_id():
+    index = filled(BruteForceIndex(3))
+    index.upsert("a", VECTORS["c"])
+
+    assert len(index) == 4
+    [matches] = index.search(VECTORS["c"][None, :], 2)
+    assert sorted(item_id for item_id, _ in matches) == ["a", "c"]
+
+
+def test_ivf_trains_only_with_enough_vectors():
+    index = IVFIndex(8, n_lists=4, nprobe=1)
+    for i, vector in enumerate(clustered(15)):
+        index.upsert(str(i), vector)
+    index.build()
+    assert index.centroids is None and not index.needs_build()
+
+    index.upsert("15", clustered(16)[15])
+    assert index.needs_build()
+    index.build()
+    assert index.trained_size == 16 and not index.needs_build()
+
+    # Train lại khi số vector gấp đôi lần train trước
+    for i, vector in enumerate(clustered(32)[16:], start=16):
+        index.upsert(str(i), vector)
+        assert index.needs_build() == (len(index) >= 32)
+
+
+def test_ivf_with_all_lists_probed_matches_exact():
+    vectors = clustered(64)
+    exact, ivf = BruteForceIndex(8), IVFIndex(8, n_lists=4, nprobe=4)
+    for i, vector in enumerate(vectors):
+        exact.upsert(str(i), vector)
+        ivf.upsert(str(i), vector)
+    ivf.build()
+
+    queries = clustered(5, seed=1)
+    for ivf_matches, exact_matches in zip(ivf.search(queries, 5), exact.search(queries, 5)):
+        assert [item_id for item_id, _ in ivf_matches] == [item_id for item_id, _ in exact_matches]
+        assert [score for _, score in ivf_matches] == pytest.approx([score for _, score in exact_matches])
+
+
+def test_ivf_remove_keeps_list_assignments_in_sync():
+    vectors = clustered(64)
+    index = IVFIndex(8, n_lists=8, nprobe=1)
+    for i, vector in enumerate(vectors):
+        index.upsert(str(i), vector)
+    index.build()
+
+    removed = {str(i) for i in range(0, 64, 3)}
+    for item_id in removed:
+        index.remove(item_id)
+    # Vector thêm sau khi train được gán cụm ngay
+    index.upsert("new", vectors[5])
+
+    for item_id in index.ids:
+        [matches] = index.search(index.vector_of(item_id)[None, :], 1)
+        assert matches[0][1] == pytest.approx(1.0)
+    found = {item_id for matches in index.search(vectors, 64) for item_id, _ in matches}
+    assert found.isdisjoint(removed)
+
+
+@pytest.mark.parametrize("kind", ["exact", "ivf"])
+def test_search_filters_exclude_and_min_score(store, kind):
+    index = SimilarityIndex(store, "model", kind=kind, n_lists=2, nprobe=2)
+    index.add(list(VECTORS), np.stack(list(VECTORS.values())))
+    query = VECTORS["a"][None, :]
+
+    assert [match["id"] for match in index.search(query, k=2)[0]] == ["a", "b"]
+    assert [match["id"] for match in index.search(query, k=2, exclude=["a"])[0]] == ["b", "d"]
+    assert [match["id"] for match in index.search(query, k=10, min_score=0.9)[0]] == ["a", "b"]
+    assert index.search(query, k=10, min_score=0.9, exclude=["a"])[0] == [{"id": "b", "score": round(float(VECTORS["a"] @ VECTORS["b"]), 4)}]
+
+
+def test_indexes_sync_through_store_by_seq(store, tmp_path):
+    writer = SimilarityIndex(store, "model")
+    # Process khác: connection và index trong bộ nhớ riêng trên cùng file SQLite
+    reader = SimilarityIndex(VectorStore(str(tmp_path / "index.sqlite3")), "model")
+    other_model = SimilarityIndex(store, "other")
+
+    writer.add(["a", "b"], np.stack([VECTORS["a"], VECTORS["b"]]))
+    assert [match["id"] for match in reader.search(VECTORS["a"][None, :], k=5)[0]] == ["a", "b"]
+    assert other_model.search(VECTORS["a"][None, :], k=5) == [[]]
+
+    writer.add(["a"], VECTORS["c"][None, :])
+    writer.remove(["b"])
+    writer.add(["d"], VECTORS["d"][None, :])
+
+    assert [match["id"] for match in reader.search(VECTORS["c"][None, :], k=5)[0]] == ["a", "d"]
+    assert reader.stats()["size"] == 2
+    assert reader.rebuild()["size"] == 2
+
+
+def test_dimension_mismatch_is_rejected(store):
+    index = SimilarityIndex(store, "model")
+    index.add(["a"], VECTORS["a"][None, :])
+
+    with pytest.raises(ValueError):
+        index.add(["b"], np.ones((1, 4), dtype=np.float32))
+    with pytest.raises(ValueError):
+        index.search(np.ones((1, 4), dtype=np.float32))
+
+
+def test_index_writes_need_admin_token(service):
+    client = service.app.test_client()
+    index = service.similarity_index(service.registry.default)
+
+    single = client.post('/analyze', json={"text": "vui qua", "index_id": "post:auth"})
+    batch = client.post('/analyze/batch', json={"texts": ["vui qua"], "output": "items", "ids": ["comment:auth"]})
+    wrong = client.post('/analyze', json={"text": "vui qua", "index_id": "post:auth"}, headers={"X-Admin-Token": "guess"})
+
+    assert [response.status_code for response in (single, batch, wrong)] == [403, 403, 403]
+    assert index.vector_of("post:auth") is None and index.vector_of("comment:auth") is None
+
+    # Embedding không ghi vào index vẫn mở cho mọi caller
+    assert client.post('/analyze', json={"text": "vui qua", "embedding": True}).status_code == 200
+
+    single = client.post('/analyze', json={"text": "vui qua", "index_id": "post:auth"}, headers=ADMIN)
+    batch = client.post('/analyze/batch', json={"texts": ["vui qua"], "output": "items", "ids": ["comment:auth"]}, headers=ADMIN)
+
+    assert single.status_code == 200 and single.get_json()["indexed"] is True
+    assert batch.status_code == 200 and batch.get_json()["indexed"] == 1
+    assert index.vector_of("post:auth") is not None
+
+
+def test_embedding_request_returns_same_scores_as_plain_analyze(service):
+    client = service.app.test_client()
+    # Dài hơn max_length nên được chia đoạn
+    text = "toi rat vui hom nay, " * 120
+
+    plain = client.post('/analyze', json={"text": text}).get_json()
+    embedded = client.post('/analyze', json={"text": text, "embedding": True}).get_json()
+    fresh = client.post('/analyze', json={"text": text + "so", "embedding": True}).get_json()
+
+    assert embedded["chunks_analyzed"] == plain["chunks_analyzed"] > 1
+    for key in ("scores", "emotion", "confidence", "method"):
+        assert embedded[key] == plain[key]
+    assert embedded["method"] == "pytorch"
+    assert len(embedded["embedding"]) == 32
+    # Text chưa có trong cache: scores vẫn theo đường chia đoạn và gộp của predict
+    assert fresh["scores"] == client.post('/analyze', json={"text": text + "so"}).get_json()["scores"]
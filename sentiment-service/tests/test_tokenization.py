@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Tests cho tokenization: parity check fast / slow tokenizer và chia batch theo độ dài"""
+import pytest
+from transformers import AutoTokenizer
+
+from tokenization import TokenizationStage
+
+
+@pytest.fixture(scope="module")
+def tokenizers(tiny_model_dir):
+    return (
+        AutoTokenizer.from_pretrained(tiny_model_dir, use_fast=True),
+        AutoTokenizer.from_pretrained(tiny_model_dir, use_fast=False),
+    )
+
+
+class ShiftedTokenizer:
+    """Tokenizer bọc tokenizer khác và làm lệch input_ids của text có dấu phẩy (giả lập tokenizer.json lỗi)"""
+
+    is_fast = True
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def __call__(self, texts, **kwargs):
+        encoded = self.tokenizer(texts, **kwargs)
+        encoded["input_ids"] = [ids + [0] if "," in text else ids for text, ids in zip(texts, encoded["input_ids"])]
+        return encoded
+
+
+def test_parity_passes_for_equivalent_tokenizers(tokenizers):
+    fast, slow = tokenizers
+    assert TokenizationStage.parity_mismatches(fast, slow) == []
+
+
+def test_parity_reports_mismatching_texts(tokenizers):
+    fast, slow = tokenizers
+    mismatches = TokenizationStage.parity_mismatches(ShiftedTokenizer(fast), slow)
+    assert mismatches and all("," in text for text in mismatches)
+
+
+def test_load_auto_uses_fast_tokenizer_after_parity(tiny_model_dir):
+    assert TokenizationStage.load(tiny_model_dir, mode="auto").is_fast
+    assert not TokenizationStage.load(tiny_model_dir, mode="slow").is_fast
+
+
+def test_load_auto_falls_back_to_slow_on_mismatch(tiny_model_dir, monkeypatch):
+    monkeypatch.setattr(TokenizationStage, "parity_mismatches", staticmethod(lambda *args: ["text"]))
+    assert not TokenizationStage.load(tiny_model_dir, mode="auto").is_fast
+
+
+def test_plan_batches_groups_by_length_bucket(tokenizers):
+    stage = TokenizationStage(tokenizers[0], max_length=64, bucket_boundaries=(8, 16))
+    texts = ["vui", "toi rat thich " * 4, "so", "hom nay " * 2, "buon " * 10]
+    encodings = stage.encode(texts)
+    batches = stage.plan_batches(encodings, max_batch_size=2)
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(texts)))
+    for batch in batches:
+        assert len(batch) <= 2
+        assert len({stage.bucket_of(len(encodings[i]["input_ids"])) for i in batch}) == 1
+
+
+def test_plan_batches_respects_token_budget(tokenizers):
+    stage = TokenizationStage(tokenizers[0], max_length=64)
+    encodings = stage.encode(["toi rat thich " * 5] * 6)
+    length = len(encodings[0]["input_ids"])
+    batches = stage.plan_batches(encodings, max_batch_size=32, max_tokens=length * 2)
+    assert [len(batch) for batch in batches] == [2, 2, 2]
+
+
+def test_padding_efficiency_counts_real_tokens(tokenizers):
+    stage = TokenizationStage(tokenizers[0], max_length=64)
+    encodings = stage.encode(["vui", "toi rat thich hom nay"])
+    inputs = stage.pad(encodings)
+
+    stats = stage.stats()
+    assert stats["padded_tokens"] == inputs["input_ids"].numel()
+    assert stats["real_tokens"] == sum(len(encoding["input_ids"]) for encoding in encodings)
+    assert 0 < stats["padding_efficiency"] < 1
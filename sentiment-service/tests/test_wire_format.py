@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Tests cho content negotiation và encode/decode của wire_format (JSON, MessagePack, float32)"""
+import json
+
+import numpy as np
+import pytest
+from flask import Flask, request
+
+import wire_format
+from wire_format import FLOAT32, JSON, MSGPACK, columns, negotiate, read_body, respond, response_format
+
+AXIOS_ACCEPT = "application/json, text/plain, */*"
+
+MATRIX = np.asarray([
+    [0.7, 0.1, 0.05, 0.05, 0.04, 0.03, 0.03],
+    [0.1, 0.123456, 0.6, 0.05, 0.05, 0.05, 0.026544],
+], dtype=np.float32)
+
+
+@pytest.fixture(scope="module")
+def app():
+    return Flask(__name__)
+
+
+@pytest.fixture
+def no_msgpack(monkeypatch):
+    def missing():
+        raise wire_format.UnsupportedFormat("MessagePack cần package msgpack")
+
+    monkeypatch.setattr(wire_format, "_msgpack", missing)
+
+
+@pytest.mark.parametrize("accept, fmt", [
+    (None, JSON),
+    ("*/*", JSON),
+    (AXIOS_ACCEPT, JSON),
+    ("text/html", JSON),
+    ("application/x-float32", FLOAT32),
+    ("application/json;q=0.5, application/x-float32", FLOAT32),
+    ("application/msgpack", MSGPACK),
+    ("application/vnd.msgpack", MSGPACK),
+    ("application/x-float32;q=0.5, application/x-msgpack", MSGPACK),
+])
+def test_negotiate(app, accept, fmt):
+    headers = {"Accept": accept} if accept else {}
+    with app.test_request_context("/analyze", headers=headers):
+        assert negotiate(request.accept_mimetypes) == fmt
+
+
+def test_msgpack_without_package_is_406_but_json_still_works(app, no_msgpack):
+    with app.test_request_context("/analyze", headers={"Accept": "application/msgpack"}):
+        fmt, error = response_format(request)
+        assert fmt is None and error[1] == 406
+    with app.test_request_context("/analyze", headers={"Accept": AXIOS_ACCEPT}):
+        assert response_format(request) == (JSON, None)
+
+
+def test_read_body_json_and_msgpack(app):
+    msgpack = pytest.importorskip("msgpack")
+    body = {"texts": ["vui quá", "buồn"], "output": "items"}
+
+    with app.test_request_context("/analyze/batch", data=json.dumps(body), content_type="application/json"):
+        assert read_body(request) == (body, None)
+    with app.test_request_context("/analyze/batch", data=msgpack.packb(body), content_type="application/msgpack"):
+        assert read_body(request) == (body, None)
+
+
+def test_read_body_errors(app, no_msgpack):
+    with app.test_request_context("/analyze/batch", data=b"\xc1", content_type="application/msgpack"):
+        data, error = read_body(request)
+        assert data is None and error[1] == 415
+
+
+def test_read_body_rejects_garbled_msgpack(app):
+    pytest.importorskip("msgpack")
+    with app.test_request_context("/analyze/batch", data=b"\xc1", content_type="application/msgpack"):
+        data, error = read_body(request)
+        assert data is None and error[1] == 400
+
+
+def test_json_response_rounds_and_keeps_rows(app):
+    with app.test_request_context("/analyze/batch"):
+        response, status = respond({"count": np.int64(2), **columns(MATRIX)}, MATRIX)
+
+    body = response.get_json()
+    assert status == 200 and response.mimetype == JSON
+    assert body["count"] == 2
+    assert body["emotion_class"] == [0, 2]
+    assert body["confidence"] == [0.7, 0.6]
+    assert body["scores"][1] == [0.1, 0.1235, 0.6, 0.05, 0.05, 0.05, 0.0265]
+
+
+def test_msgpack_response_round_trips_float32(app):
+    msgpack = pytest.importorskip("msgpack")
+    with app.test_request_context("/analyze/batch"):
+        response = respond({"count": 2, **columns(MATRIX)}, MATRIX, MSGPACK)
+
+    assert response.mimetype == MSGPACK
+    body = msgpack.unpackb(response.get_data(), raw=False)
+    assert body["count"] == 2
+    assert np.frombuffer(body["emotion_class"], dtype="u1").tolist() == [0, 2]
+    np.testing.assert_array_equal(np.frombuffer(body["confidence"], dtype="<f4"), MATRIX.max(axis=1))
+    np.testing.assert_array_equal(np.frombuffer(body["scores"], dtype="<f4").reshape(-1, 7), MATRIX)
+
+
+def test_float32_response_round_trips_with_shape(app):
+    with app.test_request_context("/analyze/batch"):
+        response = respond({}, MATRIX.astype(np.float64), FLOAT32, status=207)
+
+    assert response.status_code == 207 and response.mimetype == FLOAT32
+    assert response.headers["X-Shape"] == "2,7"
+    assert response.headers["X-Emotion-Labels"].split(",")[0] == "enjoyment"
+    rows, width = map(int, response.headers["X-Shape"].split(","))
+    decoded = np.frombuffer(response.get_data(), dtype="<f4").reshape(rows, width)
+    np.testing.assert_array_equal(decoded, MATRIX)
+
+
+def test_float32_response_of_single_vector(app):
+    with app.test_request_context("/analyze"):
+        response = respond({}, MATRIX[0], FLOAT32)
+
+    assert response.headers["X-Shape"] == "1,7"
+    assert len(response.get_data()) == 7 * 4
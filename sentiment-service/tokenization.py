@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Tokenization Stage cho local model
+Dùng fast tokenizer (Rust) khi qua được parity check, và chia batch theo độ dài token để giảm padding
+"""
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence
+
+from transformers import AutoTokenizer
+
+
+logger = logging.getLogger(__name__)
+
+
+# Các câu dùng để so sánh fast và slow tokenizer lúc khởi động
+PARITY_TEXTS = [
+    "Món này ngon quá! Tôi rất thích",
+    "Buồn quá, tôi thất vọng lắm",
+    "Tôi rất tức giận về việc này 😡😡",
+    "Sợ quá, không dám làm...",
+    "Ghê tởm, kinh khủng!!!",
+    "Ủa thiệt hả trời?? bất ngờ ghê 😮",
+    "ok",
+    "haha 😂 vl thật sự luôn ae ơi",
+    "Xem ở đây nè https://example.com/bai-viet?id=123",
+    "Đường Nguyễn Huệ, Q.1, TP.HCM – hôm nay kẹt xe từ 7h đến 9h.",
+    "  khoảng   trắng   thừa  ",
+    "ĐỌC IN HOA CÓ DẤU: Ừ, ỪM, ỐI GIỜI ƠI",
+]
+
+# Ranh giới bucket theo số token, batch không trộn text của hai bucket khác nhau
+DEFAULT_BUCKET_BOUNDARIES = (16, 32, 64, 128, 256)
+
+
+class TokenizationStage:
+    """Tokenize, chia bucket theo độ dài và pad từng batch con"""
+
+    def __init__(
+        self,
+        tokenizer,
+        max_length: int = 256,
+        bucket_boundaries: Sequence[int] = DEFAULT_BUCKET_BOUNDARIES,
+    ):
+        """
+        Initialize Tokenization Stage
+
+        Args:
+            tokenizer: Tokenizer đã load (fast hoặc slow)
+            max_length: Số token tối đa, text dài hơn bị truncate
+            bucket_boundaries: Ranh giới bucket theo số token
+        """
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.bucket_boundaries = sorted(b for b in bucket_boundaries if b < max_length) + [max_length]
+
+        self._lock = threading.Lock()
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.batches = 0
+
+    @classmethod
+    def load(cls, model_id: str, mode: str = "auto", max_length: int = 256, **kwargs) -> "TokenizationStage":
+        """
+        Load tokenizer theo mode
+
+        Args:
+            model_id: Model id hoặc thư mục local
+            mode: "auto" (fast nếu qua parity check), "fast" hoặc "slow"
+            **kwargs: Tham số thêm cho from_pretrained
+        """
+        if mode == "slow":
+            return cls(AutoTokenizer.from_pretrained(model_id, use_fast=False, **kwargs), max_length)
+
+        try:
+            fast_tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=True, **kwargs)
+        except Exception as e:
+            if mode == "fast":
+                raise
+            logger.warning("Fast tokenizer failed to load, using slow tokenizer: %s", e)
+            return cls(AutoTokenizer.from_pretrained(model_id, use_fast=False, **kwargs), max_length)
+
+        if not getattr(fast_tokenizer, "is_fast", False) or mode == "fast":
+            return cls(fast_tokenizer, max_length)
+
+        slow_tokenizer = AutoTokenizer.from_pretrained(model_id, use_fast=False, **kwargs)
+        mismatches = cls.parity_mismatches(fast_tokenizer, slow_tokenizer, max_length)
+        if mismatches:
+            logger.warning("Fast tokenizer failed parity check on %d texts, using slow tokenizer", len(mismatches))
+            return cls(slow_tokenizer, max_length)
+
+        logger.info("Fast tokenizer passed parity check")
+        return cls(fast_tokenizer, max_length)
+
+    @staticmethod
+    def parity_mismatches(fast_tokenizer, slow_tokenizer, max_length: int = 256) -> List[str]:
+        """Trả về các câu mà fast và slow tokenizer cho ra input_ids khác nhau"""
+        fast_ids = fast_tokenizer(PARITY_TEXTS, truncation=True, max_length=max_length)["input_ids"]
+        slow_ids = slow_tokenizer(PARITY_TEXTS, truncation=True, max_length=max_length)["input_ids"]
+        return [text for text, a, b in zip(PARITY_TEXTS, fast_ids, slow_ids) if a != b]
+
+    @property
+    def is_fast(self) -> bool:
+        return bool(getattr(self.tokenizer, "is_fast", False))
+
+    def encode(self, texts: List[str]) -> List[Dict[str, List[int]]]:
+        """Tokenize không padding, trả về encoding riêng cho từng text"""
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_length)
+        keys = list(encoded.keys())
+        return [{key: encoded[key][i] for key in keys} for i in range(len(texts))]
+
+    @property
+    def content_budget(self) -> int:
+        """Số token nội dung tối đa model nhận được (max_length trừ special tokens)"""
+        return self.max_length - self.tokenizer.num_special_tokens_to_add()
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Số token nội dung của từng text, không truncate và không tính special tokens"""
+        if not texts:
+            return []
+        encoded = self.tokenizer(texts, add_special_tokens=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def bucket_of(self, length: int) -> int:
+        """Index của bucket chứa độ dài token"""
+        for i, boundary in enumerate(self.bucket_boundaries):
+            if length <= boundary:
+                return i
+        return len(self.bucket_boundaries) - 1
+
+    def plan_batches(self, encodings: List[Dict[str, List[int]]], max_batch_size: int, max_tokens: int = 0) -> List[List[int]]:
+        """
+        Sắp xếp text theo độ dài token và chia thành các batch con
+
+        Args:
+            max_tokens: Số token tối đa mỗi batch con sau padding (0 = không giới hạn),
+                giới hạn bộ nhớ activation của forward pass khi batch toàn text dài
+
+        Returns:
+            List các list index (theo thứ tự của encodings) cho từng batch con
+        """
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i]["input_ids"]))
+
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_bucket: Optional[int] = None
+        for i in order:
+            length = len(encodings[i]["input_ids"])
+            bucket = self.bucket_of(length)
+            # Text đã sắp theo độ dài nên text mới là text dài nhất, batch được pad tới độ dài của nó
+            over_tokens = max_tokens > 0 and (len(current) + 1) * length > max_tokens
+            if current and (bucket != current_bucket or len(current) >= max_batch_size or over_tokens):
+                batches.append(current)
+                current = []
+            current.append(i)
+            current_bucket = bucket
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def pad(self, encodings: List[Dict[str, List[int]]]):
+        """Pad một batch con thành tensors và ghi nhận padding efficiency"""
+        inputs = self.tokenizer.pad(encodings, padding=True, return_tensors="pt")
+
+        real = sum(len(encoding["input_ids"]) for encoding in encodings)
+        padded = int(inputs["input_ids"].numel())
+        with self._lock:
+            self.real_tokens += real
+            self.padded_tokens += padded
+            self.batches += 1
+
+        return inputs
+
+    def synthetic_batch(self, batch_size: int, length: int):
+        """Batch tensors (batch_size, length) từ một token lặp lại cho warm-up, không tính vào padding stats"""
+        filler = self.tokenizer.convert_tokens_to_ids(self.tokenizer.unk_token) if self.tokenizer.unk_token else 0
+        ids = self.tokenizer.build_inputs_with_special_tokens([filler] * max(length - self.tokenizer.num_special_tokens_to_add(), 1))
+        return self.tokenizer.pad([{"input_ids": ids} for _ in range(batch_size)], return_tensors="pt")
+
+    def stats(self) -> Dict:
+        """Thống kê tokenizer và tỉ lệ token thật / token sau padding"""
+        with self._lock:
+            return {
+                "tokenizer": "fast" if self.is_fast else "slow",
+                "max_length": self.max_length,
+                "bucket_boundaries": self.bucket_boundaries,
+                "batches": self.batches,
+                "real_tokens": self.real_tokens,
+                "padded_tokens": self.padded_tokens,
+                "padding_efficiency": round(self.real_tokens / self.padded_tokens, 4) if self.padded_tokens else 1.0,
+            }
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming sentiment cho transcript cuộc gọi
+Giữ aggregate rolling theo speaker và theo cuộc gọi, cập nhật O(1) cho mỗi segment mới
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from aggregation import NUM_EMOTIONS, summarize
+
+
+class RollingEmotion:
+    """
+    Aggregate recency tăng dần: tương đương aggregate(matrix, "recency", half_life)
+    trên toàn bộ segments nhưng không cần giữ lại lịch sử
+    """
+
+    def __init__(self, half_life: float = 8.0):
+        self.decay = 0.5 ** (1.0 / max(half_life, 1e-6))
+        self._weighted = np.zeros(NUM_EMOTIONS, dtype=np.float64)
+        self._weight = 0.0
+        self.count = 0
+
+    def update(self, scores) -> np.ndarray:
+        """Thêm scores (7,) của segment mới, trả về vector rolling hiện tại"""
+        self._weighted = self._weighted * self.decay + np.asarray(scores, dtype=np.float64)
+        self._weight = self._weight * self.decay + 1.0
+        self.count += 1
+        return self.value()
+
+    def value(self) -> np.ndarray:
+        if self._weight == 0:
+            return self._weighted
+        return self._weighted / self._weight
+
+    def summary(self) -> Dict:
+        result = summarize(self.value())
+        result["segments"] = self.count
+        return result
+
+
+class CallStream:
+    """Trạng thái của một cuộc gọi: rolling aggregate theo từng speaker và cho cả cuộc gọi"""
+
+    def __init__(self, call_id: str, half_life: float = 8.0):
+        self.call_id = call_id
+        self.half_life = half_life
+        self.call = RollingEmotion(half_life)
+        self.speakers: Dict[str, RollingEmotion] = {}
+        self.last_seen = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_segment(self, speaker: Optional[str], scores: List[float]) -> Dict:
+        """Cập nhật aggregate với segment mới, trả về rolling của speaker và của cuộc gọi"""
+        speaker = str(speaker) if speaker is not None else "unknown"
+        with self._lock:
+            self.last_seen = time.monotonic()
+            rolling = self.speakers.get(speaker)
+            if rolling is None:
+                rolling = self.speakers[speaker] = RollingEmotion(self.half_life)
+            rolling.update(scores)
+            self.call.update(scores)
+            return {
+                "speaker_rolling": rolling.summary(),
+                "call_rolling": self.call.summary(),
+            }
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                "call_id": self.call_id,
+                "call": self.call.summary(),
+                "speakers": {speaker: rolling.summary() for speaker, rolling in self.speakers.items()},
+            }
+
+
+class CallStreamRegistry:
+    """Các cuộc gọi đang hoạt động trong process, cuộc gọi không có segment mới quá idle_timeout bị xóa"""
+
+    def __init__(self, half_life: float = 8.0, idle_timeout: float = 900.0):
+        self.half_life = half_life
+        self.idle_timeout = idle_timeout
+        self._calls: Dict[str, CallStream] = {}
+        self._lock = threading.Lock()
+
+    def get(self, call_id: str, half_life: Optional[float] = None) -> CallStream:
+        """Lấy hoặc tạo trạng thái cho call_id (stream kết nối lại tiếp tục aggregate cũ)"""
+        with self._lock:
+            self._expire()
+            stream = self._calls.get(call_id)
+            if stream is None:
+                stream = self._calls[call_id] = CallStream(call_id, half_life or self.half_life)
+            return stream
+
+    def end(self, call_id: str) -> Optional[CallStream]:
+        """Kết thúc cuộc gọi, trả về trạng thái cuối cùng"""
+        with self._lock:
+            return self._calls.pop(call_id, None)
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for call_id in [call_id for call_id, stream in self._calls.items() if stream.last_seen < cutoff]:
+            del self._calls[call_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"active_calls": len(self._calls)}
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Định dạng request/response gọn cho traffic batch lớn (backfill, job, service nội bộ)
+Content negotiation theo Accept: JSON (mặc định cho Node client), MessagePack hoặc mảng float32 little-endian thô.
+Kết quả từng text ở dạng cột: class id (uint8), confidence (float32) và buffer scores phẳng N x 7 (float32)
+"""
+import json
+from typing import Dict, Optional
+
+import numpy as np
+from flask import Response, jsonify
+
+from aggregation import EMOTION_LABELS, NUM_EMOTIONS
+
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FLOAT32 = "application/x-float32"
+
+# Thứ tự ưu tiên khi Accept là */* hoặc ngang nhau: JSON trước để client cũ không bị ảnh hưởng
+FORMATS = (JSON, MSGPACK, "application/x-msgpack", "application/vnd.msgpack", FLOAT32)
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+
+# Dtype cố định little-endian để client không phụ thuộc endianness của server
+CLASS_DTYPE = np.dtype("u1")
+FLOAT_DTYPE = np.dtype("<f4")
+
+
+class UnsupportedFormat(ValueError):
+    """Format không hỗ trợ hoặc thiếu thư viện (msgpack)"""
+
+
+def _msgpack():
+    try:
+        import msgpack  # Optional dependency
+    except ImportError:
+        raise UnsupportedFormat("MessagePack cần package msgpack") from None
+    return msgpack
+
+
+def msgpack_available() -> bool:
+    try:
+        _msgpack()
+    except UnsupportedFormat:
+        return False
+    return True
+
+
+def negotiate(accept_mimetypes) -> Optional[str]:
+    """
+    Format response theo header Accept (werkzeug MIMEAccept)
+
+    Returns:
+        JSON, MSGPACK hoặc FLOAT32 (JSON nếu Accept không khớp format nào); None nếu client chọn MessagePack
+        nhưng server thiếu msgpack
+    """
+    match = accept_mimetypes.best_match(FORMATS, default=JSON)
+    if match in MSGPACK_TYPES:
+        return MSGPACK if msgpack_available() else None
+    return match
+
+
+def decode_body(mimetype: str, data: bytes) -> Optional[Dict]:
+    """Body MessagePack hoặc JSON theo Content-Type, None nếu body rỗng"""
+    if not data:
+        return None
+    if mimetype in MSGPACK_TYPES:
+        return _msgpack().unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def columns(matrix: np.ndarray) -> Dict[str, np.ndarray]:
+    """Ma trận scores (N, 7) thành các cột class id, confidence và scores"""
+    matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, NUM_EMOTIONS)
+    return {
+        "emotion_class": matrix.argmax(axis=1).astype(CLASS_DTYPE),
+        "confidence": matrix.max(axis=1),
+        "scores": matrix,
+    }
+
+
+def to_jsonable(payload: Dict) -> Dict:
+    """numpy array thành list (float làm tròn 4 chữ số như các response JSON khác, scores giữ dạng hàng)"""
+    result = {}
+    for key, value in payload.items():
+        if isinstance(value, np.ndarray):
+            if value.dtype.kind == "f":
+                value = value.astype(np.float64).round(4)
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        result[key] = value
+    return result
+
+
+def to_msgpack(payload: Dict) -> bytes:
+    """numpy array thành bytes (class id uint8, float little-endian float32), giữ nguyên độ chính xác float32"""
+    packable = {}
+    for key, value in payload.items():
+        if isinstance(value, np.ndarray):
+            dtype = FLOAT_DTYPE if value.dtype.kind == "f" else value.dtype.newbyteorder("<")
+            value = np.ascontiguousarray(value, dtype=dtype).tobytes()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        packable[key] = value
+    return _msgpack().packb(packable, use_bin_type=True)
+
+
+def to_float32(matrix: np.ndarray) -> bytes:
+    """Buffer float32 little-endian thô của ma trận scores, hàng i là scores[i * 7:(i + 1) * 7]"""
+    return np.ascontiguousarray(matrix, dtype=FLOAT_DTYPE).tobytes()
+
+
+def float32_headers(matrix: np.ndarray) -> Dict[str, str]:
+    """Shape và nhãn cột cho response float32 (body không mang metadata)"""
+    return {
+        "X-Shape": f"{matrix.shape[0]},{NUM_EMOTIONS}",
+        "X-Emotion-Labels": ",".join(EMOTION_LABELS),
+    }
+
+
+def read_body(request):
+    """
+    Body của Flask request: MessagePack nếu Content-Type là msgpack, ngược lại JSON như trước
+
+    Returns:
+        (data, error_response), error_response là 415 khi thiếu msgpack và 400 khi body hỏng
+    """
+    if request.mimetype not in MSGPACK_TYPES:
+        return request.get_json(), None
+    try:
+        return decode_body(request.mimetype, request.get_data()), None
+    except UnsupportedFormat as e:
+        return None, (jsonify({"error": str(e)}), 415)
+    except Exception as e:
+        return None, (jsonify({"error": f"Invalid MessagePack body: {e!r}"}), 400)
+
+
+def response_format(request):
+    """Format response của Flask request, trả về (format, error_response) với 406 nếu không đáp ứng được Accept"""
+    fmt = negotiate(request.accept_mimetypes)
+    if fmt is None:
+        return None, (jsonify({"error": "MessagePack responses need the msgpack package; accept application/json or application/x-float32"}), 406)
+    return fmt, None
+
+
+def respond(payload: Dict, matrix: np.ndarray, fmt: str = JSON, status: int = 200):
+    """
+    Response theo format đã chọn
+
+    Args:
+        payload: Dict kết quả, có thể chứa numpy array
+        matrix: Ma trận scores (N, 7) làm body của format float32
+    """
+    if fmt == MSGPACK:
+        return Response(to_msgpack(payload), status, mimetype=MSGPACK)
+    if fmt == FLOAT32:
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, NUM_EMOTIONS)
+        return Response(to_float32(matrix), status, mimetype=FLOAT32, headers=float32_headers(matrix))
+    return jsonify(to_jsonable(payload)), status
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+WSGI entry point cho production (gunicorn -c gunicorn.conf.py wsgi:app)
+Model được load xong trong master process trước khi fork, các workers dùng chung weights (copy-on-write)
+
+gc.freeze() đưa mọi object đã tạo lúc load vào permanent generation: GC của worker không ghi vào header
+các object đó nữa nên các trang bộ nhớ của master không bị copy sang từng worker
+"""
+import gc
+
+import api_service
+
+api_service.wait_until_ready()
+
+gc.collect()
+gc.freeze()
+
+app = api_service.app
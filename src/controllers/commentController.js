@@ -88,9 +88,11 @@ const createComment = async (req, res, next) => {
 
       // Update stored sentiment analysis with actual comment ID (async, don't wait)
       if (sentimentResult) {
-         sentimentService.analyzeSentiment(content, userId, comment.id, 'comment').catch((error) => {
-            console.error('Error updating comment sentiment with entity ID:', error);
-         });
+         sentimentService
+            .analyzeSentiment(content, userId, comment.id, 'comment', { priority: 'background' })
+            .catch((error) => {
+               console.error('Error updating comment sentiment with entity ID:', error);
+            });
       }
 
       // Create notification for post author (if not commenting on own post)
@@ -359,7 +361,7 @@ const updateComment = async (req, res, next) => {
       });
 
       // Re-analyze sentiment
-      sentimentService.analyzeSentiment(content, userId, id, 'comment').catch((error) => {
+      sentimentService.analyzeSentiment(content, userId, id, 'comment', { priority: 'background' }).catch((error) => {
          console.error('Error re-analyzing comment sentiment:', error);
       });
 
@@ -658,9 +658,14 @@ const sendMessage = async (req, res, next) => {
 
       // Update stored sentiment analysis with actual message ID (async, don't wait)
       if (sentimentResult) {
-         sentimentService.analyzeSentiment(content.trim(), senderId, message.id, 'message').catch((error) => {
-            console.error('Error updating message sentiment with entity ID:', error);
-         });
+         sentimentService
+            .analyzeSentiment(content.trim(), senderId, message.id, 'message', {
+               priority: 'background',
+               conversationId,
+            })
+            .catch((error) => {
+               console.error('Error updating message sentiment with entity ID:', error);
+            });
       }
 
       // Update conversation's updatedAt
@@ -99,9 +99,11 @@ const createPost = async (req, res, next) => {
 
       // Update stored sentiment analysis with actual post ID (async, don't wait)
       if (sentimentResult && content && content.trim()) {
-         sentimentService.analyzeSentiment(content, userId, post.id, 'post').catch((error) => {
-            console.error('Error updating post sentiment with entity ID:', error);
-         });
+         sentimentService
+            .analyzeSentiment(content, userId, post.id, 'post', { priority: 'background' })
+            .catch((error) => {
+               console.error('Error updating post sentiment with entity ID:', error);
+            });
       }
 
       // Emit to Socket.IO for real-time updates
@@ -384,7 +386,7 @@ const updatePost = async (req, res, next) => {
 
       // Re-analyze sentiment if content changed
       if (content && content !== existingPost.content && content.trim()) {
-         sentimentService.analyzeSentiment(content, userId, id, 'post').catch((error) => {
+         sentimentService.analyzeSentiment(content, userId, id, 'post', { priority: 'background' }).catch((error) => {
             console.error('Error re-analyzing post sentiment:', error);
          });
       }
@@ -4,8 +4,61 @@ const prisma = require('../config/database');
 class SentimentService {
    constructor() {
       this.serviceUrl = process.env.SENTIMENT_SERVICE_URL || 'http://localhost:8000';
+      // Shared with the service; without it the service scores texts but does not record rollups
+      this.adminToken = process.env.SENTIMENT_ADMIN_TOKEN || '';
       this.maxRetries = 3;
       this.retryDelay = 1000; // 1 second
+      // Total time budget per call (all attempts included), sent to the service as a deadline
+      this.interactiveTimeout = 10000;
+      this.backgroundTimeout = 30000;
+   }
+
+   /**
+    * POST to the sentiment service with one deadline shared by all attempts.
+    * Honors Retry-After on 429/503 and gives up once the deadline has passed.
+    */
+   async _postWithDeadline(path, body, { priority, timeoutMs } = {}) {
+      const deadline = Date.now() + timeoutMs;
+      const headers = {
+         'Content-Type': 'application/json',
+         'X-Request-Deadline': String(deadline),
+      };
+      if (priority) {
+         headers['X-Priority'] = priority;
+      }
+      if (this.adminToken) {
+         headers['X-Admin-Token'] = this.adminToken;
+      }
+
+      let lastError;
+      for (let attempt = 1; attempt <= this.maxRetries; attempt++) {
+         const remaining = deadline - Date.now();
+         if (remaining <= 0) {
+            break;
+         }
+
+         try {
+            return await axios.post(`${this.serviceUrl}${path}`, body, { timeout: remaining, headers });
+         } catch (error) {
+            lastError = error;
+            console.error(`Sentiment request ${path} attempt ${attempt} failed:`, error.message);
+
+            const status = error.response?.status;
+            if (status === 504 || (status >= 400 && status < 500 && status !== 429)) {
+               // Deadline already passed on the service, or the request itself is invalid
+               break;
+            }
+
+            const retryAfter = Number(error.response?.headers?.['retry-after']);
+            const delay = Number.isFinite(retryAfter) ? retryAfter * 1000 : this.retryDelay * attempt;
+            if (attempt >= this.maxRetries || Date.now() + delay >= deadline) {
+               break;
+            }
+            await this._sleep(delay);
+         }
+      }
+
+      throw lastError || new Error(`Sentiment request ${path} deadline exceeded`);
    }
 
    /**
@@ -25,97 +78,88 @@ class SentimentService {
 
    /**
     * Analyze sentiment of a single text
+    * @param {Object} options - { priority: 'interactive' | 'background', timeoutMs, conversationId }
     */
-   async analyzeSentiment(text, userId = null, entityId = null, entityType = null) {
+   async analyzeSentiment(text, userId = null, entityId = null, entityType = null, options = {}) {
       if (!text || typeof text !== 'string' || text.trim().length === 0) {
          return this._getDefaultSentiment();
       }
 
-      let lastError;
-      for (let attempt = 1; attempt <= this.maxRetries; attempt++) {
-         try {
-            const response = await axios.post(
-               `${this.serviceUrl}/analyze`,
-               {
-                  text: text.trim(),
-                  user_id: userId,
-                  entity_id: entityId,
-                  entity_type: entityType,
-               },
-               {
-                  timeout: 10000,
-                  headers: {
-                     'Content-Type': 'application/json',
-                  },
-               }
-            );
+      const priority = options.priority || 'interactive';
+      const timeoutMs =
+         options.timeoutMs || (priority === 'background' ? this.backgroundTimeout : this.interactiveTimeout);
 
-            // Map emotion class index to emotion name
-            const emotionMap = {
-               0: 'ENJOYMENT',
-               1: 'SADNESS',
-               2: 'ANGER',
-               3: 'FEAR',
-               4: 'DISGUST',
-               5: 'SURPRISE',
-               6: 'OTHER',
-            };
-
-            // Get emotion from class index
-            const emotionClass = response.data.emotion_class;
-            const emotion = emotionMap[emotionClass] || 'OTHER';
-
-            // Map scores to emotion names
-            const scores = {
-               ENJOYMENT: response.data.scores[0],
-               SADNESS: response.data.scores[1],
-               ANGER: response.data.scores[2],
-               FEAR: response.data.scores[3],
-               DISGUST: response.data.scores[4],
-               SURPRISE: response.data.scores[5],
-               OTHER: response.data.scores[6],
-            };
-
-            const result = {
-               emotion: emotion,
-               emotionClass: emotionClass,
-               confidence: response.data.confidence,
-               scores: scores,
-               processingTime: response.data.processing_time,
-            };
-
-            // Store sentiment analysis in database if entityId is provided
-            if (userId && entityId && entityType) {
-               await this._storeSentimentAnalysis(
-                  text,
-                  result.emotion,
-                  result.confidence,
-                  userId,
-                  entityId,
-                  entityType
-               );
-            }
+      try {
+         const response = await this._postWithDeadline(
+            '/analyze',
+            {
+               text: text.trim(),
+               user_id: userId,
+               entity_id: entityId,
+               entity_type: entityType,
+               conversation_id: options.conversationId || null,
+            },
+            { priority, timeoutMs }
+         );
+
+         // Map emotion class index to emotion name
+         const emotionMap = {
+            0: 'ENJOYMENT',
+            1: 'SADNESS',
+            2: 'ANGER',
+            3: 'FEAR',
+            4: 'DISGUST',
+            5: 'SURPRISE',
+            6: 'OTHER',
+         };
 
-            return result;
-         } catch (error) {
-            lastError = error;
-            console.error(`Sentiment analysis attempt ${attempt} failed:`, error.message);
+         // Get emotion from class index
+         const emotionClass = response.data.emotion_class;
+         const emotion = emotionMap[emotionClass] || 'OTHER';
+
+         // Map scores to emotion names
+         const scores = {
+            ENJOYMENT: response.data.scores[0],
+            SADNESS: response.data.scores[1],
+            ANGER: response.data.scores[2],
+            FEAR: response.data.scores[3],
+            DISGUST: response.data.scores[4],
+            SURPRISE: response.data.scores[5],
+            OTHER: response.data.scores[6],
+         };
 
-            if (attempt < this.maxRetries) {
-               await this._sleep(this.retryDelay * attempt);
-            }
+         const result = {
+            emotion: emotion,
+            emotionClass: emotionClass,
+            confidence: response.data.confidence,
+            scores: scores,
+            processingTime: response.data.processing_time,
+         };
+
+         // Store sentiment analysis in database if entityId is provided
+         if (userId && entityId && entityType) {
+            await this._storeSentimentAnalysis(
+               text,
+               result.emotion,
+               result.confidence,
+               userId,
+               entityId,
+               entityType
+            );
          }
-      }
 
-      console.error('All sentiment analysis attempts failed:', lastError.message);
-      return this._getDefaultSentiment();
+         return result;
+      } catch (error) {
+         console.error('All sentiment analysis attempts failed:', error.message);
+         return this._getDefaultSentiment();
+      }
    }
 
    /**
     * Analyze sentiment of multiple texts and return a single aggregated sentiment
     * This is useful for analyzing a conversation and getting the overall sentiment
     */
-   async analyzeBatchSentiment(texts, userId = null) {
+   async analyzeBatchSentiment(texts, userId = null, options = {}) {
       if (!Array.isArray(texts) || texts.length === 0) {
          return this._getDefaultSentiment();
       }
@@ -127,71 +171,109 @@ class SentimentService {
          return this._getDefaultSentiment();
       }
 
-      let lastError;
-      for (let attempt = 1; attempt <= this.maxRetries; attempt++) {
-         try {
-            const response = await axios.post(
-               `${this.serviceUrl}/analyze/batch`,
-               {
-                  texts: validTexts,
-                  user_id: userId,
-               },
-               {
-                  timeout: 30000,
-                  headers: {
-                     'Content-Type': 'application/json',
-                  },
-               }
-            );
+      try {
+         const response = await this._postWithDeadline(
+            '/analyze/batch',
+            {
+               texts: validTexts,
+               user_id: userId,
+            },
+            { priority: options.priority, timeoutMs: options.timeoutMs || this.backgroundTimeout }
+         );
+
+         // Map emotion class index to emotion name
+         const emotionMap = {
+            0: 'ENJOYMENT',
+            1: 'SADNESS',
+            2: 'ANGER',
+            3: 'FEAR',
+            4: 'DISGUST',
+            5: 'SURPRISE',
+            6: 'OTHER',
+         };
 
-            // Map emotion class index to emotion name
-            const emotionMap = {
-               0: 'ENJOYMENT',
-               1: 'SADNESS',
-               2: 'ANGER',
-               3: 'FEAR',
-               4: 'DISGUST',
-               5: 'SURPRISE',
-               6: 'OTHER',
-            };
-
-            const emotionClass = response.data.emotion_class;
-            const emotion = emotionMap[emotionClass] || 'OTHER';
-
-            return {
-               emotion: emotion,
-               emotionClass: emotionClass,
-               confidence: response.data.confidence,
-               scores: {
-                  ENJOYMENT: response.data.scores[0],
-                  SADNESS: response.data.scores[1],
-                  ANGER: response.data.scores[2],
-                  FEAR: response.data.scores[3],
-                  DISGUST: response.data.scores[4],
-                  SURPRISE: response.data.scores[5],
-                  OTHER: response.data.scores[6],
-               },
-               textsAnalyzed: response.data.texts_analyzed,
-               processingTime: response.data.processing_time,
-            };
-         } catch (error) {
-            lastError = error;
-            console.error(`Batch sentiment analysis attempt ${attempt} failed:`, error.message);
+         const emotionClass = response.data.emotion_class;
+         const emotion = emotionMap[emotionClass] || 'OTHER';
 
-            if (attempt < this.maxRetries) {
-               await this._sleep(this.retryDelay * attempt);
-            }
-         }
+         return {
+            emotion: emotion,
+            emotionClass: emotionClass,
+            confidence: response.data.confidence,
+            scores: {
+               ENJOYMENT: response.data.scores[0],
+               SADNESS: response.data.scores[1],
+               ANGER: response.data.scores[2],
+               FEAR: response.data.scores[3],
+               DISGUST: response.data.scores[4],
+               SURPRISE: response.data.scores[5],
+               OTHER: response.data.scores[6],
+            },
+            textsAnalyzed: response.data.texts_analyzed,
+            processingTime: response.data.processing_time,
+         };
+      } catch (error) {
+         console.error('All batch sentiment analysis attempts failed:', error.message);
+         return this._getDefaultSentiment();
       }
+   }
+
+   /**
+    * Submit a large batch as an asynchronous job
+    * Returns the job (with jobId) right away; poll getBatchJob or pass callbackUrl
+    */
+   async submitBatchJob(texts, { aggregation = 'mean', callbackUrl, metadata } = {}) {
+      const response = await this._postWithDeadline(
+         '/jobs',
+         {
+            texts,
+            aggregation,
+            callback_url: callbackUrl,
+            metadata,
+         },
+         { timeoutMs: this.backgroundTimeout }
+      );
+      return { ...response.data, jobId: response.data.job_id };
+   }
 
-      console.error('All batch sentiment analysis attempts failed:', lastError.message);
-      return this._getDefaultSentiment();
+   /**
+    * Get job status and result; with items=true also per-text results (paged)
+    */
+   async getBatchJob(jobId, { items = false, offset = 0, limit = 100 } = {}) {
+      const response = await axios.get(`${this.serviceUrl}/jobs/${encodeURIComponent(jobId)}`, {
+         params: items ? { items: true, offset, limit } : {},
+         timeout: 5000,
+      });
+      return response.data;
+   }
+
+   /**
+    * Cancel a queued or running job; results computed so far are kept
+    */
+   async cancelBatchJob(jobId) {
+      const response = await axios.delete(`${this.serviceUrl}/jobs/${encodeURIComponent(jobId)}`, {
+         timeout: 5000,
+         validateStatus: (status) => status === 200 || status === 409,
+      });
+      return response.data;
    }
 
    /**
     * Get sentiment statistics for a user
+    * With SENTIMENT_ROLLUPS=true the counts come from the service's incremental rollups,
+    * falling back to the sentiment_analysis table if the service is unavailable
     */
    async getUserSentimentStats(userId, days = 30) {
+      if (process.env.SENTIMENT_ROLLUPS === 'true') {
+         const rollup = await this._getRollup('users', userId, { days, granularity: 'total' });
+         if (rollup) {
+            const counts = {};
+            Object.entries(rollup.counts).forEach(([label, count]) => {
+               counts[label.toUpperCase()] = count;
+            });
+            return this._buildStats(counts);
+         }
+      }
+
       try {
          const cutoffDate = new Date();
          cutoffDate.setDate(cutoffDate.getDate() - days);
@@ -209,64 +291,62 @@ class SentimentService {
             },
          });
 
-         const stats = {
-            ENJOYMENT: 0,
-            SADNESS: 0,
-            ANGER: 0,
-            FEAR: 0,
-            DISGUST: 0,
-            SURPRISE: 0,
-            OTHER: 0,
-            total: 0,
-         };
-
+         const counts = {};
          sentimentCounts.forEach((item) => {
-            stats[item.sentiment] = item._count.sentiment;
-            stats.total += item._count.sentiment;
+            counts[item.sentiment] = item._count.sentiment;
          });
 
-         // Calculate percentages
-         if (stats.total > 0) {
-            stats.enjoymentPercentage = (stats.ENJOYMENT / stats.total) * 100;
-            stats.sadnessPercentage = (stats.SADNESS / stats.total) * 100;
-            stats.angerPercentage = (stats.ANGER / stats.total) * 100;
-            stats.fearPercentage = (stats.FEAR / stats.total) * 100;
-            stats.disgustPercentage = (stats.DISGUST / stats.total) * 100;
-            stats.surprisePercentage = (stats.SURPRISE / stats.total) * 100;
-            stats.otherPercentage = (stats.OTHER / stats.total) * 100;
-         } else {
-            stats.enjoymentPercentage = 0;
-            stats.sadnessPercentage = 0;
-            stats.angerPercentage = 0;
-            stats.fearPercentage = 0;
-            stats.disgustPercentage = 0;
-            stats.surprisePercentage = 0;
-            stats.otherPercentage = 0;
-         }
-
-         return stats;
+         return this._buildStats(counts);
       } catch (error) {
          console.error('Error getting user sentiment stats:', error);
-         return {
-            ENJOYMENT: 0,
-            SADNESS: 0,
-            ANGER: 0,
-            FEAR: 0,
-            DISGUST: 0,
-            SURPRISE: 0,
-            OTHER: 0,
-            total: 0,
-            enjoymentPercentage: 0,
-            sadnessPercentage: 0,
-            angerPercentage: 0,
-            fearPercentage: 0,
-            disgustPercentage: 0,
-            surprisePercentage: 0,
-            otherPercentage: 0,
-         };
+         return this._buildStats({});
       }
    }
 
+   /**
+    * Fetch a per-user or per-conversation rollup; returns null if the service is unavailable
+    */
+   async _getRollup(scope, id, { days = 30, granularity = 'day', utcOffset = 0 } = {}) {
+      try {
+         const response = await axios.get(`${this.serviceUrl}/rollups/${scope}/${encodeURIComponent(id)}`, {
+            params: { days, granularity, utc_offset: utcOffset },
+            timeout: 5000,
+         });
+         return response.data;
+      } catch (error) {
+         console.error(`Error getting sentiment rollup for ${scope} ${id}:`, error.message);
+         return null;
+      }
+   }
+
+   /**
+    * Build the stats shape returned by getUserSentimentStats from per-emotion counts
+    */
+   _buildStats(counts) {
+      const stats = {
+         ENJOYMENT: 0,
+         SADNESS: 0,
+         ANGER: 0,
+         FEAR: 0,
+         DISGUST: 0,
+         SURPRISE: 0,
+         OTHER: 0,
+         total: 0,
+      };
+
+      Object.entries(counts).forEach(([emotion, count]) => {
+         stats[emotion] = count;
+         stats.total += count;
+      });
+
+      // Calculate percentages
+      ['ENJOYMENT', 'SADNESS', 'ANGER', 'FEAR', 'DISGUST', 'SURPRISE', 'OTHER'].forEach((emotion) => {
+         stats[`${emotion.toLowerCase()}Percentage`] = stats.total > 0 ? (stats[emotion] / stats.total) * 100 : 0;
+      });
+
+      return stats;
+   }
+
    /**
     * Get model information from sentiment service
     */